@@ -0,0 +1,79 @@
+r"""An in-process stand-in for an IPython context
+
+Jobs are executed by a pool of threads within the benchmarking process, so
+the cost of submission and of the Redis traffic of jobs is measured without
+the variability of an IPython cluster.
+"""
+
+# -----------------------------------------------------------------------------
+# Copyright (c) 2014--, The qiita Development Team.
+#
+# Distributed under the terms of the BSD 3-clause License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# -----------------------------------------------------------------------------
+
+from uuid import uuid4
+from multiprocessing.pool import ThreadPool
+
+
+class InProcessView(object):
+    """The subset of an IPython LoadBalancedView used by moi
+
+    Parameters
+    ----------
+    engines : int
+        The number of threads executing jobs
+    """
+    def __init__(self, engines):
+        self._pool = ThreadPool(engines)
+
+    def apply_async(self, f, *args, **kwargs):
+        """Execute a function
+
+        Returns
+        -------
+        multiprocessing.pool.AsyncResult
+            The result, which supports ``get``, ``wait`` and ``ready``, and
+            has ``msg_ids``, as an IPython AsyncResult does
+        """
+        ar = self._pool.apply_async(f, args, kwargs)
+        ar.msg_ids = [str(uuid4())]
+        return ar
+
+    def map_async(self, f, *sequences, **kwargs):
+        """Execute a function over the elements of sequences
+
+        Returns
+        -------
+        multiprocessing.pool.MapResult
+            The ordered results, with a message ID per element
+        """
+        sequences = list(zip(*sequences))
+        ar = self._pool.map_async(lambda args: f(*args), sequences)
+        ar.msg_ids = [str(uuid4()) for _ in sequences]
+        return ar
+
+    def close(self):
+        """Wait for the submitted jobs, and stop the threads"""
+        self._pool.close()
+        self._pool.join()
+
+
+class InProcessContext(object):
+    """A context which executes jobs in the current process
+
+    Parameters
+    ----------
+    name : str, optional
+        The name of the context, which is recorded in job info
+    engines : int, optional
+        The number of threads executing jobs
+    """
+    def __init__(self, name='benchmark', engines=4):
+        self.name = name
+        self.bv = InProcessView(engines)
+
+    def close(self):
+        """Wait for the submitted jobs, and stop the threads"""
+        self.bv.close()
@@ -0,0 +1,548 @@
+r"""Benchmarks of job submission, traversal and websocket fan-out
+
+The benchmarks run against the Redis server of the configuration pointed to
+by $MOI_CONFIG_FP, and jobs are executed in process by ``InProcessContext``.
+Every key written is removed once a benchmark completes, as are the counts
+of the job metrics histograms labelled by the context of the benchmarks,
+see ``moi.metrics``.
+
+Run all of the benchmarks, saving the results:
+
+    $ python -m benchmarks.run run --output before.json
+
+and compare two sets of results, exiting with a non-zero status if any
+metric regressed by more than the threshold:
+
+    $ python -m benchmarks.run compare before.json after.json
+"""
+
+# -----------------------------------------------------------------------------
+# Copyright (c) 2014--, The qiita Development Team.
+#
+# Distributed under the terms of the BSD 3-clause License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# -----------------------------------------------------------------------------
+
+import json
+import platform
+import subprocess
+from os.path import dirname
+from datetime import datetime
+from timeit import default_timer as timer
+from uuid import uuid4
+
+import click
+from tornado.ioloop import IOLoop
+
+import moi
+from moi import r_client, record
+from moi.group import Group, create_info, _add_children, _get_info_cache
+from moi.job import _submit, _submit_many, _status_change
+from moi.metrics import HISTOGRAMS, _metrics_key
+from moi.pubsub import get_subscriber
+from moi.websocket import MOIMessageHandler, UpdateBuffer, clients
+
+from benchmarks.context import InProcessContext
+
+
+# the suffixes of the keys a job or group may own
+_SUFFIXES = ('', ':children', ':created', ':ended', ':counts', ':result',
+             ':pubsub')
+
+# the channels the pub/sub connection has confirmed subscriptions to
+_confirmed = set()
+
+
+def _track_subscriptions(msg):
+    """Keep track of the confirmed subscriptions"""
+    kind, channel = msg[0], msg[1]
+    if kind == 'subscribe':
+        _confirmed.add(channel)
+    elif kind == 'unsubscribe':
+        _confirmed.discard(channel)
+
+
+class SimulatedClient(MOIMessageHandler):
+    """A websocket handler which records frames instead of sending them
+
+    Parameters
+    ----------
+    group_id : str
+        The ID of the group the client follows
+
+    Attributes
+    ----------
+    frames : int
+        The number of frames written
+    received : int
+        The number of job updates received
+    seen : dict of (str, str): float
+        The time each status of a job was first received
+    latest : dict of str: str
+        The latest status received of each job
+    """
+    flush_interval = 0
+
+    def __init__(self, group_id):
+        # the handler is not attached to a connection, so the initialization
+        # of the websocket is skipped
+        self._buffer = UpdateBuffer()
+        self._flush_scheduled = False
+        self.frames = 0
+        self.received = 0
+        self.seen = {}
+        self.latest = {}
+        self.group = Group(group_id, forwarder=self.forward)
+        clients.add(self)
+
+        # a dashboard requests the jobs of its group once opened, which
+        # subscribes to them
+        self.group.action('get', [])
+
+    def write_message(self, message, binary=False):
+        now = timer()
+        self.frames += 1
+
+        items = json.loads(message)
+        if isinstance(items, dict):
+            items = [items]
+
+        for item in items:
+            details = item.get('update')
+            if isinstance(details, dict) and 'status' in details:
+                self.received += 1
+                self.seen.setdefault((details['id'], details['status']), now)
+                self.latest[details['id']] = details['status']
+
+    def close(self):
+        self.on_close()
+
+
+def _noop(**kwargs):
+    """A job which does nothing"""
+    return None
+
+
+def _bench_id():
+    """Create the ID of a root group which is unique to a benchmark"""
+    return 'moi-benchmark-%s' % uuid4()
+
+
+def _build_tree(root, jobs, depth, width=4):
+    """Store a group of jobs, nested within groups
+
+    Parameters
+    ----------
+    root : str
+        The ID of the group
+    jobs : int
+        The number of jobs
+    depth : int
+        The number of levels of groups. The jobs are children of the root
+        group at a depth of 1.
+    width : int, optional
+        The number of groups within each group which is not at the lowest
+        level
+
+    Returns
+    -------
+    list of str
+        The IDs of the groups and jobs, starting with the root
+    """
+    ids = [root]
+    groups = [root]
+
+    with r_client.pipeline(transaction=False) as pipe:
+        record.store(create_info('benchmark', 'group', id=root), pipe)
+
+        for _ in range(depth - 1):
+            level = []
+            for group in groups:
+                for i in range(width):
+                    info = create_info('benchmark', 'group', parent=group)
+                    record.store(info, pipe)
+                    _add_children(pipe, group, [info['id']])
+                    level.append(info['id'])
+            ids.extend(level)
+            groups = level
+
+        for i in range(jobs):
+            group = groups[i % len(groups)]
+            info = create_info('benchmark-%d' % i, 'job', parent=group)
+            record.store(info, pipe)
+            _add_children(pipe, group, [info['id']])
+            ids.append(info['id'])
+
+        pipe.execute()
+
+    return ids
+
+
+def _cleanup(ids):
+    """Delete every key owned by jobs and groups"""
+    with r_client.pipeline(transaction=False) as pipe:
+        for id_ in ids:
+            pipe.delete(*[id_ + suffix for suffix in _SUFFIXES])
+        pipe.execute()
+
+
+def _cleanup_metrics(context):
+    """Delete the counts of the histograms labelled by a context"""
+    keys = [_metrics_key(name) for name in HISTOGRAMS]
+    with r_client.pipeline(transaction=False) as pipe:
+        for key in keys:
+            pipe.hkeys(key)
+        fields = pipe.execute()
+
+    with r_client.pipeline(transaction=False) as pipe:
+        for key, names in zip(keys, fields):
+            names = [name for name in names
+                     if name.rpartition(':')[0] == context]
+            if names:
+                pipe.hdel(key, *names)
+        pipe.execute()
+
+
+def _run_until(done, timeout=60):
+    """Run the IOLoop until a condition holds
+
+    Parameters
+    ----------
+    done : function
+        The condition, which is checked every millisecond
+    timeout : float, optional
+        The number of seconds to wait for the condition
+
+    Raises
+    ------
+    RuntimeError
+        If the condition does not hold within the timeout
+    """
+    io_loop = IOLoop.instance()
+    deadline = timer() + timeout
+
+    def check():
+        if done() or timer() > deadline:
+            io_loop.stop()
+        else:
+            io_loop.add_timeout(io_loop.time() + 0.001, check)
+
+    io_loop.add_callback(check)
+    io_loop.start()
+
+    if not done():
+        raise RuntimeError("Timed out after %s seconds" % timeout)
+
+
+def _wait_subscribed():
+    """Wait until every subscription of the process is confirmed"""
+    subscriber = get_subscriber()
+    _run_until(lambda: subscriber.channels <= _confirmed)
+
+
+def _stats(samples):
+    """Summarize samples of a duration"""
+    samples = sorted(samples)
+    n = len(samples)
+    return {'min': samples[0],
+            'median': samples[n // 2],
+            'p95': samples[min(n - 1, int(0.95 * n))],
+            'mean': sum(samples) / float(n),
+            'samples': n}
+
+
+def _result(name, params, metric, unit, better, value, **extra):
+    """Describe a measurement
+
+    Parameters
+    ----------
+    name : str
+        The benchmark
+    params : dict
+        The parameters of the benchmark
+    metric : str
+        What was measured
+    unit : str
+        The unit of the value
+    better : {'higher', 'lower'}
+        Whether a higher or lower value is an improvement
+    value : float
+        The measurement
+    extra : dict
+        Any additional details of the measurement
+
+    Returns
+    -------
+    dict
+        The result
+    """
+    return {'name': name, 'params': params, 'metric': metric, 'unit': unit,
+            'better': better, 'value': value, 'extra': extra}
+
+
+def bench_submit(repeat):
+    """Jobs submitted and completed per second, one by one and in a batch"""
+    results = []
+    for n in (100, 1000):
+        for batch in (False, True):
+            submitted = []
+            completed = []
+            for _ in range(repeat):
+                root = _bench_id()
+                ctx = InProcessContext()
+                ids = [root]
+
+                start = timer()
+                if batch:
+                    job_ids, _, ar = _submit_many(ctx, root, 'benchmark',
+                                                  None, _noop, [()] * n)
+                    ids.extend(job_ids)
+                    ars = [ar]
+                else:
+                    ars = []
+                    for _ in range(n):
+                        job_id, _, ar = _submit(ctx, root, 'benchmark', None,
+                                                _noop)
+                        ids.append(job_id)
+                        ars.append(ar)
+                submitted.append(n / (timer() - start))
+
+                for ar in ars:
+                    ar.wait()
+                completed.append(n / (timer() - start))
+
+                ctx.close()
+                _cleanup(ids)
+                _cleanup_metrics(ctx.name)
+
+            params = {'jobs': n, 'batch': batch}
+            for metric, samples in (('submitted', submitted),
+                                    ('completed', completed)):
+                stats = _stats(samples)
+                results.append(_result('submit', params, metric, 'jobs/s',
+                                       'higher', stats.pop('median'),
+                                       **stats))
+    return results
+
+
+def bench_traverse(repeat):
+    """Time to resolve a group by number of jobs and depth of groups"""
+    results = []
+    for jobs in (100, 1000, 10000):
+        for depth in (1, 3):
+            root = _bench_id()
+            ids = _build_tree(root, jobs, depth)
+
+            # opening a dashboard creates a group and requests its jobs, which
+            # resolves the tree and subscribes to the jobs
+            cache = _get_info_cache()
+            opened = []
+            for _ in range(repeat):
+                if cache is not None:
+                    cache.clear()
+                start = timer()
+                grp = Group(root)
+                grp.action('get', [])
+                opened.append(timer() - start)
+                grp.close()
+
+            grp = Group(root)
+            traverse = []
+            for _ in range(repeat):
+                start = timer()
+                for _ in grp.traverse():
+                    pass
+                traverse.append(timer() - start)
+
+            cold = []
+            for _ in range(repeat):
+                if cache is not None:
+                    cache.clear()
+                start = timer()
+                grp._action_get([root])
+                cold.append(timer() - start)
+
+            warm = []
+            for _ in range(repeat):
+                start = timer()
+                grp._action_get([root])
+                warm.append(timer() - start)
+
+            grp.close()
+            _cleanup(ids)
+
+            params = {'jobs': jobs, 'depth': depth}
+            for metric, samples in (('open', opened), ('traverse', traverse),
+                                    ('get_cold', cold), ('get_warm', warm)):
+                stats = _stats(samples)
+                results.append(_result('traverse', params, metric, 's',
+                                       'lower', stats.pop('median'), **stats))
+    return results
+
+
+def bench_latency(repeat):
+    """Time from a status change of a job to its websocket frame"""
+    root = _bench_id()
+    ids = _build_tree(root, 1, 1)
+    job = ids[1]
+
+    client = SimulatedClient(root)
+    _wait_subscribed()
+
+    samples = []
+    for i in range(repeat * 40):
+        status = 'benchmark-%d' % i
+        sent = timer()
+        _status_change(job, status, root)
+        _run_until(lambda: (job, status) in client.seen)
+        samples.append(client.seen[(job, status)] - sent)
+
+    client.close()
+    _cleanup(ids)
+
+    stats = _stats(samples)
+    return [_result('latency', {'job_updates': moi.job_updates}, 'update',
+                    's', 'lower', stats.pop('median'), **stats)]
+
+
+def bench_fanout(repeat):
+    """Job updates delivered per second to many clients of a group"""
+    results = []
+    for n in (1, 10, 100):
+        root = _bench_id()
+        jobs = 10
+        ids = _build_tree(root, jobs, 1)
+
+        group_clients = [SimulatedClient(root) for _ in range(n)]
+        _wait_subscribed()
+
+        updates = repeat * 40
+        final = {}
+        start = timer()
+        for i in range(updates):
+            job = ids[1 + i % jobs]
+            final[job] = 'benchmark-%d' % i
+            _status_change(job, final[job], root)
+        _run_until(lambda: all(c.latest.get(j) == s for c in group_clients
+                               for j, s in final.items()))
+        elapsed = timer() - start
+
+        for c in group_clients:
+            c.close()
+        _cleanup(ids)
+
+        params = {'clients': n, 'job_updates': moi.job_updates}
+        results.append(_result(
+            'fanout', params, 'delivered', 'updates/s', 'higher',
+            n * updates / elapsed,
+            frames=sum(c.frames for c in group_clients),
+            received=sum(c.received for c in group_clients)))
+    return results
+
+
+BENCHMARKS = {'submit': bench_submit,
+              'traverse': bench_traverse,
+              'latency': bench_latency,
+              'fanout': bench_fanout}
+
+
+def _metadata():
+    """Describe the environment the benchmarks run in"""
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', 'HEAD'],
+                                         cwd=dirname(__file__))
+        commit = commit.decode('utf-8').strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+
+    return {'date': datetime.now().isoformat(),
+            'commit': commit,
+            'moi': moi.__version__,
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'redis': r_client.info().get('redis_version'),
+            'config': {'job_updates': moi.job_updates,
+                       'inline_max_size': moi.inline_max_size,
+                       'info_cache_size': moi.info_cache_size,
+                       'flush_interval': moi.flush_interval,
+                       'result_codec': moi.result_codec}}
+
+
+def _key(result):
+    """Identify a measurement across runs"""
+    return (result['name'], result['metric'],
+            json.dumps(result['params'], sort_keys=True))
+
+
+@click.group()
+def cli():
+    pass
+
+
+@cli.command()
+@click.option('--output', '-o', help='The file to save the results to',
+              type=click.Path(), default=None)
+@click.option('--only', help='A benchmark to run, can be repeated',
+              multiple=True, type=click.Choice(sorted(BENCHMARKS)))
+@click.option('--repeat', help='The number of samples per measurement',
+              type=int, default=5)
+def run(output, only, repeat):
+    """Run the benchmarks"""
+    get_subscriber().add_hook(_track_subscriptions)
+
+    results = []
+    for name in sorted(only or BENCHMARKS):
+        for result in BENCHMARKS[name](repeat):
+            click.echo("%s %s %s: %.6g %s" % (
+                result['name'], result['metric'],
+                json.dumps(result['params'], sort_keys=True),
+                result['value'], result['unit']), err=True)
+            results.append(result)
+
+    report = json.dumps({'metadata': _metadata(), 'results': results},
+                        indent=2, sort_keys=True)
+    if output is None:
+        click.echo(report)
+    else:
+        with open(output, 'w') as f:
+            f.write(report)
+
+
+@cli.command()
+@click.pass_context
+@click.argument('before', type=click.File())
+@click.argument('after', type=click.File())
+@click.option('--threshold', help='The relative change considered a '
+              'regression', type=float, default=0.1)
+def compare(ctx, before, after, threshold):
+    """Compare two sets of results"""
+    before = {_key(r): r for r in json.load(before)['results']}
+    after = json.load(after)['results']
+
+    regressed = False
+    for result in after:
+        old = before.get(_key(result))
+        if old is None or not old['value']:
+            continue
+
+        ratio = result['value'] / old['value']
+        change = ratio - 1 if result['better'] == 'higher' else 1 - ratio
+        flag = ''
+        if change < -threshold:
+            flag = 'REGRESSION'
+            regressed = True
+        elif change > threshold:
+            flag = 'improved'
+
+        click.echo("%-10s %-10s %-45s %12.6g %12.6g %+7.1f%% %s" % (
+            result['name'], result['metric'],
+            json.dumps(result['params'], sort_keys=True), old['value'],
+            result['value'], 100 * change, flag))
+
+    if regressed:
+        ctx.exit(1)
+
+
+if __name__ == '__main__':
+    cli()
@@ -8,19 +8,20 @@
 from os.path import join, dirname
 from base64 import b64encode
 from uuid import uuid4
-from json import loads
 
 import tornado
 from tornado.httpserver import HTTPServer
 from tornado.ioloop import IOLoop
 from tornado.web import Application
 from tornado.options import define, options, parse_command_line
-from tornado.web import RequestHandler, StaticFileHandler
+from tornado.web import RequestHandler, StaticFileHandler, HTTPError
 from tornado.escape import json_encode
 
-from moi import r_client, ctx_default
+from moi import ctx_default
+from moi import record, sweep
 from moi.websocket import MOIMessageHandler
-from moi.job import submit
+from moi.metrics import MetricsHandler
+from moi.job import submit, submit_many
 from moi.group import get_id_from_user, create_info
 
 
@@ -30,6 +31,7 @@ define("port", default=8886, help="run on the given port", type=int)
 DIRNAME = dirname(__file__)
 STATIC_PATH = join(DIRNAME, ".")
 COOKIE_SECRET = b64encode(uuid4().bytes + uuid4().bytes)
+CHUNK_SIZE = 2 ** 20
 
 
 def say_hello(name, **kwargs):
@@ -66,20 +68,42 @@ class SubmitHandler(RequestHandler):
                                 parent=parent, store=True)
             group_id = group['id']
 
-            for i in range(5):
-                name = group_name + '-%d' % i
-                submit(ctx_default, group_id, name, job_url, say_hello, name)
+            names = [(group_name + '-%d' % i, ) for i in range(5)]
+            submit_many(ctx_default, group_id, group_name, job_url, say_hello,
+                        names)
 
         self.redirect('/')
 
 
 class ResultHandler(RequestHandler):
     def get(self, id):
-        job_info = loads(r_client.get(id))
+        job_info = record.fetch(id)
+        if job_info is not None and job_info.get('result_path') is None:
+            # the result is only fetched when it is to be displayed. Results
+            # offloaded to files are large, and are streamed by
+            # DownloadHandler instead
+            job_info['result'] = record.fetch_result(job_info)
         self.render("moi_result.html", job_info=job_info,
                     group_id=job_info['parent'])
 
 
+class DownloadHandler(RequestHandler):
+    def get(self, id):
+        job_info = record.fetch(id)
+        f = None if job_info is None else record.open_result(job_info)
+        if f is None:
+            raise HTTPError(404)
+
+        # results may be larger than memory, so they are sent in chunks
+        self.set_header('Content-Type', 'application/octet-stream')
+        self.set_header('Content-Disposition',
+                        'attachment; filename="%s.result"' % id)
+        with f:
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+                self.write(chunk)
+                self.flush()
+
+
 class GroupHandler(RequestHandler):
     def get(self, id):
         self.render("moi_group.html", group_id=id)
@@ -89,9 +113,11 @@ class MOIApplication(Application):
     def __init__(self):
         handlers = [
             (r"/moi-ws/", MOIMessageHandler),
+            (r"/metrics", MetricsHandler),
             (r"/static/(.*)", StaticFileHandler,
              {"path": STATIC_PATH}),
             (r"/result/(.*)", ResultHandler),
+            (r"/download/(.*)", DownloadHandler),
             (r"/group/(.*)", GroupHandler),
             (r".*", SubmitHandler)
         ]
@@ -107,6 +133,7 @@ def main():
     parse_command_line()
     http_server = HTTPServer(MOIApplication())
     http_server.listen(options.port)
+    sweep.start()
     print("Tornado started on port", options.port)
     IOLoop.instance().start()
 
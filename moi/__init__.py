@@ -7,15 +7,15 @@
 # -----------------------------------------------------------------------------
 import os
 from sys import stderr
-from uuid import uuid4
 
-from redis import Redis
 from future import standard_library
 from IPython.parallel.error import TimeoutError
 with standard_library.hooks():
     from configparser import ConfigParser
 
 from moi.context import Context  # noqa
+from moi.connection import create_client
+from moi.codec import validate as validate_codec
 
 
 def _support_directory():
@@ -39,42 +39,274 @@ def moi_list_js():
 REDIS_KEY_TIMEOUT = 84600 * 14  # two weeks
 
 
-# parse the config bits
-if 'MOI_CONFIG_FP' not in os.environ:
-    raise IOError('$MOI_CONFIG_FP is not set')
+class _Lazy(object):
+    """An object which is created on first use
 
-_config = ConfigParser()
-with open(os.environ['MOI_CONFIG_FP']) as conf:
-    _config.readfp(conf)
+    Attribute access, item access, iteration and membership tests are
+    forwarded to the object, which is created by calling ``factory`` the
+    first time it is needed.
 
+    Parameters
+    ----------
+    factory : function
+        A function without arguments that creates the object
+    """
+    def __init__(self, factory):
+        self._factory = factory
+        self._obj = None
 
-# establish a connection to the redis server
-r_client = Redis(host=_config.get('redis', 'host'),
-                 port=_config.getint('redis', 'port'),
-                 password=_config.get('redis', 'password'),
-                 db=_config.get('redis', 'db'))
+    def _get(self):
+        if self._obj is None:
+            self._obj = self._factory()
+        return self._obj
 
-# make sure we can connect, let the error propogate so it can be caught
-# or observed upstrean
-key = 'MOI_INIT_TEST_%s' % str(uuid4())
-r_client.set(key, 42)
-r_client.delete(key)
+    def _reset(self):
+        """Discard the object, it is recreated on next use"""
+        self._obj = None
 
-# setup contexts
-ctxs = {}
-failed = []
-for name in _config.get('ipython', 'context').split(','):
-    try:
-        ctxs[name] = Context(name)
-    except (TimeoutError, IOError, ValueError):
-        failed.append(name)
+    def __getattr__(self, name):
+        return getattr(self._get(), name)
 
-if failed:
-    stderr.write('Unable to connect to ipcluster(s): %s\n' % ', '.join(failed))
+    def __getitem__(self, key):
+        return self._get()[key]
 
-ctx_default = _config.get('ipython', 'default')
+    def __contains__(self, key):
+        return key in self._get()
+
+    def __iter__(self):
+        return iter(self._get())
+
+    def __len__(self):
+        return len(self._get())
+
+    def __repr__(self):
+        if self._obj is None:
+            return '<lazy %s>' % self._factory.__name__
+        return repr(self._obj)
+
+
+def _get_config():
+    """Get the parsed configuration, reading $MOI_CONFIG_FP if needed"""
+    if _config is None:
+        configure()
+    return _config
+
+
+def _option(config, section, option, default, getter='get'):
+    """Get an optional configuration value"""
+    if config.has_option(section, option):
+        return getattr(config, getter)(section, option)
+    return default
+
+
+def _pairs(value):
+    """Parse a comma separated list of ``key:value`` pairs
+
+    Values are split on the last colon, so keys may contain colons.
+    """
+    pairs = []
+    for item in value.split(','):
+        item = item.strip()
+        if not item:
+            continue
+        key, sep, val = item.rpartition(':')
+        if not sep or not key.strip() or not val.strip():
+            raise ValueError("Expected key:value, got: %s" % item)
+        pairs.append((key.strip(), val.strip()))
+    return pairs
+
+
+def _create_redis_client():
+    """Create the Redis client described by the configuration"""
+    return create_client(_get_config())
+
+
+def _create_contexts():
+    """Connect to the IPython clusters described by the configuration"""
+    contexts = {}
+    failed = []
+    for name in _get_config().get('ipython', 'context').split(','):
+        try:
+            contexts[name] = Context(name)
+        except (TimeoutError, IOError, ValueError):
+            failed.append(name)
+
+    if failed:
+        stderr.write('Unable to connect to ipcluster(s): %s\n' %
+                     ', '.join(failed))
+
+    return contexts
+
+
+def configure(config_fp=None):
+    """Configure moi
+
+    Parameters
+    ----------
+    config_fp : str, optional
+        The path to the configuration file. Defaults to $MOI_CONFIG_FP.
+
+    Raises
+    ------
+    IOError
+        If ``config_fp`` is not provided and $MOI_CONFIG_FP is not set.
+    ValueError
+        If the configuration is invalid.
+
+    Notes
+    -----
+    Configuring does not connect to Redis or the IPython clusters. These
+    connections are established when ``r_client`` and ``ctxs`` are first
+    used, and any existing connections are discarded by reconfiguring.
+
+    Importing moi configures it from $MOI_CONFIG_FP if it is set, which only
+    reads the file. Otherwise, moi is configured on the first use of
+    ``r_client`` or ``ctxs``, and ``configure`` must be called explicitly
+    prior to relying on ``ctx_default`` or the other configuration values.
+    """
+    global _config, ctx_default, job_updates, status_interval, flush_interval
+    global info_cache_size, inline_max_size, result_codec
+    global result_directory, result_offload_size, sweep_interval, sweep_count
+    global scheduler_weights, scheduler_pins, scheduler_refresh
+    global memo_ttl, memo_max_entries
+
+    if config_fp is None:
+        if 'MOI_CONFIG_FP' not in os.environ:
+            raise IOError('$MOI_CONFIG_FP is not set')
+        config_fp = os.environ['MOI_CONFIG_FP']
+
+    config = ConfigParser()
+    with open(config_fp) as conf:
+        config.readfp(conf)
+
+    # where job updates are published: on the channel of the job ("job"), on
+    # the channel of the group that owns the job ("group"), or on both
+    updates = _option(config, 'pubsub', 'job_updates', 'job')
+    if updates not in ('job', 'group', 'both'):
+        raise ValueError("Unknown job_updates mode: %s" % updates)
+
+    # the largest update message, in bytes, which carries the changed info of
+    # a job. Larger updates only carry the ID, and 0 never inlines info
+    inline_size = _option(config, 'pubsub', 'inline_max_size', 0, 'getint')
+    if inline_size < 0:
+        raise ValueError("inline_max_size must not be negative: %d" %
+                         inline_size)
+
+    # the codec job results are encoded with, see moi.codec
+    codec = _option(config, 'result', 'codec', 'json')
+    validate_codec(codec)
+
+    # where results larger than offload_size bytes are written to instead of
+    # redis, which is disabled if no directory is set
+    directory = _option(config, 'result', 'directory', '') or None
+    offload_size = _option(config, 'result', 'offload_size', 64 * 2 ** 20,
+                           'getint')
+
+    # the weight of each context and the contexts jobs are pinned to by name
+    # when submitted through the "auto" context, see moi.scheduler
+    weights = {}
+    for name, weight in _pairs(_option(config, 'scheduler', 'weights', '')):
+        weights[name] = float(weight)
+        if weights[name] < 0:
+            raise ValueError("weight must not be negative: %s" % name)
+    pins = _pairs(_option(config, 'scheduler', 'pins', ''))
+
+    # the minimum number of seconds between writes of status updates made by
+    # a job through moi_update_status, where 0 writes every update immediately
+    status = _option(config, 'job', 'status_interval', 1.0, 'getfloat')
+
+    # the number of seconds updates are collected for prior to being sent over
+    # a websocket, where 0 sends them on the next iteration of the IOLoop
+    flush = _option(config, 'websocket', 'flush_interval', 0, 'getfloat')
+
+    # the number of decoded job infos cached per process, where 0 disables
+    # the cache
+    info_size = _option(config, 'cache', 'info_size', 10000, 'getint')
+    if info_size < 0:
+        raise ValueError("info_size must not be negative: %d" % info_size)
+
+    # the number of seconds between steps of the sweep of expired jobs by a
+    # server, where 0 disables it, and the number of keys examined per step
+    interval = _option(config, 'sweep', 'interval', 0, 'getfloat')
+    count = _option(config, 'sweep', 'count', 100, 'getint')
+    if count < 1:
+        raise ValueError("count must be positive: %d" % count)
+
+    # the number of seconds the queue status of a context is reused for when
+    # routing jobs automatically
+    refresh = _option(config, 'scheduler', 'refresh', 1.0, 'getfloat')
+
+    # the number of seconds a memoized result is kept for since it was last
+    # used, which is bounded by the lifetime of the jobs holding the results,
+    # and the number of results kept, see moi.memo
+    ttl = _option(config, 'memoize', 'ttl', 86400, 'getint')
+    if not 0 < ttl <= REDIS_KEY_TIMEOUT:
+        raise ValueError("ttl must be within 1 and %d: %d" %
+                         (REDIS_KEY_TIMEOUT, ttl))
+    max_entries = _option(config, 'memoize', 'max_entries', 10000, 'getint')
+    if max_entries < 1:
+        raise ValueError("max_entries must be positive: %d" % max_entries)
+
+    default = config.get('ipython', 'default')
+
+    # the configuration is only replaced once all of it is valid, so that an
+    # invalid configuration leaves the previous one in place
+    _config = config
+    r_client._reset()
+    ctxs._reset()
+
+    ctx_default = default
+    job_updates = updates
+    status_interval = status
+    flush_interval = flush
+    info_cache_size = info_size
+    inline_max_size = inline_size
+    result_codec = codec
+    result_directory = directory
+    result_offload_size = offload_size
+    sweep_interval = interval
+    sweep_count = count
+    scheduler_weights = weights
+    scheduler_pins = pins
+    scheduler_refresh = refresh
+    memo_ttl = ttl
+    memo_max_entries = max_entries
+
+
+_config = None
+
+# the connection to the redis server and the IPython contexts, which are
+# established on first use
+r_client = _Lazy(_create_redis_client)
+ctxs = _Lazy(_create_contexts)
+
+# configuration values, which are set by configure
+ctx_default = None
+job_updates = 'job'
+status_interval = 1.0
+flush_interval = 0
+info_cache_size = 10000
+inline_max_size = 0
+result_codec = 'json'
+result_directory = None
+result_offload_size = 64 * 2 ** 20
+sweep_interval = 0
+sweep_count = 100
+scheduler_weights = {}
+scheduler_pins = []
+scheduler_refresh = 1.0
+memo_ttl = 86400
+memo_max_entries = 10000
+
+if 'MOI_CONFIG_FP' in os.environ:
+    configure()
 
 
 __version__ = '0.2.0-dev'
-__all__ = ['r_client', 'ctxs', 'ctx_default', 'REDIS_KEY_TIMEOUT', 'moi_js',
+__all__ = ['r_client', 'ctxs', 'ctx_default', 'job_updates', 'status_interval',
+           'flush_interval', 'info_cache_size', 'inline_max_size',
+           'result_codec', 'result_directory', 'result_offload_size',
+           'sweep_interval', 'sweep_count', 'scheduler_weights',
+           'scheduler_pins', 'scheduler_refresh', 'memo_ttl',
+           'memo_max_entries', 'configure', 'REDIS_KEY_TIMEOUT', 'moi_js',
            'moi_list_js']
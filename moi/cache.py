@@ -0,0 +1,109 @@
+r"""In-process caching"""
+
+# -----------------------------------------------------------------------------
+# Copyright (c) 2014--, The qiita Development Team.
+#
+# Distributed under the terms of the BSD 3-clause License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# -----------------------------------------------------------------------------
+
+from collections import OrderedDict
+from threading import Lock
+
+
+class LRUCache(object):
+    """A size-bounded mapping which evicts the least recently used entry
+
+    Parameters
+    ----------
+    maxsize : int
+        The maximum number of entries
+
+    Attributes
+    ----------
+    hits : int
+        The number of lookups which found an entry
+    misses : int
+        The number of lookups which did not find an entry
+    """
+    def __init__(self, maxsize):
+        if maxsize < 1:
+            raise ValueError("maxsize must be positive: %d" % maxsize)
+
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def get(self, key, default=None):
+        """Get an entry, marking it as recently used
+
+        Parameters
+        ----------
+        key : hashable
+            The key of the entry
+        default : object, optional
+            The value to return if the entry does not exist
+
+        Returns
+        -------
+        object
+            The value of the entry, or ``default``
+        """
+        with self._lock:
+            try:
+                value = self._data.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+
+            self._data[key] = value
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        """Set an entry, evicting the least recently used entry if full
+
+        Parameters
+        ----------
+        key : hashable
+            The key of the entry
+        value : object
+            The value of the entry
+        """
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = value
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        """Remove an entry
+
+        Parameters
+        ----------
+        key : hashable
+            The key of the entry
+        default : object, optional
+            The value to return if the entry does not exist
+
+        Returns
+        -------
+        object
+            The value of the removed entry, or ``default``
+        """
+        with self._lock:
+            return self._data.pop(key, default)
+
+    def clear(self):
+        """Remove all entries"""
+        with self._lock:
+            self._data.clear()
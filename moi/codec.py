@@ -0,0 +1,333 @@
+r"""Serialization of job results
+
+A codec is named by a serialization format, optionally followed by a
+compression, e.g. ``json``, ``msgpack+zlib`` or ``pickle+lz4``.
+
+Formats:
+
+    json
+        The default. Results must be JSON serializable, aside from NumPy
+        arrays and scalars, which are encoded as lists and numbers.
+    msgpack
+        Requires ``msgpack``. NumPy arrays are stored as their raw bytes, and
+        are decoded as read-only arrays over a copy of the bytes of each
+        array, which msgpack extracts from the stored bytes.
+    pickle
+        Any picklable result. With pickle protocol 5 (Python 3.8, or the
+        ``pickle5`` backport), the buffers of NumPy arrays are stored out of
+        band, and are decoded as read-only arrays over the stored bytes.
+        Decoding a pickle can execute arbitrary code, so this format must
+        only be used if everyone able to write to Redis is trusted.
+
+Compressions:
+
+    zlib
+        Always available
+    lz4
+        Requires ``lz4``
+"""
+
+# -----------------------------------------------------------------------------
+# Copyright (c) 2014--, The qiita Development Team.
+#
+# Distributed under the terms of the BSD 3-clause License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# -----------------------------------------------------------------------------
+
+import json
+import zlib
+import struct
+
+try:
+    import pickle5 as pickle
+except ImportError:
+    try:
+        import cPickle as pickle
+    except ImportError:
+        import pickle
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import lz4.frame as lz4
+except ImportError:
+    lz4 = None
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+# out-of-band buffers are only available from pickle protocol 5
+_OUT_OF_BAND = getattr(pickle, 'PickleBuffer', None) is not None
+
+# the msgpack extension type of NumPy arrays
+_NDARRAY = 1
+
+
+def _as_bytes(data):
+    """Get the bytes of a buffer, such as a memory map"""
+    if isinstance(data, bytes):
+        return data
+    if isinstance(data, memoryview):
+        return data.tobytes()
+    return data[:]
+
+
+def _json_default(obj):
+    """Encode the NumPy types which JSON does not support"""
+    if np is not None:
+        if isinstance(obj, np.ndarray):
+            return obj.tolist()
+        if isinstance(obj, np.generic):
+            return obj.item()
+    raise TypeError("%r is not JSON serializable" % obj)
+
+
+def _json_encode(obj):
+    return json.dumps(obj, default=_json_default).encode('utf-8')
+
+
+def _json_decode(data):
+    return json.loads(_as_bytes(data).decode('utf-8'))
+
+
+def _msgpack_default(obj):
+    """Encode NumPy arrays as their dtype, shape and raw bytes"""
+    if np is not None and isinstance(obj, np.ndarray):
+        if obj.dtype.hasobject:
+            raise TypeError("Arrays of objects are not supported")
+        obj = np.ascontiguousarray(obj)
+        header = json.dumps([obj.dtype.str, obj.shape]).encode('utf-8')
+        return msgpack.ExtType(_NDARRAY, struct.pack('<I', len(header)) +
+                               header + obj.tobytes())
+    if np is not None and isinstance(obj, np.generic):
+        return obj.item()
+    raise TypeError("%r is not serializable with msgpack" % obj)
+
+
+def _msgpack_ext_hook(code, data):
+    """Decode NumPy arrays without copying the bytes extracted by msgpack"""
+    if code != _NDARRAY:
+        return msgpack.ExtType(code, data)
+    if np is None:
+        raise ValueError("NumPy is required to decode arrays")
+
+    size, = struct.unpack_from('<I', data)
+    dtype, shape = json.loads(data[4:4 + size].decode('utf-8'))
+    return np.frombuffer(data, dtype=dtype, offset=4 + size).reshape(shape)
+
+
+def _msgpack_encode(obj):
+    return msgpack.packb(obj, default=_msgpack_default, use_bin_type=True)
+
+
+def _msgpack_decode(data):
+    # a view of a memory mapped result is not copied as a whole, although
+    # msgpack copies the bytes of each array out of it
+    return msgpack.unpackb(memoryview(data), ext_hook=_msgpack_ext_hook,
+                           raw=False)
+
+
+def _pickle_encode(obj):
+    """Pickle a result, with any out-of-band buffers following the pickle
+
+    The encoding is the number of buffers, the length of each buffer and the
+    length of the pickle as little-endian unsigned integers, followed by the
+    pickle and the buffers.
+    """
+    buffers = []
+    if _OUT_OF_BAND:
+        data = pickle.dumps(obj, protocol=5, buffer_callback=buffers.append)
+        buffers = [b.raw() for b in buffers]
+    else:
+        data = pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL)
+
+    lengths = [len(b) for b in buffers] + [len(data)]
+    header = struct.pack('<I%dQ' % len(lengths), len(buffers), *lengths)
+    return b''.join([header, data] + [bytes(b) for b in buffers])
+
+
+def _pickle_decode(data):
+    """Unpickle a result, referencing the stored bytes from its buffers"""
+    # views avoid copying the buffers, which only exist with protocol 5
+    data = memoryview(data) if _OUT_OF_BAND else _as_bytes(data)
+    n, = struct.unpack_from('<I', data)
+    lengths = struct.unpack_from('<%dQ' % (n + 1), data, 4)
+
+    offset = 4 + 8 * (n + 1)
+    payload = data[offset:offset + lengths[-1]]
+    offset += lengths[-1]
+
+    buffers = []
+    for length in lengths[:-1]:
+        buffers.append(data[offset:offset + length])
+        offset += length
+
+    if buffers:
+        if not _OUT_OF_BAND:
+            raise ValueError("Pickle protocol 5 is required to decode")
+        return pickle.loads(payload, buffers=buffers)
+    return pickle.loads(payload)
+
+
+def _lz4_compress(data):
+    return lz4.compress(data)
+
+
+def _lz4_decompress(data):
+    return lz4.decompress(data)
+
+
+FORMATS = {'json': (_json_encode, _json_decode, lambda: True),
+           'msgpack': (_msgpack_encode, _msgpack_decode,
+                       lambda: msgpack is not None),
+           'pickle': (_pickle_encode, _pickle_decode, lambda: True)}
+
+COMPRESSIONS = {'zlib': (zlib.compress, zlib.decompress, lambda: True),
+                'lz4': (_lz4_compress, _lz4_decompress,
+                        lambda: lz4 is not None)}
+
+
+def _parse(codec):
+    """Get the format and compression functions of a codec
+
+    Parameters
+    ----------
+    codec : str
+        The codec
+
+    Raises
+    ------
+    ValueError
+        If the codec is unknown, or requires a package that is not installed
+
+    Returns
+    -------
+    tuple, (tuple, tuple or None)
+        The format functions, and the compression functions if any
+    """
+    fmt, _, compression = codec.partition('+')
+
+    if fmt not in FORMATS:
+        raise ValueError("Unknown format: %s" % fmt)
+    if compression and compression not in COMPRESSIONS:
+        raise ValueError("Unknown compression: %s" % compression)
+
+    format_funcs = FORMATS[fmt]
+    compression_funcs = COMPRESSIONS[compression] if compression else None
+
+    for name, funcs in ((fmt, format_funcs), (compression, compression_funcs)):
+        if funcs is not None and not funcs[2]():
+            raise ValueError("%s is not installed" % name)
+
+    return format_funcs, compression_funcs
+
+
+def validate(codec):
+    """Verify that a codec is known and can be used
+
+    Parameters
+    ----------
+    codec : str
+        The codec
+
+    Raises
+    ------
+    ValueError
+        If the codec is unknown, or requires a package that is not installed
+    """
+    _parse(codec)
+
+
+def encode(obj, codec='json'):
+    """Encode a result
+
+    Parameters
+    ----------
+    obj : object
+        The result
+    codec : str, optional
+        The codec to encode with
+
+    Raises
+    ------
+    ValueError
+        If the codec is unknown, or requires a package that is not installed
+    TypeError
+        If the result cannot be encoded by the codec
+
+    Returns
+    -------
+    bytes
+        The encoded result
+    """
+    (fmt_encode, _, _), compression = _parse(codec)
+    data = fmt_encode(obj)
+    if compression is not None:
+        data = compression[0](data)
+    return data
+
+
+def decode(data, codec='json'):
+    """Decode a result
+
+    Parameters
+    ----------
+    data : bytes
+        The encoded result
+    codec : str, optional
+        The codec the result was encoded with
+
+    Raises
+    ------
+    ValueError
+        If the codec is unknown, requires a package that is not installed, or
+        the data cannot be decoded
+
+    Returns
+    -------
+    object
+        The result. NumPy arrays may be read-only views of ``data``.
+    """
+    (_, fmt_decode, _), compression = _parse(codec)
+    try:
+        if compression is not None:
+            data = compression[1](data)
+        return fmt_decode(data)
+    except ValueError:
+        raise
+    except Exception as e:
+        raise ValueError("Unable to decode result: %s" % e)
+
+
+def jsonable(obj):
+    """Convert the NumPy arrays and scalars within a result to JSON types
+
+    Parameters
+    ----------
+    obj : object
+        A decoded result
+
+    Returns
+    -------
+    object
+        The result, with arrays as lists and scalars as numbers, within any
+        nested lists, tuples and dicts
+    """
+    if np is not None:
+        if isinstance(obj, np.ndarray):
+            return obj.tolist()
+        if isinstance(obj, np.generic):
+            return obj.item()
+
+    if isinstance(obj, (list, tuple)):
+        return [jsonable(o) for o in obj]
+    if isinstance(obj, dict):
+        return {k: jsonable(v) for k, v in obj.items()}
+    return obj
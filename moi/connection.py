@@ -0,0 +1,187 @@
+r"""Redis connections described by the configuration
+
+The ``[redis]`` section of the configuration accepts the following options,
+of which only ``host``, ``port``, ``password`` and ``db`` are required:
+
+    unix_socket_path : str
+        Connect over a unix domain socket instead of TCP, ``host`` and
+        ``port`` are then ignored.
+    max_connections : int
+        The size of the connection pool of the blocking client. If set, a
+        command waits up to ``pool_timeout`` seconds for a connection to
+        become available, and raises ``redis.ConnectionError`` otherwise.
+    pool_timeout : float
+        The number of seconds to wait for a connection from a full pool.
+    socket_timeout : float
+        The number of seconds to wait for a reply.
+    socket_connect_timeout : float
+        The number of seconds to wait for a TCP connection to be established.
+    socket_keepalive : bool
+        Enable TCP keepalive. The pub/sub client relies on the internals of
+        toredis to do so.
+
+Both the blocking client and the asynchronous pub/sub client honour these
+options where they apply.
+"""
+
+# -----------------------------------------------------------------------------
+# Copyright (c) 2014--, The qiita Development Team.
+#
+# Distributed under the terms of the BSD 3-clause License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# -----------------------------------------------------------------------------
+
+import socket
+
+import toredis
+from redis import (Redis, ConnectionPool, BlockingConnectionPool,
+                   ConnectionError, UnixDomainSocketConnection)
+
+
+class MeteredConnectionPool(BlockingConnectionPool):
+    """A bounded connection pool which counts when it runs dry
+
+    Attributes
+    ----------
+    waits : int
+        The number of times a connection was requested while none were
+        available, and the request had to wait.
+    exhausted : int
+        The number of times a connection could not be obtained within the
+        pool timeout.
+    """
+    def __init__(self, *args, **kwargs):
+        self.waits = 0
+        self.exhausted = 0
+        super(MeteredConnectionPool, self).__init__(*args, **kwargs)
+
+    def get_connection(self, command_name, *keys, **options):
+        if self.pool.empty():
+            self.waits += 1
+
+        try:
+            return super(MeteredConnectionPool, self).get_connection(
+                command_name, *keys, **options)
+        except ConnectionError:
+            self.exhausted += 1
+            raise
+
+
+def _option(config, option, getter='get'):
+    """Get an optional option of the redis section, or None"""
+    if config.has_option('redis', option) and config.get('redis', option):
+        return getattr(config, getter)('redis', option)
+    return None
+
+
+def create_client(config):
+    """Create a blocking Redis client
+
+    Parameters
+    ----------
+    config : ConfigParser
+        The configuration
+
+    Returns
+    -------
+    redis.Redis
+        The client
+    """
+    kwargs = {'password': config.get('redis', 'password'),
+              'db': config.get('redis', 'db'),
+              'socket_timeout': _option(config, 'socket_timeout',
+                                        'getfloat')}
+
+    path = _option(config, 'unix_socket_path')
+    if path is not None:
+        kwargs['path'] = path
+        kwargs['connection_class'] = UnixDomainSocketConnection
+    else:
+        kwargs['host'] = config.get('redis', 'host')
+        kwargs['port'] = config.getint('redis', 'port')
+        kwargs['socket_connect_timeout'] = _option(
+            config, 'socket_connect_timeout', 'getfloat')
+        kwargs['socket_keepalive'] = _option(config, 'socket_keepalive',
+                                             'getboolean')
+
+    max_connections = _option(config, 'max_connections', 'getint')
+    if max_connections is not None:
+        timeout = _option(config, 'pool_timeout', 'getfloat')
+        pool = MeteredConnectionPool(max_connections=max_connections,
+                                     timeout=20 if timeout is None
+                                     else timeout, **kwargs)
+    else:
+        pool = ConnectionPool(**kwargs)
+
+    return Redis(connection_pool=pool)
+
+
+def create_pubsub_client(config):
+    """Create and connect an asynchronous client for pub/sub
+
+    Parameters
+    ----------
+    config : ConfigParser
+        The configuration
+
+    Returns
+    -------
+    toredis.Client
+        The connected client
+    """
+    client = toredis.Client()
+
+    path = _option(config, 'unix_socket_path')
+    if path is not None:
+        client.connect_usocket(path)
+    else:
+        client.connect(config.get('redis', 'host'),
+                       config.getint('redis', 'port'))
+        if _option(config, 'socket_keepalive', 'getboolean'):
+            # toredis does not expose its socket, so this relies on its
+            # internals, and keepalive is left unset if they change
+            sock = getattr(getattr(client, '_stream', None), 'socket', None)
+            if sock is not None:
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+
+    password = _option(config, 'password')
+    if password is not None:
+        client.auth(password)
+
+    return client
+
+
+def pool_stats(client):
+    """Describe the use of the connection pool of a client
+
+    Parameters
+    ----------
+    client : redis.Redis
+        The client
+
+    Returns
+    -------
+    dict
+        The ``max_connections`` of the pool, the number of connections
+        ``in_use`` and ``created``, and for bounded pools, the number of
+        ``waits`` for a connection and the number of times the pool was
+        ``exhausted``.
+    """
+    pool = client.connection_pool
+    stats = {'max_connections': pool.max_connections}
+
+    if isinstance(pool, BlockingConnectionPool):
+        # the queue holds idle connections and placeholders for connections
+        # which have yet to be created
+        stats['in_use'] = pool.max_connections - pool.pool.qsize()
+        stats['created'] = len(pool._connections)
+    else:
+        stats['in_use'] = len(pool._in_use_connections)
+        stats['created'] = pool._created_connections
+
+    if isinstance(pool, MeteredConnectionPool):
+        stats['waits'] = pool.waits
+        stats['exhausted'] = pool.exhausted
+
+    return stats
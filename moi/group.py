@@ -8,14 +8,34 @@ r"""Redis group communication"""
 # The full license is in the file LICENSE, distributed with this software.
 # -----------------------------------------------------------------------------
 
+import json
 from uuid import uuid4
+from time import time, mktime
 from datetime import datetime
 
-import toredis
 from redis import ResponseError
-from tornado.escape import json_decode, json_encode
+from tornado.escape import json_decode
 
-from moi import r_client, ctx_default
+import moi
+from moi import r_client, REDIS_KEY_TIMEOUT
+from moi import record, summary, codec, scripts
+from moi.cache import LRUCache
+from moi.pubsub import get_subscriber
+
+
+# placeholder for info that exists but could not be decoded
+_UNDECODABLE = object()
+
+# decoded info shared by every Group in the process, created on first use
+_info_cache = None
+
+# the number of children examined per child requested when filtering a page
+_PAGE_SCAN_FACTOR = 10
+
+# the mapping of users to IDs and IDs to users, which does not change once
+# created
+_ids = LRUCache(10000)
+_users = LRUCache(10000)
 
 
 def _children_key(key):
@@ -34,6 +54,157 @@ def _children_key(key):
     return key + ':children'
 
 
+def _created_key(key):
+    """Create a key that corresponds to the group's index by creation
+
+    Parameters
+    ----------
+    key : str
+        The group key
+
+    Returns
+    -------
+    str
+        The augmented key
+    """
+    return key + ':created'
+
+
+def _ended_key(key):
+    """Create a key that corresponds to the group's index by completion
+
+    Parameters
+    ----------
+    key : str
+        The group key
+
+    Returns
+    -------
+    str
+        The augmented key
+    """
+    return key + ':ended'
+
+
+def _add_children(pipe, parent, ids, created=None):
+    """Queue the addition of children to a group
+
+    Parameters
+    ----------
+    pipe : redis.client.Pipeline
+        The pipeline to queue the addition on
+    parent : str
+        The ID of the group
+    ids : list of str
+        The IDs of the children
+    created : float, optional
+        The time the children were created, in seconds since the epoch.
+        Defaults to now.
+    """
+    created = time() if created is None else created
+    pipe.sadd(_children_key(parent), *ids)
+    pipe.zadd(_created_key(parent), **dict.fromkeys(ids, created))
+
+
+def _remove_children(pipe, parent, ids):
+    """Queue the removal of children from a group
+
+    Parameters
+    ----------
+    pipe : redis.client.Pipeline
+        The pipeline to queue the removal on
+    parent : str
+        The ID of the group
+    ids : list of str
+        The IDs of the children
+    """
+    pipe.srem(_children_key(parent), *ids)
+    pipe.zrem(_created_key(parent), *ids)
+    pipe.zrem(_ended_key(parent), *ids)
+
+
+def _remove_child(parent, id_):
+    """Remove a child from a group, and from the counts of the group
+
+    Parameters
+    ----------
+    parent : str
+        The ID of the group
+    id_ : str
+        The ID of the child
+
+    Notes
+    -----
+    The removal and the adjustment of the counts of the group and of the
+    groups containing it are made atomically by a server-side script, so a
+    status change of the child is either counted and then removed, or not
+    counted at all. Legacy string records are converted prior to removal.
+
+    Returns
+    -------
+    bool
+        Whether the child was removed
+    """
+    keys = [id_, _children_key(parent), _created_key(parent),
+            _ended_key(parent), summary._counts_key(id_)]
+    keys.extend(summary._counts_key(group)
+                for group in summary.ancestors(parent))
+    args = [json.dumps(summary.STATUSES)]
+
+    try:
+        return bool(scripts.run(scripts.REMOVE, keys, args))
+    except ResponseError:
+        if record.convert(id_, REDIS_KEY_TIMEOUT) is None:
+            raise
+        return bool(scripts.run(scripts.REMOVE, keys, args))
+
+
+def _create_children(parent, infos, created=None, expire=None,
+                     parent_info=None, announce=False):
+    """Store info objects as children of a group in a single round trip
+
+    Parameters
+    ----------
+    parent : str
+        The ID of the group
+    infos : list of dict
+        The info objects to store
+    created : float, optional
+        The time the children were created, in seconds since the epoch.
+        Defaults to now.
+    expire : int or None, optional
+        The number of seconds until the info objects expire, or None for no
+        expiration
+    parent_info : dict, optional
+        The info object of the group, which is stored with the expiration of
+        the children if the group does not exist
+    announce : bool, optional
+        If True, the addition of the children is published on the channel of
+        the group
+
+    Notes
+    -----
+    The info objects are stored, added to the group, counted under their
+    status (see ``moi.summary``) and announced atomically by a server-side
+    script.
+    """
+    created = time() if created is None else created
+    ids = [info['id'] for info in infos]
+    counts = [summary._counts_key(id_) for id_ in summary.ancestors(parent)]
+
+    keys = [parent, _children_key(parent), _created_key(parent)]
+    args = [json.dumps(summary.STATUSES), len(counts),
+            '' if expire is None else expire, REDIS_KEY_TIMEOUT,
+            '' if parent_info is None else json.dumps(
+                record.encode(parent_info)),
+            created,
+            _pubsub_key(parent) if announce else '',
+            json.dumps({'add': ids})]
+
+    scripts.run(scripts.CREATE, keys + counts + ids,
+                args + [json.dumps(record.encode(info)) for info in infos])
+
+
 def _pubsub_key(key):
     """Create a pubsub key that corresponds to the group's pubsub
 
@@ -50,6 +221,319 @@ def _pubsub_key(key):
     return key + ':pubsub'
 
 
+def _update_channels(id, parent):
+    """Get the channels an update of a job is published on
+
+    Parameters
+    ----------
+    id : str
+        The job ID
+    parent : str or None
+        The ID of the group the job is a part of
+
+    Notes
+    -----
+    The channels depend on the ``job_updates`` mode of the configuration.
+    Updates of a job without a parent are always published on the channel
+    of the job.
+
+    Returns
+    -------
+    list of str
+        The channels
+    """
+    channels = []
+    if moi.job_updates in ('job', 'both') or parent is None:
+        channels.append(_pubsub_key(id))
+    if moi.job_updates in ('group', 'both') and parent is not None:
+        channels.append(_pubsub_key(parent))
+    return channels
+
+
+def _get_info_cache():
+    """Get the process-wide cache of info, or None if it is disabled"""
+    global _info_cache
+    size = moi.info_cache_size
+    if not size:
+        return None
+    if _info_cache is None or _info_cache.maxsize != size:
+        _info_cache = LRUCache(size)
+    return _info_cache
+
+
+def _cache_get(id_):
+    """Get cached info if it is known to be current
+
+    Parameters
+    ----------
+    id_ : str
+        The ID of the node
+
+    Returns
+    -------
+    dict or None
+        A copy of the cached info, or None if the info is not cached or may
+        be outdated.
+
+    Notes
+    -----
+    Info is current if, since it was cached, the process has continuously
+    been subscribed to a channel its updates are published on, as every
+    update then invalidates it.
+    """
+    cache = _get_info_cache()
+    if cache is None:
+        return None
+
+    entry = cache.get(id_)
+    if entry is None:
+        return None
+
+    details, coverage = entry
+    subscriber = get_subscriber()
+    for channel, generation in coverage:
+        if subscriber.generation(channel) == generation:
+            return dict(details)
+
+    cache.pop(id_)
+    return None
+
+
+def _cache_set(id_, details):
+    """Cache info if the process receives its updates
+
+    Parameters
+    ----------
+    id_ : str
+        The ID of the node
+    details : dict
+        The decoded info of a node
+    """
+    cache = _get_info_cache()
+    if cache is None:
+        return
+
+    subscriber = get_subscriber()
+    coverage = []
+    for channel in _update_channels(id_, details.get('parent')):
+        generation = subscriber.generation(channel)
+        if generation is not None:
+            coverage.append((channel, generation))
+
+    if coverage:
+        cache.set(id_, (details, coverage))
+
+
+def _refresh_cached(msg):
+    """Apply the updates of a message to the cached info
+
+    Parameters
+    ----------
+    msg : tuple, (str, str, str)
+        The message sent over the line. The `tuple` is of the form:
+        (message_type, channel, payload).
+
+    Notes
+    -----
+    Updates which carry the full info replace the cached info, and updates
+    which carry the changed fields are applied to it. Cached info is dropped
+    for updates which only carry the ID, or whose info is not cached.
+    """
+    cache = _get_info_cache()
+    if cache is None or msg[0] != 'message':
+        return
+
+    try:
+        payload = json_decode(msg[2])
+    except (ValueError, TypeError):
+        return
+
+    if not isinstance(payload, dict):
+        return
+
+    items = payload.get('update')
+    if not isinstance(items, list):
+        return
+
+    for item in items:
+        if not isinstance(item, dict):
+            cache.pop(item)
+            continue
+
+        id_ = item.get('id')
+        if isinstance(item.get('info'), dict):
+            _cache_set(id_, dict(item['info']))
+            continue
+
+        details = _cache_get(id_)
+        if details is not None and isinstance(item.get('diff'), dict):
+            details.update(item['diff'])
+            _cache_set(id_, details)
+        else:
+            cache.pop(id_)
+
+
+def _parse_date(date):
+    """Get the seconds since the epoch of a date set by ``create_info``"""
+    for fmt in ('%Y-%m-%d %H:%M:%S.%f', '%Y-%m-%d %H:%M:%S'):
+        try:
+            parsed = datetime.strptime(date, fmt)
+        except (ValueError, TypeError):
+            continue
+        return mktime(parsed.timetuple()) + parsed.microsecond / 1e6
+    return 0.0
+
+
+def _build_index(id_):
+    """Index the children of a group which are missing from its indexes
+
+    Parameters
+    ----------
+    id_ : str
+        The ID of the group
+
+    Notes
+    -----
+    Children added prior to the indexes are indexed by the ``date_created``
+    and ``date_end`` of their info. Children whose info cannot be read are
+    indexed as created at the epoch, and are skipped when paging. The
+    children are only examined if the index by creation is smaller than the
+    set of children.
+    """
+    with r_client.pipeline(transaction=False) as pipe:
+        pipe.scard(_children_key(id_))
+        pipe.zcard(_created_key(id_))
+        n_children, n_indexed = pipe.execute()
+
+    if n_indexed >= n_children:
+        return
+
+    children = list(r_client.smembers(_children_key(id_)))
+    with r_client.pipeline(transaction=False) as pipe:
+        for child in children:
+            pipe.zscore(_created_key(id_), child)
+        scores = pipe.execute()
+
+    missing = [c for c, score in zip(children, scores) if score is None]
+    created = {}
+    ended = {}
+    for child, payload in zip(missing, record.fetch_many(missing)):
+        try:
+            details = record.decode(payload)
+        except ValueError:
+            created[child] = 0.0
+            continue
+
+        created[child] = _parse_date(details.get('date_created'))
+        if details.get('date_end') is not None:
+            ended[child] = _parse_date(details['date_end'])
+
+    with r_client.pipeline() as pipe:
+        if created:
+            pipe.zadd(_created_key(id_), **created)
+        if ended:
+            pipe.zadd(_ended_key(id_), **ended)
+        pipe.execute()
+
+
+def page(id_, cursor=None, limit=50, status=None, order='created'):
+    """Get a page of the children of a group, most recent first
+
+    Parameters
+    ----------
+    id_ : str
+        The ID of the group
+    cursor : str, optional
+        The cursor returned with the previous page. Defaults to the first
+        page.
+    limit : int, optional
+        The maximum number of children on the page
+    status : str or list of str, optional
+        Only include jobs counted under these statuses (see
+        ``moi.summary.bucket``)
+    order : {'created', 'ended'}, optional
+        Order the children by the time they were created, or by the time they
+        ended, in which case children which have not ended are excluded.
+
+    Raises
+    ------
+    ValueError
+        If the order, limit or cursor are not valid
+
+    Notes
+    -----
+    Children are read from a sorted set index of the group, so the cost of
+    a page depends on ``limit`` and not on the number of children. When
+    filtering by status, at most ``limit * _PAGE_SCAN_FACTOR`` children are
+    examined, and the page may then be short even if more children match.
+
+    Returns
+    -------
+    tuple, (list of dict, str or None)
+        The info of the children, and the cursor of the next page or None if
+        there are no more children.
+    """
+    if order == 'created':
+        key = _created_key(id_)
+    elif order == 'ended':
+        key = _ended_key(id_)
+    else:
+        raise ValueError("Unknown order: %s" % order)
+
+    limit = int(limit)
+    if limit < 1:
+        raise ValueError("limit must be positive: %d" % limit)
+
+    if isinstance(status, (list, tuple, set)):
+        statuses = set(status)
+    elif status is not None:
+        statuses = {status}
+    else:
+        statuses = None
+
+    # the cursor is the score of the last child examined, and the number of
+    # children with that score which were examined, as members with the
+    # same score are returned in a stable order
+    if cursor is None:
+        _build_index(id_)
+        max_score, skip = '+inf', 0
+    else:
+        score, _, skip = str(cursor).rpartition(':')
+        max_score, skip = float(score), int(skip)
+
+    result = []
+    scanned = 0
+    while len(result) < limit and scanned < limit * _PAGE_SCAN_FACTOR:
+        batch = r_client.zrevrangebyscore(key, max_score, '-inf', start=skip,
+                                          num=limit, withscores=True)
+        if not batch:
+            return result, None
+
+        ids = [child for child, _ in batch]
+        for (child, score), payload in zip(batch, record.fetch_many(ids)):
+            scanned += 1
+            if score == max_score:
+                skip += 1
+            else:
+                max_score, skip = score, 1
+
+            try:
+                details = record.decode(payload)
+            except ValueError:
+                continue
+
+            if (statuses is None or
+                    summary.bucket(details.get('status')) in statuses):
+                result.append(details)
+                if len(result) == limit:
+                    break
+        else:
+            if len(batch) < limit:
+                return result, None
+
+    return result, '%r:%d' % (max_score, skip)
+
+
 class Group(object):
     """A object-relational mapper against a Redis job group
 
@@ -60,10 +544,32 @@ class Group(object):
     forwarder : function
         A function to forward on state changes to. This function must accept a
         `dict`. Any return is ignored.
+
+    Notes
+    -----
+    Subscriptions are registered with the process-wide ``Subscriber``, which
+    shares a single pub/sub connection between every ``Group``. As the
+    subscriber holds on to the callbacks of the group, ``close`` must be
+    called once the group is no longer needed.
+
+    Opening a group only subscribes to its own channel. The nodes returned
+    by the "get" action, including the children on a requested page, are
+    subscribed to as they are returned, so the cost of opening a group does
+    not grow with its size, and a client paging through a group only
+    receives updates for the nodes it has seen. If job updates are published
+    on the channels of the groups owning the jobs (the "group" or "both"
+    ``job_updates`` modes), only the channels of groups are subscribed to,
+    while jobs are only tracked.
+
+    The info returned by the "get", "update" and "result" actions is read
+    through a cache shared by every ``Group`` in the process. Cached info is
+    refreshed or dropped when an update for it is received, so it is read
+    from Redis at most once per update regardless of the number of groups
+    listening to the job, and not at all if the update carries the info.
     """
     def __init__(self, group, forwarder=None):
-        self.toredis = toredis.Client()
-        self.toredis.connect()
+        self._subscriber = get_subscriber()
+        self._subscriber.add_hook(_refresh_cached)
 
         self._listening_to = {}
 
@@ -77,31 +583,157 @@ class Group(object):
             self.forwarder = forwarder
 
         self.listen_for_updates()
-        for node in self.traverse(self.group):
-            self.listen_to_node(node['id'])
 
     def traverse(self, id_=None):
-        """Traverse groups and yield info dicts for jobs"""
+        """Traverse groups and yield info dicts for jobs
+
+        Parameters
+        ----------
+        id_ : str, optional
+            The group to traverse. Defaults to the group of this object.
+
+        Notes
+        -----
+        The group itself is not yielded, only its descendants. Children that
+        have expired or been deleted are skipped, see ``moi.sweep``.
+        """
         if id_ is None:
             id_ = self.group
 
-        nodes = r_client.smembers(_children_key(id_))
-        while nodes:
-            current_id = nodes.pop()
+        for details in self._resolve([id_], include_roots=False):
+            yield details
+
+    def _resolve(self, ids, include_roots=True, ignore_errors=False,
+                 cached=False):
+        """Resolve info for IDs and all of their descendants
+
+        Parameters
+        ----------
+        ids : iterable of str
+            The IDs to resolve. ``None`` values are ignored.
+        include_roots : bool, optional
+            If True, the info for ``ids`` are yielded as well as the info of
+            their descendants. If False, ``ids`` are assumed to be groups and
+            only their descendants are yielded.
+        ignore_errors : bool, optional
+            If True, nodes whose info cannot be decoded are skipped instead of
+            raising.
+        cached : bool, optional
+            If True, info is read through the cache of the process.
+
+        Raises
+        ------
+        ValueError
+            If the info of a node cannot be decoded and ``ignore_errors`` is
+            False.
+
+        Notes
+        -----
+        The tree is resolved one level at a time: the children of every group
+        on a level are obtained with a single pipelined batch of SMEMBERS, and
+        the info for all of those children is obtained with a single
+        pipelined batch of reads.
+        The number of round trips is therefore proportional to the depth of
+        the tree and not to the number of nodes. Each node is decoded at most
+        once, even if it is reachable through multiple groups.
+
+        Returns
+        -------
+        generator of dict
+            The info of each resolved node
+        """
+        visited = set()
+        level = []
+        for id_ in ids:
+            if id_ is not None and id_ not in visited:
+                visited.add(id_)
+                level.append(id_)
+
+        if include_roots:
+            groups = []
+            for details in self._fetch(level, ignore_errors, cached):
+                if details is None or details is _UNDECODABLE:
+                    continue
+                if details.get('type') == 'group':
+                    groups.append(details['id'])
+                yield details
+        else:
+            groups = level
+
+        while groups:
+            with r_client.pipeline(transaction=False) as pipe:
+                for group in groups:
+                    pipe.smembers(_children_key(group))
+                children_sets = pipe.execute()
+
+            level = []
+            for children in children_sets:
+                for child in children:
+                    if child not in visited:
+                        visited.add(child)
+                        level.append(child)
+
+            groups = []
+            for details in self._fetch(level, ignore_errors, cached):
+                # expired children are skipped, and reclaimed by moi.sweep
+                if details is None or details is _UNDECODABLE:
+                    continue
+                if details.get('type') == 'group':
+                    groups.append(details['id'])
+                yield details
+
+    def _fetch(self, ids, ignore_errors=False, cached=False):
+        """Fetch and decode the info for IDs in a single round trip
+
+        Parameters
+        ----------
+        ids : list of str
+            The IDs to fetch
+        ignore_errors : bool, optional
+            If True, info which cannot be decoded is returned as
+            ``_UNDECODABLE`` instead of raising.
+        cached : bool, optional
+            If True, current info is taken from the cache of the process, and
+            only the remaining IDs are read from Redis. The info read is
+            cached if the process receives its updates.
+
+        Raises
+        ------
+        ValueError
+            If the info for an ID cannot be decoded and ``ignore_errors`` is
+            False.
 
-            details = r_client.get(current_id)
+        Returns
+        -------
+        list of dict or None
+            The info for each ID, in order, or None if the ID does not exist.
+        """
+        result = [None] * len(ids)
+        missing = []
+        for i, id_ in enumerate(ids):
+            details = _cache_get(id_) if cached else None
             if details is None:
-                # child has expired or been deleted, remove from :children
-                r_client.srem(_children_key(id_), current_id)
+                missing.append(i)
+            else:
+                result[i] = details
+
+        payloads = record.fetch_many([ids[i] for i in missing])
+        for i, payload in zip(missing, payloads):
+            if payload is None:
                 continue
 
-            details = self._decode(details)
-            if details['type'] == 'group':
-                children = r_client.smembers(_children_key(details['id']))
-                if children is not None:
-                    nodes.update(children)
+            try:
+                details = record.decode(payload)
+            except ValueError:
+                if not ignore_errors:
+                    raise
+                result[i] = _UNDECODABLE
+                continue
 
-            yield details
+            if cached and isinstance(details, dict):
+                _cache_set(ids[i], dict(details))
+            result[i] = details
+        return result
 
     def __del__(self):
         self.close()
@@ -109,8 +741,9 @@ class Group(object):
     def close(self):
         """Unsubscribe the group and all jobs being listened too"""
         for channel in self._listening_to:
-            self.toredis.unsubscribe(channel)
-        self.toredis.unsubscribe(self.group_pubsub)
+            self._subscriber.unsubscribe(channel, self.callback)
+        self._listening_to = {}
+        self._subscriber.unsubscribe(self.group_pubsub, self.callback)
 
     def _decode(self, data):
         try:
@@ -125,16 +758,53 @@ class Group(object):
 
     def listen_for_updates(self):
         """Attach a callback on the group pubsub"""
-        self.toredis.subscribe(self.group_pubsub, callback=self.callback)
+        self._subscriber.subscribe(self.group_pubsub, self.callback)
 
     def listen_to_node(self, id_):
         """Attach a callback on the job pubsub if it exists"""
-        if r_client.get(id_) is None:
+        details = self._fetch([id_], ignore_errors=True)[0]
+        if details is None:
             return
+        elif details is _UNDECODABLE:
+            return self._subscribe_to_node(id_)
         else:
-            self.toredis.subscribe(_pubsub_key(id_), callback=self.callback)
-            self._listening_to[_pubsub_key(id_)] = id_
-            return id_
+            return self._subscribe_to_node(id_, details.get('type'))
+
+    def _subscribe_to_node(self, id_, info_type=None):
+        """Attach a callback on the job pubsub without checking existence
+
+        Parameters
+        ----------
+        id_ : str
+            The ID of the node
+        info_type : {'job', 'group', None}, optional
+            The type of the node. If job updates are published on group
+            channels, only groups are subscribed to, while jobs are only
+            tracked.
+
+        Returns
+        -------
+        str
+            The ID of the node
+        """
+        id_pubsub = _pubsub_key(id_)
+        if id_pubsub not in self._listening_to:
+            if moi.job_updates == 'job' or info_type == 'group':
+                self._subscriber.subscribe(id_pubsub, self.callback)
+            self._listening_to[id_pubsub] = id_
+        return id_
+
+    def _listen_to_details(self, details):
+        """Subscribe to the nodes returned to the client
+
+        Parameters
+        ----------
+        details : list of dict
+            The details of the nodes, which were just resolved, so they are
+            known to exist
+        """
+        for info in details:
+            self._subscribe_to_node(info['id'], info.get('type'))
 
     def unlisten_to_node(self, id_):
         """Stop listening to a job
@@ -153,12 +823,16 @@ class Group(object):
 
         if id_pubsub in self._listening_to:
             del self._listening_to[id_pubsub]
-            self.toredis.unsubscribe(id_pubsub)
+            self._subscriber.unsubscribe(id_pubsub, self.callback)
 
-            parent = json_decode(r_client.get(id_)).get('parent', None)
+            info = record.fetch(id_) or {}
+            parent = info.get('parent', None)
             if parent is not None:
-                r_client.srem(_children_key(parent), id_)
-            r_client.srem(self.group_children, id_)
+                _remove_child(parent, id_)
+            if parent != self.group:
+                with r_client.pipeline() as pipe:
+                    _remove_children(pipe, self.group, [id_])
+                    pipe.execute()
 
             return id_
 
@@ -206,10 +880,12 @@ class Group(object):
 
         Parameters
         ----------
-        verb : str, {'add', 'remove', 'get'}
+        verb : str, {'add', 'remove', 'get', 'result', 'update', 'summary'}
             The specific action to perform
-        args : {list, set, tuple}
-            Any relevant arguments for the action.
+        args : {list, set, tuple, dict}
+            Any relevant arguments for the action. A dict is only accepted by
+            "get", and requests a page of the children of a group as
+            described by ``_action_page``.
 
         Raises
         ------
@@ -223,6 +899,10 @@ class Group(object):
         list
             Elements dependent on the action
         """
+        if verb == 'get' and isinstance(args, dict):
+            self.forwarder(self._action_page(args))
+            return
+
         if not isinstance(args, (list, set, tuple)):
             raise TypeError("args is unknown type: %s" % type(args))
 
@@ -231,7 +911,16 @@ class Group(object):
         elif verb == 'remove':
             response = ({'remove': i} for i in self._action_remove(args))
         elif verb == 'get':
-            response = ({'get': i} for i in self._action_get(args))
+            details = self._action_get(args)
+            self._listen_to_details(details)
+            response = ({'get': i} for i in details)
+        elif verb == 'result':
+            response = ({'result': i} for i in self._action_result(args))
+        elif verb == 'update':
+            # job updates published on the group channel
+            response = ({'update': i} for i in self._action_update(args))
+        elif verb == 'summary':
+            response = ({'summary': i} for i in self._action_summary(args))
         else:
             raise ValueError("Unknown action: %s" % verb)
 
@@ -261,7 +950,7 @@ class Group(object):
             raise TypeError("args is unknown type: %s" % type(args))
 
         if verb == 'update':
-            response = ({'update': i} for i in self._action_get(args))
+            response = ({'update': i} for i in self._action_update(args))
         elif verb == 'add':
             response = ({'add': i} for i in self._action_add(args))
         else:
@@ -309,7 +998,11 @@ class Group(object):
 
         Notes
         -----
-        If ids is empty, then all IDs are returned.
+        If ids is empty, then the details of every descendant of the group
+        and of every node listened to are returned, which traverses the
+        group. If an ID is a group, the details of all of its descendants
+        are returned as well. IDs which do not exist or cannot be decoded
+        are ignored.
 
         Returns
         -------
@@ -317,41 +1010,141 @@ class Group(object):
             The details of the jobs
         """
         if not ids:
-            ids = self.jobs
+            ids = list(r_client.smembers(self.group_children))
+            ids.extend(self.jobs)
+
+        return list(self._resolve(ids, ignore_errors=True, cached=True))
+
+    def _action_update(self, items):
+        """Get the details of updated jobs
+
+        Parameters
+        ----------
+        items : {list, set, tuple} of str or dict
+            The IDs of the updated jobs, or inline updates of the form
+            ``{"id": id, "info": info}`` or ``{"id": id, "diff": fields}``
+
+        Notes
+        -----
+        Inlined info is returned as is. The changed fields of an update have
+        already been applied to the cached info on receipt of the message, so
+        the details of the remaining jobs are only read from Redis if they
+        are not cached.
+
+        Returns
+        -------
+        list of dict
+            The details of the jobs
+        """
         result = []
+        ids = []
+        for item in items:
+            if not isinstance(item, dict):
+                ids.append(item)
+            elif isinstance(item.get('info'), dict):
+                result.append(item['info'])
+            else:
+                ids.append(item.get('id'))
 
-        ids = set(ids)
-        while ids:
-            id_ = ids.pop()
+        if ids:
+            result.extend(self._action_get(ids))
+        return result
 
-            if id_ is None:
-                continue
+    def _action_page(self, args):
+        """Get a page of the children of a group
 
-            try:
-                payload = r_client.get(id_)
-            except ResponseError:
-                # wrong key type
+        Parameters
+        ----------
+        args : dict
+            The ``id`` of the group, defaulting to the group of this object,
+            and the ``cursor``, ``limit``, ``status`` and ``order`` of the
+            page as described by ``page``
+
+        Returns
+        -------
+        list of dict
+            A "get" message with the details of each child on the page,
+            followed by a "page" message with the ``id`` of the group and the
+            ``cursor`` of the next page
+
+        Notes
+        -----
+        The children on the page are subscribed to.
+        """
+        id_ = args.get('id') or self.group
+        details, cursor = page(id_, args.get('cursor'), args.get('limit', 50),
+                               args.get('status'),
+                               args.get('order', 'created'))
+
+        self._listen_to_details(details)
+
+        response = [{'get': i} for i in details]
+        response.append({'page': {'id': id_, 'cursor': cursor}})
+        return response
+
+    def _action_summary(self, ids):
+        """Get the counts of jobs by status for groups
+
+        Parameters
+        ----------
+        ids : {list, set, tuple, generator} of str
+            The group IDs to summarize
+
+        Notes
+        -----
+        If ids is empty, the group of this object is summarized. The counts
+        of a group include the jobs of all of the groups it contains.
+
+        Returns
+        -------
+        list of dict
+            Each dict contains the ``id`` of a group and its ``counts``, the
+            number of jobs by status
+        """
+        ids = [id_ for id_ in ids if id_ is not None] or [self.group]
+        return [{'id': id_, 'counts': counts}
+                for id_, counts in zip(ids, summary.get_summaries(ids))]
+
+    def _action_result(self, ids):
+        """Get the results for ids
+
+        Parameters
+        ----------
+        ids : {list, set, tuple, generator} of str
+            The job IDs to get results for
+
+        Notes
+        -----
+        Results are not part of the details returned by other actions, and
+        are only fetched through this action. IDs which do not exist, or
+        whose results cannot be decoded, are ignored.
+
+        Returns
+        -------
+        list of dict
+            Each dict contains the ``id`` of a job and its ``result``
+        """
+        result = []
+        for details in self._fetch(list(ids), ignore_errors=True,
+                                   cached=True):
+            if details is None or details is _UNDECODABLE:
                 continue
 
             try:
-                payload = self._decode(payload)
+                payload = record.fetch_result(details)
             except ValueError:
-                # unable to decode or data doesn't exist in redis
                 continue
-            else:
-                result.append(payload)
-
-            if payload['type'] == 'group':
-                for obj in self.traverse(id_):
-                    ids.add(obj['id'])
 
+            result.append({'id': details['id'],
+                           'result': codec.jsonable(payload)})
         return result
 
 
 def create_info(name, info_type, url=None, parent=None, id=None,
-                context=ctx_default, store=False):
+                context=None, store=False):
     """Return a group object"""
     id = str(uuid4()) if id is None else id
+    context = moi.ctx_default if context is None else context
     pubsub = _pubsub_key(id)
 
     info = {'id': id,
@@ -365,27 +1158,52 @@ def create_info(name, info_type, url=None, parent=None, id=None,
             'date_start': None,
             'date_end': None,
             'date_created': str(datetime.now()),
-            'result': None}
+            'time_queued': None,
+            'time_picked_up': None,
+            'time_started': None,
+            'time_ended': None,
+            'time_stored': None,
+            'result_key': None,
+            'result_path': None,
+            'result_size': None,
+            'result_checksum': None,
+            'result_codec': None,
+            'depends_on': None,
+            'msg_id': None,
+            'memo_key': None}
 
     if store:
-        r_client.set(id, json_encode(info))
-
-        if parent is not None:
-            r_client.sadd(_children_key(parent), id)
+        if parent is None:
+            record.store(info)
+        else:
+            _create_children(parent, [info])
 
     return info
 
 
 def get_user_from_id(id):
     """Gets a user from an ID"""
-    return r_client.hget('user-id-map', id)
+    user = _users.get(id)
+    if user is None:
+        user = r_client.hget('user-id-map', id)
+        if user is not None:
+            _users.set(id, user)
+    return user
 
 
 def get_id_from_user(user):
-    """Get an ID from a user, creates if necessary"""
-    id = r_client.hget('user-id-map', user)
+    """Get an ID from a user, creates if necessary
+
+    Notes
+    -----
+    The ID is created atomically, so simultaneous first calls for a user
+    agree on its ID. Mappings are never removed, so they are cached in the
+    process once known.
+    """
+    id = _ids.get(user)
     if id is None:
-        id = str(uuid4())
-        r_client.hset('user-id-map', user, id)
-        r_client.hset('user-id-map', id, user)
+        id = scripts.run(scripts.GET_OR_CREATE_ID, ['user-id-map'],
+                         [user, str(uuid4())])
+        _ids.set(user, id)
+        _users.set(id, user)
     return id
@@ -9,13 +9,24 @@
 import sys
 import traceback
 import json
-from functools import partial
+from uuid import uuid4
+from time import time, sleep
 from datetime import datetime
+from collections import deque
+from contextlib import contextmanager
+from threading import Lock, Thread, Timer
 from subprocess import Popen, PIPE
 
-from moi import r_client, ctxs, ctx_default, REDIS_KEY_TIMEOUT
-from moi.group import create_info
+from redis import ResponseError
+from IPython.parallel import Dependency
+
+import moi
+from moi import r_client, ctxs, REDIS_KEY_TIMEOUT
+from moi import record, summary, metrics, scripts, memo
+from moi.group import (create_info, _update_channels, _create_children,
+                       _ended_key, _children_key)
 from moi.context import Context
+from moi.scheduler import AUTO, get_scheduler
 
 
 def system_call(cmd, **kwargs):
@@ -54,11 +65,232 @@ def system_call(cmd, **kwargs):
     return stdout, stderr, return_value
 
 
-def _status_change(id, new_status):
+# the longest line read from a command at once, longer lines are split
+_MAX_LINE = 65536
+
+
+def _drain(pipe, tail, spool=None, on_line=None):
+    """Read a pipe line by line until it is closed
+
+    Parameters
+    ----------
+    pipe : file
+        The pipe to read
+    tail : collections.deque
+        Receives each line, and is expected to be bounded
+    spool : file, optional
+        Receives each line
+    on_line : function, optional
+        Called with each line, without its trailing newline
+    """
+    for line in iter(lambda: pipe.readline(_MAX_LINE), ''):
+        tail.append(line)
+        if spool is not None:
+            spool.write(line)
+        if on_line is not None:
+            on_line(line.rstrip('\n'))
+    pipe.close()
+
+
+def streaming_system_call(cmd, tail=100, stdout_fp=None, stderr_fp=None,
+                          progress=None, **kwargs):
+    """Call cmd, reading its output as it is produced
+
+    Unlike ``system_call``, the output of the command is not held in memory.
+    Only its last lines are kept, and the full output can be written to
+    files.
+
+    Parameters
+    ----------
+    cmd : str
+        Can be either a string containing the command to be run, or a sequence
+        of strings that are the tokens of the command.
+    tail : int, optional
+        The number of lines of stdout and of stderr to keep
+    stdout_fp : str, optional
+        The path of a file to write stdout to
+    stderr_fp : str, optional
+        The path of a file to write stderr to
+    progress : {'stdout', 'stderr', None}, optional
+        Pass each line of this output to ``moi_update_status``, which writes
+        the latest line at most once per ``status_interval`` seconds.
+    kwargs : dict, optional
+        Ignored, aside from ``moi_update_status``. Available so that this
+        function is compatible with _redis_wrap.
+
+    Raises
+    ------
+    ValueError
+        If the command exits with a non-zero status. The message holds the
+        last lines of stdout and stderr.
+
+    Returns
+    -------
+    tuple, (str, str, int)
+        The last lines of stdout and stderr, and the return value
+    """
+    if progress not in ('stdout', 'stderr', None):
+        raise ValueError("Unknown progress output: %s" % progress)
+
+    update_status = kwargs.get('moi_update_status')
+    on_line = {'stdout': None, 'stderr': None}
+    if progress is not None and update_status is not None:
+        on_line[progress] = update_status
+
+    stdout_tail = deque(maxlen=tail)
+    stderr_tail = deque(maxlen=tail)
+    stdout_spool = None if stdout_fp is None else open(stdout_fp, 'w')
+    stderr_spool = None if stderr_fp is None else open(stderr_fp, 'w')
+
+    try:
+        proc = Popen(cmd,
+                     universal_newlines=True,
+                     shell=True,
+                     stdout=PIPE,
+                     stderr=PIPE)
+
+        # both pipes are read concurrently, as the command blocks if either
+        # of them fills up
+        reader = Thread(target=_drain, args=(proc.stderr, stderr_tail,
+                                             stderr_spool, on_line['stderr']))
+        reader.daemon = True
+        reader.start()
+        _drain(proc.stdout, stdout_tail, stdout_spool, on_line['stdout'])
+        reader.join()
+        return_value = proc.wait()
+    finally:
+        for spool in (stdout_spool, stderr_spool):
+            if spool is not None:
+                spool.close()
+
+    stdout = ''.join(stdout_tail)
+    stderr = ''.join(stderr_tail)
+
+    if return_value != 0:
+        raise ValueError("Failed to execute: %s\nstdout (last %d lines): %s\n"
+                         "stderr (last %d lines): %s" %
+                         (cmd, tail, stdout, tail, stderr))
+
+    return stdout, stderr, return_value
+
+
+def _update_message(id, info=None, diff=None):
+    """Create the message published on an update of a job
+
+    Parameters
+    ----------
+    id : str
+        The job ID
+    info : dict, optional
+        The full job info
+    diff : dict, optional
+        The fields of the job info that have changed
+
+    Notes
+    -----
+    The info, or if not provided the changed fields, are inlined in the
+    message as ``{"id": id, "info": info}`` or ``{"id": id, "diff": diff}``
+    if the message does not exceed the ``inline_max_size`` option of the
+    configuration. Otherwise, the message only holds the ID.
+
+    Returns
+    -------
+    str
+        The JSON encoded message
+    """
+    if moi.inline_max_size:
+        if info is not None:
+            item = {'id': id, 'info': info}
+        else:
+            item = {'id': id, 'diff': diff}
+
+        message = json.dumps({"update": [item]})
+        if len(message) <= moi.inline_max_size:
+            return message
+
+    return json.dumps({"update": [id]})
+
+
+def _write_info(id, fields, parent=None, store=False):
+    """Write job info, count any change of status, and publish an update
+
+    Parameters
+    ----------
+    id : str
+        The job ID
+    fields : dict
+        The fields of the job info to write
+    parent : str, optional
+        The ID of the group the job is a part of. If not provided, it is read
+        from the job.
+    store : bool, optional
+        If True, the job info is replaced by ``fields``
+
+    Notes
+    -----
+    The exchange of the status, the write, the adjustment of the counts of
+    the groups of the job (see ``moi.summary``), the indexing of its end
+    time and the publication of the update are made atomically by a
+    server-side script, in a single round trip if ``parent`` is provided.
+    The counts and the end time are left as they are if the job was removed
+    from its group. Legacy string records are converted prior to being
+    written.
+
+    Returns
+    -------
+    str or None
+        The old status
+    """
+    if store:
+        message = _update_message(id, info=fields)
+    else:
+        message = _update_message(id, diff=fields)
+
+    counted = store or 'status' in fields
+    ended = time() if fields.get('date_end') is not None else ''
+    encoded = json.dumps(record.encode(fields))
+
+    converted = False
+    while True:
+        try:
+            if parent is None:
+                stored_parent = r_client.hget(id, 'parent')
+                if stored_parent is not None:
+                    parent = json.loads(stored_parent)
+
+            # the end time is only indexed within a group
+            # updates of a job removed from its group are not counted
+            if parent is None:
+                keys = [id, id, id]
+            else:
+                keys = [id, _ended_key(parent), _children_key(parent)]
+            keys.extend(summary._counts_key(group)
+                        for group in summary.ancestors(parent))
+            args = [json.dumps(summary.STATUSES), '1' if store else '0',
+                    encoded, REDIS_KEY_TIMEOUT,
+                    json.dumps(fields.get('status')) if counted else '',
+                    '' if parent is None else ended, message]
+            old_status = scripts.run(scripts.WRITE, keys,
+                                     args + _update_channels(id, parent))
+        except ResponseError:
+            # a legacy string record, which is converted prior to retrying
+            if converted or record.convert(id, REDIS_KEY_TIMEOUT) is None:
+                raise
+            converted = True
+            continue
+
+        if old_status is not None:
+            old_status = json.loads(old_status)
+        return old_status
+
+
+def _status_change(id, new_status, parent=None):
     """Update the status of a job
 
     The status associated with the id is updated, an update command is
-    issued to the job's pubsub, and and the old status is returned.
+    issued to the job's pubsub, and and the old status is returned. Only the
+    status field of the job is written, and the exchange of the old status
+    for the new one is atomic.
 
     Parameters
     ----------
@@ -66,36 +298,124 @@ def _status_change(id, new_status):
         The job ID
     new_status : str
         The status change
+    parent : str, optional
+        The ID of the group the job is a part of. If not provided, it is read
+        from the job.
 
     Returns
     -------
     str
         The old status
     """
-    job_info = json.loads(r_client.get(id))
-    old_status = job_info['status']
-    job_info['status'] = new_status
-    _deposit_payload(job_info)
-
-    return old_status
+    return _write_info(id, {'status': new_status}, parent)
 
 
-def _deposit_payload(to_deposit):
+def _deposit_payload(to_deposit, fields=None):
     """Store job info, and publish an update
 
     Parameters
     ----------
     to_deposit : dict
         The job info
+    fields : iterable of str, optional
+        The fields of the job info that have changed. If provided, only
+        these fields are written, otherwise the full job info is stored.
 
     """
-    pubsub = to_deposit['pubsub']
     id = to_deposit['id']
+    parent = to_deposit.get('parent')
 
-    with r_client.pipeline() as pipe:
-        pipe.set(id, json.dumps(to_deposit), ex=REDIS_KEY_TIMEOUT)
-        pipe.publish(pubsub, json.dumps({"update": [id]}))
-        pipe.execute()
+    if fields is None:
+        _write_info(id, to_deposit, parent, store=True)
+    else:
+        _write_info(id, {f: to_deposit[f] for f in fields}, parent)
+
+
+class StatusUpdater(object):
+    """Rate limited status updates of a job
+
+    Status updates are written at most once per ``min_interval`` seconds.
+    Updates made within the interval are buffered, and only the latest one
+    is written once the interval has elapsed. Buffered updates are written
+    from a background thread, or on ``flush``.
+
+    Parameters
+    ----------
+    id : str
+        The job ID
+    status : str
+        The current status of the job
+    parent : str, optional
+        The ID of the group the job is a part of
+    min_interval : float, optional
+        The minimum number of seconds between writes. Defaults to the
+        ``status_interval`` of the configuration.
+    """
+    def __init__(self, id, status, parent=None, min_interval=None):
+        self.id = id
+        self.parent = parent
+        self.min_interval = (moi.status_interval if min_interval is None
+                             else min_interval)
+
+        self._lock = Lock()
+        self._status = status
+        self._pending = False
+        self._last_write = 0.0
+        self._timer = None
+
+    def __call__(self, new_status, force=False):
+        """Update the status of the job
+
+        Parameters
+        ----------
+        new_status : str
+            The status change
+        force : bool, optional
+            If True, the status is written immediately regardless of the
+            interval since the last write.
+
+        Returns
+        -------
+        str
+            The old status
+        """
+        with self._lock:
+            old_status = self._status
+            self._status = new_status
+            self._pending = True
+
+            wait = self._last_write + self.min_interval - time()
+            if force or wait <= 0:
+                self._write()
+            elif self._timer is None:
+                self._timer = Timer(wait, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+
+        return old_status
+
+    def flush(self):
+        """Write the buffered status, if any"""
+        with self._lock:
+            if self._pending:
+                self._write()
+
+    def _write(self):
+        """Write the current status, the lock must be held"""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        _status_change(self.id, self._status, self.parent)
+        self._pending = False
+        self._last_write = time()
+
+
+def _timed(func, *args):
+    """Call a function, returning the number of seconds it took"""
+    start = time()
+    func(*args)
+    return time() - start
 
 
 def _redis_wrap(job_info, func, *args, **kwargs):
@@ -107,6 +427,11 @@ def _redis_wrap(job_info, func, *args, **kwargs):
 
         old_status = kwargs['moi_update_status']('my new status')
 
+    Status updates are rate limited as described by ``StatusUpdater``, and an
+    immediate write can be forced with:
+
+        kwargs['moi_update_status']('my new status', force=True)
+
     Parameters
     ----------
     job_info : dict
@@ -120,23 +445,35 @@ def _redis_wrap(job_info, func, *args, **kwargs):
     ------
     Exception
         If the function called raises, that exception is propagated.
+    ValueError
+        If a job in the ``depends_on`` of the job did not succeed, in which
+        case the function is not called and the job fails.
 
     Returns
     -------
     Anything the function executed returns.
     """
-    status_changer = partial(_status_change, job_info['id'])
+    job_info['time_picked_up'] = time()
+    job_info['status'] = 'Running'
+    job_info['date_start'] = str(datetime.now())
+
+    status_changer = StatusUpdater(job_info['id'], job_info['status'],
+                                   parent=job_info['parent'])
     kwargs['moi_update_status'] = status_changer
     kwargs['moi_context'] = job_info['context']
     kwargs['moi_parent_id'] = job_info['parent']
 
-    job_info['status'] = 'Running'
-    job_info['date_start'] = str(datetime.now())
-
-    _deposit_payload(job_info)
+    # the time spent writing the status and info object to Redis
+    redis_seconds = _timed(_deposit_payload, job_info,
+                           ('status', 'date_start', 'time_picked_up'))
 
     caught = None
+    job_info['time_started'] = time()
     try:
+        failed = _failed_dependencies(job_info.get('depends_on') or [])
+        if failed:
+            raise ValueError("Dependencies did not succeed: %s" %
+                             ', '.join(failed))
         result = func(*args, **kwargs)
         job_info['status'] = 'Success'
     except Exception as e:
@@ -144,9 +481,23 @@ def _redis_wrap(job_info, func, *args, **kwargs):
         job_info['status'] = 'Failed'
         caught = e
     finally:
-        job_info['result'] = result
+        job_info['time_ended'] = time()
+        redis_seconds += _timed(status_changer.flush)
+
+        # the result is stored prior to the info object referencing it
+        result_fields = record.store_result(job_info['id'], result,
+                                            expire=REDIS_KEY_TIMEOUT)
+        job_info.update(result_fields)
         job_info['date_end'] = str(datetime.now())
-        _deposit_payload(job_info)
+        job_info['time_stored'] = time()
+        redis_seconds += _timed(_deposit_payload, job_info,
+                                ['status', 'date_end', 'time_started',
+                                 'time_ended', 'time_stored'] +
+                                list(result_fields))
+        if job_info['status'] == 'Success' and job_info.get('memo_key'):
+            memo.remember(job_info['memo_key'], job_info)
+
+        metrics.observe_job(job_info, redis_seconds)
 
     if caught is None:
         return result
@@ -154,13 +505,44 @@ def _redis_wrap(job_info, func, *args, **kwargs):
         raise caught
 
 
+def _failed_dependencies(ids):
+    """Get the jobs among dependencies which did not succeed
+
+    Parameters
+    ----------
+    ids : list of str
+        The IDs of the jobs
+
+    Returns
+    -------
+    list of str
+        The IDs of the jobs which failed or no longer exist
+    """
+    failed = []
+    for id_, payload in zip(ids, record.fetch_many(ids)):
+        if payload is None or \
+                record.decode(payload).get('status') != 'Success':
+            failed.append(id_)
+    return failed
+
+
+def _redis_wrap_packed(job_info, func, args, kwargs):
+    """Unpack args and kwargs for ``_redis_wrap``
+
+    This allows ``_redis_wrap`` to be used with ``map``, which can only pass
+    positional arguments.
+    """
+    return _redis_wrap(job_info, func, *args, **kwargs)
+
+
 def submit(ctx_name, parent_id, name, url, func, *args, **kwargs):
     """Submit through a context
 
     Parameters
     ----------
     ctx_name : str
-        The name of the context to submit through
+        The name of the context to submit through, or ``auto`` to submit
+        through the least loaded context, see ``moi.scheduler``
     parent_id : str
         The ID of the group that the job is a part of.
     name : str
@@ -169,25 +551,400 @@ def submit(ctx_name, parent_id, name, url, func, *args, **kwargs):
         The handler that can take the results (e.g., /beta_diversity/)
     func : function
         The function to execute. Any returns from this function will be
-        serialized and deposited into Redis using the uuid for a key. This
-        function should raise if the method fails.
+        serialized and deposited into Redis using the uuid and a ":result"
+        suffix for a key. This function should raise if the method fails.
     args : tuple or None
         Any args for ``func``
     kwargs : dict or None
-        Any kwargs for ``func``
+        Any kwargs for ``func``, except for ``depends_on``, a list of the IDs
+        of jobs the job runs after (see ``submit_dag``), and ``memoize``,
+        which if True completes the job with the result of a previous run of
+        ``func`` over the same arguments if there is one, see ``moi.memo``
 
     Returns
     -------
     tuple, (str, str, AsyncResult)
         The job ID, parent ID and the IPython's AsyncResult object of the job
     """
-    if isinstance(ctx_name, Context):
-        ctx = ctx_name
-    else:
-        ctx = ctxs.get(ctx_name, ctxs[ctx_default])
+    ctx = _get_context(ctx_name, name, depends_on=kwargs.get('depends_on'))
     return _submit(ctx, parent_id, name, url, func, *args, **kwargs)
 
 
+def submit_many(ctx_name, parent_id, name, url, func, iterable, **kwargs):
+    """Submit a function over many sets of arguments through a context
+
+    Parameters
+    ----------
+    ctx_name : str
+        The name of the context to submit through, or ``auto`` to submit
+        through the least loaded context, see ``moi.scheduler``
+    parent_id : str
+        The ID of the group that the jobs are a part of.
+    name : str
+        The base name of the jobs. Each job is named ``<name>-<index>``.
+    url : str
+        The handler that can take the results (e.g., /beta_diversity/)
+    func : function
+        The function to execute. Any returns from this function will be
+        serialized and deposited into Redis using the uuid and a ":result"
+        suffix for a key. This function should raise if the method fails.
+    iterable : iterable of tuple
+        The args for ``func``, one tuple per job
+    kwargs : dict or None
+        Any kwargs for ``func``, shared by all jobs, except for
+        ``depends_on``, a list of the IDs of jobs all of the jobs run after,
+        and ``memoize``, which is not supported
+
+    Notes
+    -----
+    The info objects of all jobs are created within a single pipeline, a
+    single "add" message is published to the parent, and the jobs are handed
+    to the load balanced view with a single ``map``.
+
+    Raises
+    ------
+    ValueError
+        If ``memoize`` is True, as the jobs are mapped with a single result
+
+    Returns
+    -------
+    tuple, (list of str, str, AsyncMapResult)
+        The job IDs, parent ID and the IPython's AsyncMapResult object of the
+        jobs. The results are in the same order as the job IDs.
+    """
+    iterable = list(iterable)
+    ctx = _get_context(ctx_name, name, len(iterable),
+                       depends_on=kwargs.get('depends_on'))
+    return _submit_many(ctx, parent_id, name, url, func, iterable, **kwargs)
+
+
+def submit_dag(ctx_name, parent_id, url, jobs, follow=False):
+    """Submit a graph of jobs which run after the jobs they depend on
+
+    Parameters
+    ----------
+    ctx_name : str
+        The name of the context to submit through, or ``auto`` to submit
+        through the least loaded context, see ``moi.scheduler``
+    parent_id : str
+        The ID of the group that the jobs are a part of.
+    url : str
+        The handler that can take the results (e.g., /beta_diversity/)
+    jobs : dict of str: dict
+        The jobs by name. Each job is described by its ``func``, and
+        optionally its ``args``, its ``kwargs`` and its ``depends_on``, a list
+        of the names of the jobs it runs after.
+    follow : bool, optional
+        If True, a job is run on an engine which ran one of the jobs it
+        depends on, e.g. to reuse files local to the engine
+
+    Raises
+    ------
+    ValueError
+        If there are no jobs, a job depends on a job not in the graph, or the
+        dependencies are cyclic
+
+    Notes
+    -----
+    All jobs are handed to the load balanced view at once, with the IPython
+    messages of the jobs they depend on as their ``after`` dependencies, so
+    the scheduler of the cluster dispatches a job as soon as the jobs it
+    depends on complete. Jobs with dependencies are created with a status of
+    Blocked, and fail without running if a job they depend on did not
+    succeed.
+
+    Returns
+    -------
+    tuple, (dict of str: str, str, dict of str: AsyncResult)
+        The job IDs by name, parent ID and the IPython's AsyncResult objects
+        of the jobs by name
+    """
+    order = _topological_order(dict((name, job.get('depends_on') or [])
+                                    for name, job in jobs.items()))
+    ctx = _get_context(ctx_name, jobs=len(order))
+    return _submit_dag(ctx, parent_id, url, jobs, order, follow)
+
+
+def _topological_order(depends_on):
+    """Order the jobs of a graph after the jobs they depend on
+
+    Parameters
+    ----------
+    depends_on : dict of str: list of str
+        The names of the jobs each job depends on
+
+    Raises
+    ------
+    ValueError
+        If there are no jobs, a job depends on an unknown job, or the
+        dependencies are cyclic
+
+    Returns
+    -------
+    list of str
+        The names of the jobs
+    """
+    if not depends_on:
+        raise ValueError("Nothing to submit!")
+
+    dependents = dict((name, []) for name in depends_on)
+    waiting = {}
+    for name, parents in depends_on.items():
+        for parent in parents:
+            if parent not in dependents:
+                raise ValueError("%s depends on an unknown job: %s" %
+                                 (name, parent))
+            dependents[parent].append(name)
+        waiting[name] = len(set(parents))
+
+    ready = sorted(name for name, n in waiting.items() if n == 0)
+    order = []
+    while ready:
+        name = ready.pop(0)
+        order.append(name)
+        for dependent in sorted(set(dependents[name])):
+            waiting[dependent] -= 1
+            if waiting[dependent] == 0:
+                ready.append(dependent)
+
+    if len(order) != len(depends_on):
+        raise ValueError("Cyclic dependencies among: %s" %
+                         ', '.join(sorted(set(depends_on) - set(order))))
+    return order
+
+
+def _get_context(ctx_name, name=None, jobs=1, depends_on=None):
+    """Get a context, falling back on the default context
+
+    Parameters
+    ----------
+    ctx_name : str or Context
+        The name of the context, ``auto`` for the least loaded context, or a
+        context
+    name : str, optional
+        The name of the job, which may pin it to a context if it is routed
+        automatically
+    jobs : int, optional
+        The number of jobs being submitted
+    depends_on : list of str, optional
+        The IDs of the jobs the jobs depend on. Jobs routed automatically are
+        submitted through the context of these jobs.
+
+    Returns
+    -------
+    Context
+        The context to submit through
+    """
+    if isinstance(ctx_name, Context):
+        return ctx_name
+
+    if ctx_name != AUTO and ctx_name not in ctxs:
+        ctx_name = moi.ctx_default
+
+    if ctx_name == AUTO:
+        if depends_on:
+            contexts = set(info['context'] for info in
+                           _fetch_dependencies(depends_on))
+            if len(contexts) == 1 and list(contexts)[0] in ctxs:
+                return ctxs[contexts.pop()]
+        return get_scheduler().choose(name, jobs)
+    return ctxs[ctx_name]
+
+
+def _fetch_dependencies(ids):
+    """Fetch the info objects of the jobs others depend on
+
+    Parameters
+    ----------
+    ids : list of str
+        The IDs of the jobs
+
+    Raises
+    ------
+    ValueError
+        If a job does not exist
+
+    Returns
+    -------
+    list of dict
+        The info objects, in order
+    """
+    infos = []
+    for id_, payload in zip(ids, record.fetch_many(ids)):
+        if payload is None:
+            raise ValueError("Unknown job: %s" % id_)
+        infos.append(record.decode(payload))
+    return infos
+
+
+# the number of seconds to wait for a job being submitted to record its
+# message, and the interval at which to check
+_MSG_ID_TIMEOUT = 5
+_MSG_ID_POLL = 0.05
+
+
+def _after(ctx, ids, timeout=None):
+    """Get the IPython messages of the jobs others depend on
+
+    Parameters
+    ----------
+    ctx : Context
+        The context the dependent jobs are submitted through
+    ids : list of str
+        The IDs of the jobs
+    timeout : float, optional
+        The number of seconds to wait for pending jobs to record their
+        messages. Defaults to ``_MSG_ID_TIMEOUT``.
+
+    Raises
+    ------
+    ValueError
+        If a job does not exist, was submitted through another context, or
+        is still pending without a recorded message after the timeout, as
+        IPython only resolves dependencies between the tasks of a cluster
+
+    Notes
+    -----
+    A job is created before it is handed to IPython, and records its message
+    once it has been, so a job submitted in between is waited for.
+
+    Returns
+    -------
+    list of str
+        The message IDs of the jobs which have yet to complete. Jobs which
+        have completed are not waited for, and are checked by the dependent
+        jobs once they run.
+    """
+    timeout = _MSG_ID_TIMEOUT if timeout is None else timeout
+    deadline = time() + timeout
+    msg_ids = {}
+    pending = list(ids)
+    while True:
+        waiting = []
+        for info in _fetch_dependencies(pending):
+            if info['status'] in ('Success', 'Failed'):
+                continue
+            if info['context'] != ctx.name:
+                raise ValueError("Job %s runs in context %s, not %s" %
+                                 (info['id'], info['context'], ctx.name))
+            if info.get('msg_id') is None:
+                waiting.append(info['id'])
+            else:
+                msg_ids[info['id']] = info['msg_id']
+
+        if not waiting:
+            break
+        if time() >= deadline:
+            raise ValueError("Job %s has no message to depend on" %
+                             waiting[0])
+        pending = waiting
+        sleep(_MSG_ID_POLL)
+
+    return [msg_ids[id_] for id_ in ids if id_ in msg_ids]
+
+
+@contextmanager
+def _dependent(ctx, msg_ids, follow=False):
+    """Submit through a context after IPython messages
+
+    Parameters
+    ----------
+    ctx : Context
+        The context to submit through
+    msg_ids : list of str
+        The messages the submissions run after, whether or not they succeed,
+        as the submissions check the status of the jobs themselves
+    follow : bool, optional
+        If True, the submissions run on an engine which ran one of the
+        messages
+    """
+    if not msg_ids:
+        yield
+        return
+
+    after = Dependency(msg_ids, success=True, failure=True)
+    flags = {'after': after}
+    if follow:
+        flags['follow'] = Dependency(msg_ids, all=False, success=True,
+                                     failure=True)
+    with ctx.bv.temp_flags(**flags):
+        yield
+
+
+def _record_msg_ids(ids, msg_ids):
+    """Record the IPython messages of submitted jobs, to depend on them
+
+    Parameters
+    ----------
+    ids : list of str
+        The IDs of the jobs
+    msg_ids : list of str
+        The message IDs, in the order of the jobs
+    """
+    with r_client.pipeline(transaction=False) as pipe:
+        for id_, msg_id in zip(ids, msg_ids):
+            record.update(id_, {'msg_id': msg_id}, pipe)
+        pipe.execute()
+
+
+def _create_jobs(ctx, parent_id, names, url, ids=None, depends_on=None,
+                 memo_keys=None, blocked=None):
+    """Create job info objects under a parent and announce them
+
+    Parameters
+    ----------
+    ctx : Context
+        The context the jobs will be submitted through
+    parent_id : str
+        The ID of the group that the jobs are a part of. The group is created
+        if it does not exist.
+    names : list of str
+        The names of the jobs
+    url : str
+        The handler that can take the results (e.g., /beta_diversity/)
+    ids : list of str, optional
+        The IDs of the jobs. Defaults to new IDs.
+    depends_on : list of list of str, optional
+        The IDs of the jobs each job depends on
+    blocked : list of bool, optional
+        Whether each job waits on the jobs it depends on. Defaults to whether
+        it depends on any, and is False for jobs whose dependencies have all
+        completed.
+    memo_keys : list of str, optional
+        The keys the results of the jobs are memoized under, see ``moi.memo``
+
+    Returns
+    -------
+    tuple, (list of dict, str)
+        The info objects of the jobs, each with a status of Queued, or
+        Blocked if it waits on other jobs, and the parent ID
+    """
+    queued = time()
+    ids = [None] * len(names) if ids is None else ids
+    depends_on = [None] * len(names) if depends_on is None else depends_on
+    memo_keys = [None] * len(names) if memo_keys is None else memo_keys
+    blocked = ([bool(parents) for parents in depends_on] if blocked is None
+               else blocked)
+
+    job_infos = [create_info(name, 'job', url=url, parent=parent_id,
+                             context=ctx.name, id=id_)
+                 for name, id_ in zip(names, ids)]
+    for info, parents, key, waits in zip(job_infos, depends_on, memo_keys,
+                                         blocked):
+        info['time_queued'] = queued
+        info['memo_key'] = key
+        if parents:
+            info['depends_on'] = list(parents)
+        if waits:
+            info['status'] = 'Blocked'
+
+    _create_children(parent_id, job_infos, queued, expire=REDIS_KEY_TIMEOUT,
+                     parent_info=create_info('unnamed', 'group', id=parent_id),
+                     announce=True)
+
+    return job_infos, parent_id
+
+
 def _submit(ctx, parent_id, name, url, func, *args, **kwargs):
     """Submit a function to a cluster
 
@@ -201,38 +958,197 @@ def _submit(ctx, parent_id, name, url, func, *args, **kwargs):
         The handler that can take the results (e.g., /beta_diversity/)
     func : function
         The function to execute. Any returns from this function will be
-        serialized and deposited into Redis using the uuid for a key. This
-        function should raise if the method fails.
+        serialized and deposited into Redis using the uuid and a ":result"
+        suffix for a key. This function should raise if the method fails.
     args : tuple or None
         Any args for ``func``
     kwargs : dict or None
-        Any kwargs for ``func``
+        Any kwargs for ``func``, except for ``depends_on``, a list of the IDs
+        of jobs the job runs after, and ``memoize``, see ``submit``
+
+    Notes
+    -----
+    Jobs with dependencies are not memoized, as their results may depend on
+    the results of the jobs they depend on.
 
     Returns
     -------
     tuple, (str, str, AsyncResult)
-        The job ID, parent ID and the IPython's AsyncResult object of the job
+        The job ID, parent ID and the IPython's AsyncResult object of the job,
+        or a ``moi.memo.MemoizedResult`` if the job completed from the cache
     """
-    parent_info = r_client.get(parent_id)
-    if parent_info is None:
-        parent_info = create_info('unnamed', 'group', id=parent_id)
-        parent_id = parent_info['id']
-        r_client.set(parent_id, json.dumps(parent_info))
-
-    parent_pubsub_key = parent_id + ':pubsub'
-
-    job_info = create_info(name, 'job', url=url, parent=parent_id,
-                           context=ctx.name, store=True)
-    job_info['status'] = 'Queued'
-    job_id = job_info['id']
-
-    with r_client.pipeline() as pipe:
-        pipe.set(job_id, json.dumps(job_info))
-        pipe.publish(parent_pubsub_key, json.dumps({'add': [job_id]}))
+    depends_on = kwargs.pop('depends_on', None) or []
+    key = None
+    if kwargs.pop('memoize', False) and not depends_on:
+        key = memo.memo_key(func, args, kwargs)
+    if key is not None:
+        memoized = _submit_memoized(ctx, parent_id, name, url, key)
+        if memoized is not None:
+            return memoized
+
+    msg_ids = _after(ctx, depends_on)
+    (job_info, ), parent_id = _create_jobs(ctx, parent_id, [name], url,
+                                           depends_on=[depends_on],
+                                           memo_keys=[key],
+                                           blocked=[bool(msg_ids)])
+
+    with _dependent(ctx, msg_ids):
+        ar = ctx.bv.apply_async(_redis_wrap, job_info, func, *args, **kwargs)
+    _record_msg_ids([job_info['id']], ar.msg_ids)
+    return job_info['id'], parent_id, ar
+
+
+def _submit_memoized(ctx, parent_id, name, url, key):
+    """Complete a job with a memoized result
+
+    Parameters
+    ----------
+    ctx : Context
+        The context the job would have been submitted through
+    parent_id : str
+        The ID of the group that the job is a part of.
+    name : str
+        The name of the job
+    url : str
+        The handler that can take the results (e.g., /beta_diversity/)
+    key : str
+        The key of the run of the job, see ``moi.memo.memo_key``
+
+    Returns
+    -------
+    tuple, (str, str, MemoizedResult) or None
+        The job ID, parent ID and the result of the job, or None if the run
+        is not memoized
+    """
+    fields = memo.lookup(key)
+    if fields is None:
+        return None
+
+    info = create_info(name, 'job', url=url, parent=parent_id,
+                       context=ctx.name)
+    copied = memo.copy_result(fields, info['id'])
+    if copied is None:
+        memo.forget(key)
+        return None
+
+    now = time()
+    date = str(datetime.now())
+    info.update(copied)
+    info.update({'status': 'Success', 'memo_key': key, 'date_start': date,
+                 'date_end': date, 'time_queued': now, 'time_picked_up': now,
+                 'time_started': now, 'time_ended': now, 'time_stored': now})
+
+    _create_children(parent_id, [info], now, expire=REDIS_KEY_TIMEOUT,
+                     parent_info=create_info('unnamed', 'group', id=parent_id),
+                     announce=True)
+    with r_client.pipeline(transaction=False) as pipe:
+        pipe.zadd(_ended_key(parent_id), **{info['id']: now})
+        memo.hit(key, copied, pipe)
         pipe.execute()
 
-    ar = ctx.bv.apply_async(_redis_wrap, job_info, func, *args, **kwargs)
-    return job_id, parent_id, ar
+    return info['id'], parent_id, memo.MemoizedResult(info['id'])
+
+
+def _submit_many(ctx, parent_id, name, url, func, iterable, **kwargs):
+    """Submit a function over many sets of arguments to a cluster
+
+    Parameters
+    ----------
+    parent_id : str
+        The ID of the group that the jobs are a part of.
+    name : str
+        The base name of the jobs. Each job is named ``<name>-<index>``.
+    url : str
+        The handler that can take the results (e.g., /beta_diversity/)
+    func : function
+        The function to execute. Any returns from this function will be
+        serialized and deposited into Redis using the uuid and a ":result"
+        suffix for a key. This function should raise if the method fails.
+    iterable : iterable of tuple
+        The args for ``func``, one tuple per job
+    kwargs : dict or None
+        Any kwargs for ``func``, shared by all jobs, except for
+        ``depends_on``, a list of the IDs of jobs all of the jobs run after,
+        and ``memoize``, which is not supported
+
+    Raises
+    ------
+    ValueError
+        If there is nothing to submit, or ``memoize`` is True
+
+    Returns
+    -------
+    tuple, (list of str, str, AsyncMapResult)
+        The job IDs, parent ID and the IPython's AsyncMapResult object of the
+        jobs
+    """
+    all_args = [tuple(args) for args in iterable]
+    if not all_args:
+        raise ValueError("Nothing to submit!")
+    if kwargs.pop('memoize', False):
+        raise ValueError("submit_many does not memoize, use submit")
+
+    depends_on = kwargs.pop('depends_on', None) or []
+    msg_ids = _after(ctx, depends_on)
+    names = ['%s-%d' % (name, i) for i in range(len(all_args))]
+    job_infos, parent_id = _create_jobs(ctx, parent_id, names, url,
+                                        depends_on=[depends_on] * len(names),
+                                        blocked=[bool(msg_ids)] * len(names))
+
+    n = len(job_infos)
+    with _dependent(ctx, msg_ids):
+        ar = ctx.bv.map_async(_redis_wrap_packed, job_infos, [func] * n,
+                              all_args, [kwargs] * n, ordered=True)
+
+    ids = [info['id'] for info in job_infos]
+    _record_msg_ids(ids, ar.msg_ids)
+    return ids, parent_id, ar
+
+
+def _submit_dag(ctx, parent_id, url, jobs, order, follow=False):
+    """Submit a graph of jobs to a cluster
+
+    Parameters
+    ----------
+    ctx : Context
+        The context to submit through
+    parent_id : str
+        The ID of the group that the jobs are a part of.
+    url : str
+        The handler that can take the results (e.g., /beta_diversity/)
+    jobs : dict of str: dict
+        The jobs by name, see ``submit_dag``
+    order : list of str
+        The names of the jobs, after the jobs they depend on
+    follow : bool, optional
+        If True, a job is run on an engine which ran one of the jobs it
+        depends on
+
+    Returns
+    -------
+    tuple, (dict of str: str, str, dict of str: AsyncResult)
+        The job IDs by name, parent ID and the IPython's AsyncResult objects
+        of the jobs by name
+    """
+    parents = dict((name, sorted(set(jobs[name].get('depends_on') or [])))
+                   for name in order)
+    ids = dict((name, str(uuid4())) for name in order)
+    job_infos, parent_id = _create_jobs(
+        ctx, parent_id, order, url, ids=[ids[name] for name in order],
+        depends_on=[[ids[p] for p in parents[name]] for name in order])
+
+    ars = {}
+    for name, job_info in zip(order, job_infos):
+        job = jobs[name]
+        msg_ids = [ars[p].msg_ids[0] for p in parents[name]]
+        with _dependent(ctx, msg_ids, follow):
+            ars[name] = ctx.bv.apply_async(_redis_wrap, job_info, job['func'],
+                                           *job.get('args', ()),
+                                           **job.get('kwargs', {}))
+
+    _record_msg_ids([ids[name] for name in order],
+                    [ars[name].msg_ids[0] for name in order])
+    return ids, parent_id, ars
 
 
 def submit_nouser(func, *args, **kwargs):
@@ -253,5 +1169,5 @@ def submit_nouser(func, *args, **kwargs):
     tuple, (str, str)
         The job ID, parent ID and the IPython's AsyncResult object of the job
     """
-    return submit(ctx_default, "no-user", "unnamed", None, func, *args,
+    return submit(moi.ctx_default, "no-user", "unnamed", None, func, *args,
                   **kwargs)
@@ -0,0 +1,353 @@
+r"""Memoization of the results of submitted functions
+
+Submitting with ``memoize=True`` looks up a previous successful run of the
+same function over the same arguments. On a hit, the job is created as
+already succeeded with a copy of the cached result, and is never handed to a
+cluster. On a miss, the job is submitted as usual, and its result is cached
+once it succeeds.
+
+Runs are identified by a SHA1 of the module, name, bytecode, constants,
+referenced names, defaults and closure of the function, and of the pickled
+arguments, with the elements of sets and the items of dicts put in a fixed
+order. Functions or arguments which cannot be pickled are not memoized, and
+other arguments which are equal but pickle differently do not hit the cache.
+
+Cache entries are kept in Redis under ``moi:memo:<sha1>``, and refer to the
+result of the job which last produced the result, which outlives the entry.
+The ``[memoize]`` section of the configuration sets the number of seconds an
+entry lives for since it was last used, ``ttl``, which is at most the
+lifetime of a job, and the number of entries kept, ``max_entries``, beyond
+which the least recently used entries are evicted.
+
+The number of ``lookups``, ``hits``, ``stores`` and ``evictions`` are
+counted in ``moi:memo:stats``, and reported by ``stats`` and the Prometheus
+metrics of ``moi.metrics``.
+"""
+
+# -----------------------------------------------------------------------------
+# Copyright (c) 2014--, The qiita Development Team.
+#
+# Distributed under the terms of the BSD 3-clause License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# -----------------------------------------------------------------------------
+
+import os
+import errno
+import shutil
+from time import time
+from types import CodeType
+from hashlib import sha1
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+import moi
+from moi import r_client, REDIS_KEY_TIMEOUT
+from moi import record, scripts
+
+
+_PREFIX = 'moi:memo:'
+_INDEX_KEY = 'moi:memo'
+_STATS_KEY = 'moi:memo:stats'
+
+# the protocol arguments are pickled with, which is fixed so that keys are
+# stable across versions of Python
+_PROTOCOL = 2
+
+# the fields of an info object that describe its stored result
+_RESULT_FIELDS = ('result_key', 'result_path', 'result_size',
+                  'result_checksum', 'result_codec')
+
+_COUNTERS = ('lookups', 'hits', 'stores', 'evictions')
+
+
+def _bytes(value):
+    """Encode text to bytes for hashing"""
+    return value if isinstance(value, bytes) else value.encode('utf-8')
+
+
+class _Unordered(tuple):
+    """The type and sorted elements of a set, or sorted items of a dict"""
+
+
+def _sort_key(obj):
+    """Order objects of any type by their pickle"""
+    return pickle.dumps(obj, _PROTOCOL)
+
+
+def _canonical(obj):
+    """Put the sets and dicts within an object in a fixed order
+
+    The iteration order of sets, and of dicts in Python 2, depends on the
+    hashes of their elements, which differ between processes for strings.
+    """
+    if isinstance(obj, (set, frozenset)):
+        return _Unordered((type(obj).__name__, ) + tuple(
+            sorted((_canonical(item) for item in obj), key=_sort_key)))
+    if isinstance(obj, dict):
+        return _Unordered((type(obj).__name__, ) + tuple(
+            sorted(((_canonical(k), _canonical(v)) for k, v in obj.items()),
+                   key=lambda item: _sort_key(item[0]))))
+    if type(obj) in (list, tuple):
+        return type(obj)(_canonical(item) for item in obj)
+    return obj
+
+
+def _const_repr(const):
+    """The repr of a constant of a code object, with frozensets sorted"""
+    if isinstance(const, frozenset):
+        return 'frozenset(%s)' % ', '.join(sorted(_const_repr(c)
+                                                  for c in const))
+    if isinstance(const, tuple):
+        return '(%s)' % ', '.join(_const_repr(c) for c in const)
+    return repr(const)
+
+
+def _hash_code(digest, code):
+    """Add a code object, including those nested in it, to a digest"""
+    digest.update(_bytes(code.co_code))
+    # the globals and attributes the code refers to
+    digest.update(_bytes(repr(code.co_names)))
+    for const in code.co_consts:
+        if isinstance(const, CodeType):
+            _hash_code(digest, const)
+        else:
+            digest.update(_bytes(_const_repr(const)))
+
+
+def memo_key(func, args, kwargs):
+    """Get the key of a run of a function
+
+    Parameters
+    ----------
+    func : function
+        The function
+    args : tuple
+        The args of the run
+    kwargs : dict
+        The kwargs of the run
+
+    Returns
+    -------
+    str or None
+        The key, or None if the run cannot be memoized
+    """
+    digest = sha1()
+    try:
+        code = getattr(func, '__code__', None)
+        if code is None:
+            # builtins and classes pickle by reference, partials by value
+            digest.update(pickle.dumps(func, _PROTOCOL))
+        else:
+            digest.update(_bytes('%s.%s' % (func.__module__,
+                                            func.__name__)))
+            _hash_code(digest, code)
+            cells = [cell.cell_contents for cell in func.__closure__ or ()]
+            digest.update(pickle.dumps(_canonical((func.__defaults__, cells)),
+                                       _PROTOCOL))
+
+        digest.update(pickle.dumps(_canonical((args, kwargs)), _PROTOCOL))
+    except (pickle.PicklingError, TypeError, AttributeError, ValueError):
+        return None
+
+    return _PREFIX + digest.hexdigest()
+
+
+def lookup(key):
+    """Look up the cached result of a run
+
+    Parameters
+    ----------
+    key : str
+        The key of the run, see ``memo_key``
+
+    Returns
+    -------
+    dict or None
+        The result fields of the job which computed the result, or None if
+        the run is not cached
+    """
+    with r_client.pipeline(transaction=False) as pipe:
+        pipe.hgetall(key)
+        pipe.hincrby(_STATS_KEY, 'lookups', 1)
+        fields = pipe.execute()[0]
+
+    if not fields:
+        return None
+    return record.decode(fields)
+
+
+def copy_result(fields, id_):
+    """Copy a cached result to a job
+
+    Parameters
+    ----------
+    fields : dict
+        The result fields of the job which computed the result
+    id_ : str
+        The ID of the job to copy the result to
+
+    Returns
+    -------
+    dict or None
+        The result fields of the job, or None if the cached result no longer
+        exists
+    """
+    copied = dict((field, fields.get(field)) for field in _RESULT_FIELDS)
+
+    if fields.get('result_path') is not None:
+        copied['result_path'] = os.path.join(
+            os.path.dirname(fields['result_path']), id_)
+        try:
+            # a link shares the data, and outlives the removal of the source
+            os.link(fields['result_path'], copied['result_path'])
+        except OSError as e:
+            if e.errno == errno.ENOENT:
+                return None
+            try:
+                shutil.copyfile(fields['result_path'], copied['result_path'])
+            except IOError as e:
+                if e.errno == errno.ENOENT:
+                    return None
+                raise
+        return copied
+
+    if fields.get('result_key') is None:
+        return None
+
+    copied['result_key'] = record._result_key(id_)
+    if not scripts.run(scripts.COPY_RESULT,
+                       [fields['result_key'], copied['result_key']],
+                       [REDIS_KEY_TIMEOUT]):
+        return None
+    return copied
+
+
+def _store_entry(pipe, key, info):
+    """Queue the storage of an entry referring to the result of a job"""
+    fields = dict((field, info.get(field)) for field in _RESULT_FIELDS)
+    record.store(dict(fields, id=key), pipe, expire=moi.memo_ttl)
+    pipe.zadd(_INDEX_KEY, **{key: time()})
+
+
+def hit(key, fields, pipe=None):
+    """Count a hit, referring the entry to the copy of the result
+
+    Parameters
+    ----------
+    key : str
+        The key of the run
+    fields : dict
+        The result fields of the job the result was copied to
+    pipe : redis.client.BasePipeline, optional
+        A pipeline to queue the commands on. If not provided, the commands
+        are executed immediately.
+    """
+    if pipe is None:
+        with r_client.pipeline(transaction=False) as pipe:
+            hit(key, fields, pipe)
+            pipe.execute()
+        return
+
+    _store_entry(pipe, key, fields)
+    pipe.hincrby(_STATS_KEY, 'hits', 1)
+
+
+def forget(key):
+    """Remove an entry, e.g. as its result no longer exists
+
+    Parameters
+    ----------
+    key : str
+        The key of the run
+    """
+    with r_client.pipeline(transaction=False) as pipe:
+        pipe.delete(key)
+        pipe.zrem(_INDEX_KEY, key)
+        pipe.execute()
+
+
+def remember(key, info):
+    """Cache the result of a successful run, evicting the least recently used
+
+    Parameters
+    ----------
+    key : str
+        The key of the run
+    info : dict
+        The info object of the job which computed the result
+    """
+    with r_client.pipeline(transaction=False) as pipe:
+        _store_entry(pipe, key, info)
+        pipe.hincrby(_STATS_KEY, 'stores', 1)
+        pipe.zcard(_INDEX_KEY)
+        size = pipe.execute()[-1]
+
+    excess = size - moi.memo_max_entries
+    if excess <= 0:
+        return
+
+    # concurrent evictions may evict a few more entries than needed, which
+    # only costs misses
+    evicted = r_client.zrange(_INDEX_KEY, 0, excess - 1)
+    if not evicted:
+        return
+    with r_client.pipeline(transaction=False) as pipe:
+        pipe.delete(*evicted)
+        pipe.zrem(_INDEX_KEY, *evicted)
+        pipe.hincrby(_STATS_KEY, 'evictions', len(evicted))
+        pipe.execute()
+
+
+def stats():
+    """Get the counters of the cache
+
+    Returns
+    -------
+    dict
+        The number of ``lookups``, ``hits``, ``stores`` and ``evictions``,
+        and the ``hit_rate``, which is None if there were no lookups
+    """
+    counts = r_client.hmget(_STATS_KEY, *_COUNTERS)
+    result = dict((name, int(n or 0)) for name, n in zip(_COUNTERS, counts))
+    result['hit_rate'] = (float(result['hits']) / result['lookups']
+                          if result['lookups'] else None)
+    return result
+
+
+class MemoizedResult(object):
+    """The result of a job completed from the cache
+
+    This provides the subset of an IPython AsyncResult used with jobs.
+
+    Parameters
+    ----------
+    id_ : str
+        The ID of the job
+    """
+    msg_ids = []
+
+    def __init__(self, id_):
+        self.id = id_
+
+    def ready(self):
+        return True
+
+    def successful(self):
+        return True
+
+    def wait(self, timeout=-1):
+        pass
+
+    def get(self, timeout=-1):
+        """Get the result of the job
+
+        Returns
+        -------
+        object
+            The cached result
+        """
+        return record.fetch_result(record.fetch(self.id))
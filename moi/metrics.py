@@ -0,0 +1,235 @@
+r"""Job timing metrics in the Prometheus text format
+
+Jobs record the time they were queued, picked up by an engine, started and
+ended, and when their result was stored, in the ``time_*`` fields of their
+info objects. Once a job completes, the engine adds the following to
+histograms kept in Redis, labelled by the context of the job:
+
+    moi_job_queue_wait_seconds
+        The time from queueing to being picked up by an engine
+    moi_job_run_seconds
+        The time the function of the job ran for
+    moi_job_redis_seconds
+        The time the job spent writing its status and info object to Redis,
+        which excludes encoding and storing its result, see
+        ``moi_job_result_bytes``
+    moi_job_result_bytes
+        The size of the encoded result
+
+The counters of the memoization of results (see ``moi.memo``) are reported
+as ``moi_memo_<counter>_total``.
+
+The connection pool of the Redis client of the serving process (see
+``moi.connection.pool_stats``) is reported as the gauges
+``moi_redis_pool_max_connections``, ``moi_redis_pool_in_use`` and
+``moi_redis_pool_created``, and, if ``max_connections`` is configured, the
+counters ``moi_redis_pool_waits_total`` and
+``moi_redis_pool_exhausted_total``, the number of times a command waited
+for a connection and gave up waiting.
+
+As the histograms are kept in Redis, every web server reports the jobs of
+every engine. ``MetricsHandler`` serves them to a Prometheus server.
+"""
+
+# -----------------------------------------------------------------------------
+# Copyright (c) 2014--, The qiita Development Team.
+#
+# Distributed under the terms of the BSD 3-clause License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# -----------------------------------------------------------------------------
+
+from bisect import bisect_left
+
+from tornado.web import RequestHandler
+
+from moi import r_client
+from moi import memo
+from moi.connection import pool_stats
+
+
+_TIME_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10,
+                 30, 60, 300, 900, 3600, 14400, 86400)
+_REDIS_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                  0.25, 0.5, 1, 5)
+_SIZE_BUCKETS = tuple(2 ** i for i in range(10, 32, 2))
+
+# the type and help of the statistics of the connection pool of the process
+POOL_METRICS = {
+    'max_connections': ('gauge', 'Maximum number of Redis connections'),
+    'in_use': ('gauge', 'Redis connections in use'),
+    'created': ('gauge', 'Redis connections created'),
+    'waits': ('counter', 'Commands which waited for a Redis connection'),
+    'exhausted': ('counter', 'Commands which timed out waiting for a Redis '
+                  'connection')}
+
+# the help and upper bounds of the buckets of each histogram. Counts are
+# stored by the index of their bucket, so bounds may only be appended to
+HISTOGRAMS = {
+    'moi_job_queue_wait_seconds': (
+        'Time from queueing a job to an engine picking it up',
+        _TIME_BUCKETS),
+    'moi_job_run_seconds': (
+        'Time the function of a job ran for',
+        _TIME_BUCKETS),
+    'moi_job_redis_seconds': (
+        'Time a job spent writing its status and info object to Redis',
+        _REDIS_BUCKETS),
+    'moi_job_result_bytes': (
+        'Size of the encoded result of a job',
+        _SIZE_BUCKETS)}
+
+
+def _metrics_key(name):
+    """Create a key that corresponds to a histogram
+
+    Parameters
+    ----------
+    name : str
+        The name of the histogram
+
+    Returns
+    -------
+    str
+        The key
+    """
+    return 'moi:metrics:' + name
+
+
+def observe(pipe, name, context, value):
+    """Queue the addition of a value to a histogram
+
+    Parameters
+    ----------
+    pipe : redis.client.BasePipeline
+        The pipeline to queue the addition on
+    name : str
+        The name of the histogram, one of ``HISTOGRAMS``
+    context : str
+        The context the value is labelled with
+    value : float
+        The value
+    """
+    buckets = HISTOGRAMS[name][1]
+    key = _metrics_key(name)
+
+    # the first bucket whose upper bound is not less than the value, where
+    # the index past the last bound is the +Inf bucket
+    pipe.hincrby(key, '%s:%d' % (context, bisect_left(buckets, value)), 1)
+    pipe.hincrby(key, context + ':count', 1)
+    pipe.hincrbyfloat(key, context + ':sum', value)
+
+
+def _elapsed(info, start, end):
+    """The seconds between two time fields of an info object, or None"""
+    if info.get(start) is None or info.get(end) is None:
+        return None
+    return max(0.0, info[end] - info[start])
+
+
+def observe_job(info, redis_seconds):
+    """Add a completed job to the histograms
+
+    Parameters
+    ----------
+    info : dict
+        The info object of the job
+    redis_seconds : float
+        The time the job spent writing its status and info object to Redis
+    """
+    context = info.get('context') or ''
+    values = (('moi_job_queue_wait_seconds',
+               _elapsed(info, 'time_queued', 'time_picked_up')),
+              ('moi_job_run_seconds',
+               _elapsed(info, 'time_started', 'time_ended')),
+              ('moi_job_redis_seconds', redis_seconds),
+              ('moi_job_result_bytes', info.get('result_size')))
+
+    with r_client.pipeline(transaction=False) as pipe:
+        for name, value in values:
+            if value is not None:
+                observe(pipe, name, context, value)
+        pipe.execute()
+
+
+def _escape(value):
+    """Escape a label value"""
+    return (value.replace('\\', '\\\\').replace('"', '\\"')
+            .replace('\n', '\\n'))
+
+
+def _bound(bound):
+    """Format the upper bound of a bucket"""
+    return '+Inf' if bound is None else repr(float(bound))
+
+
+def render():
+    """Render the histograms in the Prometheus text format
+
+    Returns
+    -------
+    str
+        The exposition of every histogram, of the memoization counters and
+        of the connection pool of the process
+    """
+    names = sorted(HISTOGRAMS)
+    with r_client.pipeline(transaction=False) as pipe:
+        for name in names:
+            pipe.hgetall(_metrics_key(name))
+        stored = pipe.execute()
+
+    lines = []
+    for name, fields in zip(names, stored):
+        help_, buckets = HISTOGRAMS[name]
+        bounds = buckets + (None, )
+        lines.append('# HELP %s %s' % (name, help_))
+        lines.append('# TYPE %s histogram' % name)
+
+        contexts = {}
+        for field, value in fields.items():
+            context, _, kind = field.rpartition(':')
+            counts = contexts.setdefault(context, {'sum': 0.0, 'count': 0})
+            counts.setdefault('buckets', [0] * len(bounds))
+            if kind == 'sum':
+                counts['sum'] = float(value)
+            elif kind == 'count':
+                counts['count'] = int(value)
+            elif int(kind) < len(bounds):
+                counts['buckets'][int(kind)] = int(value)
+
+        for context in sorted(contexts):
+            counts = contexts[context]
+            label = 'context="%s"' % _escape(context)
+
+            cumulative = 0
+            for bound, n in zip(bounds, counts['buckets']):
+                cumulative += n
+                lines.append('%s_bucket{%s,le="%s"} %d' %
+                             (name, label, _bound(bound), cumulative))
+            lines.append('%s_sum{%s} %r' % (name, label, counts['sum']))
+            lines.append('%s_count{%s} %d' % (name, label, counts['count']))
+
+    for counter, value in sorted(memo.stats().items()):
+        if counter == 'hit_rate':
+            continue
+        name = 'moi_memo_%s_total' % counter
+        lines.append('# HELP %s Memoized result %s' % (name, counter))
+        lines.append('# TYPE %s counter' % name)
+        lines.append('%s %d' % (name, value))
+
+    for stat, value in sorted(pool_stats(r_client).items()):
+        kind, help_ = POOL_METRICS[stat]
+        name = 'moi_redis_pool_%s%s' % (stat,
+                                        '_total' if kind == 'counter' else '')
+        lines.append('# HELP %s %s' % (name, help_))
+        lines.append('# TYPE %s %s' % (name, kind))
+        lines.append('%s %d' % (name, value))
+
+    return '\n'.join(lines) + '\n'
+
+
+class MetricsHandler(RequestHandler):
+    """Serve the job metrics to Prometheus"""
+    def get(self):
+        self.set_header('Content-Type', 'text/plain; version=0.0.4')
+        self.write(render())
@@ -0,0 +1,204 @@
+r"""Process-wide Redis pub/sub multiplexing
+
+A single pub/sub connection is shared by every ``Group`` within a process.
+Channels are reference counted: the connection subscribes to a channel when
+its first listener is registered, and unsubscribes when its last listener
+is removed. Incoming messages are fanned out to every listener of the
+channel, so a message is received once per process regardless of how many
+listeners are interested in it.
+
+Hooks registered with ``add_hook`` see every message exactly once, before
+it is fanned out, which is where state shared between listeners, such as
+the cache of job info, is kept current.
+
+A subscription is only active once Redis confirms it, so messages published
+in between are not received. Each subscription is identified by a generation
+from its confirmation onwards, see ``Subscriber.generation``.
+"""
+
+# -----------------------------------------------------------------------------
+# Copyright (c) 2014--, The qiita Development Team.
+#
+# Distributed under the terms of the BSD 3-clause License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# -----------------------------------------------------------------------------
+
+from itertools import count
+
+from tornado.log import app_log
+
+import moi
+from moi.connection import create_pubsub_client
+
+
+class Subscriber(object):
+    """A reference counted registry of pub/sub listeners
+
+    Parameters
+    ----------
+    client : toredis.Client, optional
+        The pub/sub client to use. If not provided, a client is created and
+        connected as described by the configuration when the first channel
+        is subscribed to.
+    """
+    def __init__(self, client=None):
+        self._client = client
+        self._listeners = {}
+        self._hooks = []
+        self._generations = {}
+        self._pending = {}
+        self._counter = count(1)
+
+    @property
+    def client(self):
+        """The pub/sub client, connected on first use"""
+        if self._client is None:
+            self._client = create_pubsub_client(moi._get_config())
+        return self._client
+
+    @property
+    def channels(self):
+        """The channels currently subscribed to"""
+        return set(self._listeners)
+
+    def listeners(self, channel):
+        """Get the listeners of a channel
+
+        Parameters
+        ----------
+        channel : str
+            The channel
+
+        Returns
+        -------
+        list of function
+            The listeners, in order of registration
+        """
+        return list(self._listeners.get(channel, []))
+
+    def generation(self, channel):
+        """Identify the current subscription to a channel
+
+        Parameters
+        ----------
+        channel : str
+            The channel
+
+        Returns
+        -------
+        int or None
+            A number which changes every time the channel is subscribed to
+            anew, or None if the channel is not subscribed to or Redis has
+            yet to confirm the subscription. Every message published on a
+            channel while its generation is unchanged has been received.
+        """
+        return self._generations.get(channel)
+
+    def add_hook(self, callback):
+        """Register a function which receives every message before listeners
+
+        Parameters
+        ----------
+        callback : function
+            A function which accepts a message tuple of the form
+            (message_type, channel, payload). Registering a hook more than
+            once has no effect.
+        """
+        if callback not in self._hooks:
+            self._hooks.append(callback)
+
+    def subscribe(self, channel, callback):
+        """Register a listener on a channel
+
+        Parameters
+        ----------
+        channel : str
+            The channel to listen to
+        callback : function
+            A function which accepts a message tuple of the form
+            (message_type, channel, payload). A callback can be registered on
+            the same channel more than once, in which case it must be
+            unsubscribed an equal number of times.
+        """
+        listeners = self._listeners.get(channel)
+        if listeners is None:
+            self._listeners[channel] = [callback]
+            # the generation is set once every subscription sent is confirmed
+            self._pending[channel] = self._pending.get(channel, 0) + 1
+            self.client.subscribe(channel, callback=self._dispatch)
+        else:
+            listeners.append(callback)
+
+    def unsubscribe(self, channel, callback):
+        """Remove a listener from a channel
+
+        Parameters
+        ----------
+        channel : str
+            The channel to stop listening to
+        callback : function
+            The function previously registered with ``subscribe``
+
+        Returns
+        -------
+        bool
+            True if the listener was removed, False if it was not registered
+        """
+        listeners = self._listeners.get(channel)
+        if listeners is None or callback not in listeners:
+            return False
+
+        listeners.remove(callback)
+        if not listeners:
+            del self._listeners[channel]
+            self._generations.pop(channel, None)
+            self.client.unsubscribe(channel)
+
+        return True
+
+    def _dispatch(self, msg):
+        """Pass a message to the hooks, and fan out to its listeners
+
+        Parameters
+        ----------
+        msg : tuple, (str, str, str)
+            The message sent over the line. The `tuple` is of the form:
+            (message_type, channel, payload).
+
+        Notes
+        -----
+        An exception raised by a hook or a listener is logged, and does not
+        prevent the remaining hooks and listeners from receiving the message.
+        The confirmation of the last subscription sent to a channel which is
+        still listened to starts a new generation of the channel.
+        """
+        channel = msg[1]
+        if msg[0] == 'subscribe' and self._pending.get(channel):
+            self._pending[channel] -= 1
+            if not self._pending[channel]:
+                del self._pending[channel]
+                if channel in self._listeners:
+                    self._generations[channel] = next(self._counter)
+        for callback in self._hooks + self.listeners(channel):
+            try:
+                callback(msg)
+            except Exception:
+                app_log.exception("Pub/sub listener failed on %s" % channel)
+
+
+_subscriber = None
+
+
+def get_subscriber():
+    """Get the process-wide subscriber
+
+    Returns
+    -------
+    Subscriber
+        The subscriber shared by every ``Group`` in the process
+    """
+    global _subscriber
+    if _subscriber is None:
+        _subscriber = Subscriber()
+    return _subscriber
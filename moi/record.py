@@ -0,0 +1,427 @@
+r"""Storage of job and group info in Redis
+
+Info objects are stored as Redis hashes keyed by their ID, where each field
+of the info object is a hash field holding the JSON encoded value. This
+allows a single field, such as the status, to be modified without reading or
+rewriting the remainder of the info object.
+
+Info objects written by earlier versions of moi are stored as a single JSON
+encoded string. These are still readable, and are converted to hashes the
+first time they are written.
+
+The result of a job is not part of its info object. It is stored under a
+separate key, and the info object only holds a reference to that key along
+with the size, checksum and codec (see ``moi.codec``) of the stored result.
+This keeps info objects small regardless of the size of the result, and
+results are only transferred when explicitly requested. Very large results
+can be offloaded to files on a shared filesystem, in which case the info
+object holds the path of the file.
+"""
+
+# -----------------------------------------------------------------------------
+# Copyright (c) 2014--, The qiita Development Team.
+#
+# Distributed under the terms of the BSD 3-clause License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# -----------------------------------------------------------------------------
+
+import os
+import json
+import mmap
+import errno
+from io import BytesIO
+from hashlib import sha1
+from tempfile import mkstemp
+
+from redis import ResponseError
+
+import moi
+from moi import r_client
+from moi.codec import encode as encode_result, decode as decode_result
+
+
+def encode(info):
+    """Encode an info object into hash fields
+
+    Parameters
+    ----------
+    info : dict
+        The info object, or a subset of its fields
+
+    Returns
+    -------
+    dict of {str: str}
+        The JSON encoded value of each field
+    """
+    return {key: json.dumps(value) for key, value in info.items()}
+
+
+def decode(payload):
+    """Decode an info object as returned by Redis
+
+    Parameters
+    ----------
+    payload : dict or str
+        The fields of a hash, or a JSON encoded string for legacy info
+        objects
+
+    Raises
+    ------
+    ValueError
+        If the payload cannot be decoded
+
+    Returns
+    -------
+    dict
+        The decoded info object
+    """
+    try:
+        if isinstance(payload, dict):
+            return {key: json.loads(value) for key, value in payload.items()}
+        else:
+            return json.loads(payload)
+    except (ValueError, TypeError):
+        raise ValueError("Unable to decode data!")
+
+
+def fetch_many(ids):
+    """Fetch the raw info objects for IDs in a single round trip
+
+    Parameters
+    ----------
+    ids : list of str
+        The IDs to fetch
+
+    Notes
+    -----
+    Both the hash and legacy string form are requested for every ID within
+    a single pipeline. At most one of them can succeed as a key has a single
+    type, and the other is discarded.
+
+    Returns
+    -------
+    list of {dict, str, None}
+        The raw payload for each ID, in order, suitable for ``decode``. None
+        is used if the ID does not exist or is of an unexpected type.
+    """
+    if not ids:
+        return []
+
+    with r_client.pipeline(transaction=False) as pipe:
+        for id_ in ids:
+            pipe.hgetall(id_)
+            pipe.get(id_)
+        replies = pipe.execute(raise_on_error=False)
+
+    result = []
+    for fields, legacy in zip(replies[::2], replies[1::2]):
+        if fields and not isinstance(fields, ResponseError):
+            result.append(fields)
+        elif legacy is not None and not isinstance(legacy, ResponseError):
+            result.append(legacy)
+        else:
+            result.append(None)
+    return result
+
+
+def fetch(id_):
+    """Fetch and decode an info object
+
+    Parameters
+    ----------
+    id_ : str
+        The ID to fetch
+
+    Raises
+    ------
+    ValueError
+        If the info object cannot be decoded
+
+    Returns
+    -------
+    dict or None
+        The info object, or None if it does not exist
+    """
+    payload = fetch_many([id_])[0]
+    return None if payload is None else decode(payload)
+
+
+def store(info, pipe=None, expire=None):
+    """Store a complete info object
+
+    Parameters
+    ----------
+    info : dict
+        The info object to store, it must contain an ``id``.
+    pipe : redis.client.BasePipeline, optional
+        A pipeline to queue the commands on. If not provided, the commands
+        are executed immediately within a transaction.
+    expire : int or None, optional
+        The number of seconds until the info object expires, or None for no
+        expiration.
+
+    Notes
+    -----
+    Any existing info object under the same ID, including a legacy string,
+    is replaced.
+    """
+    if pipe is None:
+        with r_client.pipeline() as pipe:
+            store(info, pipe, expire)
+            pipe.execute()
+        return
+
+    id_ = info['id']
+    pipe.delete(id_)
+    pipe.hmset(id_, encode(info))
+    if expire is not None:
+        pipe.expire(id_, expire)
+
+
+def update(id_, fields, pipe=None, expire=None):
+    """Update a subset of the fields of an info object
+
+    Parameters
+    ----------
+    id_ : str
+        The ID of the info object
+    fields : dict
+        The fields to set
+    pipe : redis.client.BasePipeline, optional
+        A pipeline to queue the commands on. If not provided, the commands
+        are executed immediately within a transaction.
+    expire : int or None, optional
+        The number of seconds until the info object expires, or None to leave
+        the expiration untouched.
+
+    Notes
+    -----
+    If the info object is a legacy string, the update fails with a
+    ``redis.ResponseError`` when the commands are executed. ``convert`` can
+    be used to upgrade the info object prior to retrying.
+    """
+    if pipe is None:
+        with r_client.pipeline() as pipe:
+            update(id_, fields, pipe, expire)
+            pipe.execute()
+        return
+
+    pipe.hmset(id_, encode(fields))
+    if expire is not None:
+        pipe.expire(id_, expire)
+
+
+def convert(id_, expire=None):
+    """Convert a legacy string info object into a hash
+
+    Parameters
+    ----------
+    id_ : str
+        The ID of the info object
+    expire : int or None, optional
+        The number of seconds until the info object expires, or None for no
+        expiration.
+
+    Returns
+    -------
+    dict or None
+        The info object, or None if it does not exist
+    """
+    info = fetch(id_)
+    if info is not None:
+        store(info, expire=expire)
+    return info
+
+
+def _result_key(id_):
+    """Create a key that corresponds to the result of a job
+
+    Parameters
+    ----------
+    id_ : str
+        The job ID
+
+    Returns
+    -------
+    str
+        The augmented key
+    """
+    return id_ + ':result'
+
+
+def _checksum(data):
+    """Compute the checksum of encoded data, or of a buffer of it"""
+    if not isinstance(data, bytes) and hasattr(data, 'encode'):
+        data = data.encode('utf-8')
+    return sha1(data).hexdigest()
+
+
+def _write_file(path, data):
+    """Write data to a file, which appears complete or not at all"""
+    directory = os.path.dirname(path)
+    fd, tmp = mkstemp(dir=directory, prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        # readable by the readers of results, which may run as other users
+        os.chmod(tmp, 0o644)
+        os.rename(tmp, path)
+    except Exception:
+        os.remove(tmp)
+        raise
+
+
+def store_result(id_, result, pipe=None, expire=None, codec=None):
+    """Store the result of a job out of line of its info object
+
+    Parameters
+    ----------
+    id_ : str
+        The job ID
+    result : object
+        The result, which must be serializable by the codec
+    pipe : redis.client.BasePipeline, optional
+        A pipeline to queue the commands on. If not provided, the commands
+        are executed immediately.
+    expire : int or None, optional
+        The number of seconds until the result expires, or None for no
+        expiration. Results offloaded to files do not expire.
+    codec : str, optional
+        The codec to encode the result with, see ``moi.codec``. Defaults to
+        the ``result_codec`` of the configuration.
+
+    Notes
+    -----
+    If the ``result_directory`` of the configuration is set, results whose
+    encoding is larger than ``result_offload_size`` bytes are written to a
+    file named by the job ID in that directory instead of to Redis. The
+    directory must be shared by the engines and the readers of results.
+
+    Returns
+    -------
+    dict
+        The ``result_key`` or ``result_path``, and the ``result_size``,
+        ``result_checksum`` and ``result_codec`` fields to record in the info
+        object of the job
+    """
+    codec = moi.result_codec if codec is None else codec
+    encoded = encode_result(result, codec)
+
+    fields = {'result_key': None,
+              'result_path': None,
+              'result_size': len(encoded),
+              'result_checksum': _checksum(encoded),
+              'result_codec': codec}
+
+    if (moi.result_directory is not None and
+            len(encoded) > moi.result_offload_size):
+        fields['result_path'] = os.path.join(moi.result_directory, id_)
+        _write_file(fields['result_path'], encoded)
+        return fields
+
+    fields['result_key'] = _result_key(id_)
+    if pipe is None:
+        r_client.set(fields['result_key'], encoded, ex=expire)
+    else:
+        pipe.set(fields['result_key'], encoded, ex=expire)
+
+    return fields
+
+
+def _map_result(path):
+    """Memory map a result file, or None if it does not exist"""
+    try:
+        f = open(path, 'rb')
+    except IOError as e:
+        if e.errno == errno.ENOENT:
+            return None
+        raise
+
+    with f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return b''
+        # the mapping remains valid once the file is closed
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def fetch_result(info):
+    """Fetch the result of a job
+
+    Parameters
+    ----------
+    info : dict
+        The info object of the job
+
+    Raises
+    ------
+    ValueError
+        If the stored result does not match its checksum, or cannot be
+        decoded.
+
+    Notes
+    -----
+    Results offloaded to files are memory mapped rather than read. The NumPy
+    arrays of results encoded with an uncompressed pickle codec with out of
+    band buffers are backed by the file, while those of other codecs are
+    copied into memory, see ``moi.codec``. Use ``open_result`` to stream
+    large results instead.
+
+    Returns
+    -------
+    object or None
+        The result, or None if the job does not have a result
+    """
+    if info.get('result_path') is not None:
+        encoded = _map_result(info['result_path'])
+    elif info.get('result_key') is not None:
+        encoded = r_client.get(info['result_key'])
+    else:
+        # legacy info objects carry the result inline
+        return info.get('result')
+
+    if encoded is None:
+        return None
+
+    if _checksum(encoded) != info.get('result_checksum'):
+        raise ValueError("Result of %s does not match its checksum!" %
+                         info['id'])
+
+    # results stored prior to codecs are JSON
+    return decode_result(encoded, info.get('result_codec') or 'json')
+
+
+def open_result(info):
+    """Open the encoded result of a job for reading
+
+    Parameters
+    ----------
+    info : dict
+        The info object of the job
+
+    Notes
+    -----
+    This allows the encoded result to be streamed, e.g. to an HTTP client,
+    without holding results offloaded to files in memory. The checksum is
+    not verified.
+
+    Returns
+    -------
+    file or None
+        A binary file-like object of the encoded result, or None if the job
+        does not have a stored result
+    """
+    if info.get('result_path') is not None:
+        try:
+            return open(info['result_path'], 'rb')
+        except IOError as e:
+            if e.errno == errno.ENOENT:
+                return None
+            raise
+
+    if info.get('result_key') is not None:
+        encoded = r_client.get(info['result_key'])
+        if encoded is not None:
+            return BytesIO(encoded)
+
+    return None
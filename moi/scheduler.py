@@ -0,0 +1,194 @@
+r"""Load-aware routing of submissions across IPython contexts
+
+Submitting through the ``auto`` context, or with ``auto`` as the default
+context of the configuration, routes each submission to the context with the
+fewest outstanding tasks per engine, as reported by the queue status of its
+controller. The ``[scheduler]`` section of the configuration accepts:
+
+    weights : str
+        A comma separated list of ``context:weight``, where a context with a
+        weight of 2 is given twice the load of a context with a weight of 1
+        before it is considered as loaded. Contexts default to a weight of 1,
+        and a weight of 0 excludes a context from automatic routing.
+    pins : str
+        A comma separated list of ``pattern:context``, where jobs whose name
+        matches the shell-style pattern are routed to the context, if it is
+        connected, regardless of load. The first matching pattern applies.
+    refresh : float
+        The number of seconds the queue status of a context is reused for.
+        Submissions made in between are accounted for locally.
+
+Contexts which cannot report their queue status, or have no engines, are
+not routed to.
+"""
+
+# -----------------------------------------------------------------------------
+# Copyright (c) 2014--, The qiita Development Team.
+#
+# Distributed under the terms of the BSD 3-clause License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# -----------------------------------------------------------------------------
+
+from fnmatch import fnmatchcase
+from threading import Lock
+from time import time
+
+import moi
+
+
+AUTO = 'auto'
+
+
+def queue_load(status):
+    """Get the outstanding tasks and engines from a queue status
+
+    Parameters
+    ----------
+    status : dict
+        The queue status of an IPython client, which holds the ``queue`` and
+        ``tasks`` of each engine, and the ``unassigned`` tasks
+
+    Returns
+    -------
+    tuple, (int, int)
+        The number of outstanding tasks and the number of engines
+    """
+    engines = [v for k, v in status.items() if k != 'unassigned']
+    outstanding = status.get('unassigned', 0)
+    for engine in engines:
+        outstanding += engine.get('queue', 0) + engine.get('tasks', 0)
+    return outstanding, len(engines)
+
+
+class Scheduler(object):
+    """Route submissions to the least loaded context
+
+    Parameters
+    ----------
+    contexts : dict of str: Context, optional
+        The contexts to route between. Defaults to the connected contexts.
+    """
+    def __init__(self, contexts=None):
+        self._contexts = contexts
+        self._snapshots = {}
+        self._lock = Lock()
+
+    @property
+    def contexts(self):
+        """The contexts to route between"""
+        return moi.ctxs if self._contexts is None else self._contexts
+
+    def _snapshot(self, name):
+        """Get the load of a context, querying it if the load is stale
+
+        The lock must be held.
+
+        Returns
+        -------
+        dict
+            The ``time`` the context was queried, the ``outstanding`` tasks
+            including those submitted since, and its ``engines``, which is 0
+            if the context is not healthy
+        """
+        snapshot = self._snapshots.get(name)
+        if snapshot is not None and \
+                time() - snapshot['time'] < moi.scheduler_refresh:
+            return snapshot
+
+        try:
+            outstanding, engines = queue_load(
+                self.contexts[name].client.queue_status())
+        except Exception:
+            # any failure to report the status marks the context unhealthy
+            outstanding, engines = 0, 0
+
+        snapshot = {'time': time(), 'outstanding': outstanding,
+                    'engines': engines}
+        self._snapshots[name] = snapshot
+        return snapshot
+
+    def load(self, name):
+        """Get the load of a context
+
+        Parameters
+        ----------
+        name : str
+            The name of the context
+
+        Returns
+        -------
+        float or None
+            The outstanding tasks per weighted engine, or None if the context
+            is not healthy or is excluded from routing
+        """
+        weight = moi.scheduler_weights.get(name, 1.0)
+        if weight <= 0:
+            return None
+
+        with self._lock:
+            snapshot = self._snapshot(name)
+        if not snapshot['engines']:
+            return None
+
+        return snapshot['outstanding'] / float(snapshot['engines'] * weight)
+
+    def choose(self, name=None, jobs=1):
+        """Choose the context to submit through
+
+        Parameters
+        ----------
+        name : str, optional
+            The name of the job, which is matched against the pins
+        jobs : int, optional
+            The number of jobs being submitted
+
+        Raises
+        ------
+        ValueError
+            If no context is healthy
+
+        Returns
+        -------
+        Context
+            The context, to which the jobs are accounted
+        """
+        contexts = self.contexts
+
+        chosen = None
+        if name is not None:
+            for pattern, ctx_name in moi.scheduler_pins:
+                if fnmatchcase(name, pattern) and ctx_name in contexts:
+                    chosen = ctx_name
+                    break
+
+        if chosen is None:
+            loads = [(self.load(ctx_name), ctx_name)
+                     for ctx_name in sorted(contexts)]
+            loads = [(load, ctx_name) for load, ctx_name in loads
+                     if load is not None]
+            if not loads:
+                raise ValueError("No healthy context to submit through")
+            chosen = min(loads)[1]
+
+        with self._lock:
+            self._snapshot(chosen)['outstanding'] += jobs
+
+        return contexts[chosen]
+
+
+_scheduler = None
+
+
+def get_scheduler():
+    """Get the process-wide scheduler
+
+    Returns
+    -------
+    Scheduler
+        The scheduler routing submissions through the ``auto`` context
+    """
+    global _scheduler
+    if _scheduler is None:
+        _scheduler = Scheduler()
+    return _scheduler
@@ -0,0 +1,275 @@
+r"""Server-side scripts which write atomically in a single round trip
+
+Info objects are passed to the scripts as JSON objects of their encoded
+fields, see ``moi.record.encode``. Statuses are counted under the buckets
+described by ``moi.summary.bucket``, whose statuses are passed to the
+scripts writing info objects as their first argument.
+"""
+
+# -----------------------------------------------------------------------------
+# Copyright (c) 2014--, The qiita Development Team.
+#
+# Distributed under the terms of the BSD 3-clause License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# -----------------------------------------------------------------------------
+
+from moi import r_client
+
+
+_PRELUDE = """
+local canonical = {}
+for _, status in ipairs(cjson.decode(ARGV[1])) do
+    canonical[status] = true
+end
+
+-- the status an encoded status is counted under, or nil if not counted
+local function bucket(encoded)
+    if not encoded then
+        return nil
+    end
+    local status = cjson.decode(encoded)
+    if status == cjson.null then
+        return nil
+    end
+    if canonical[status] then
+        return status
+    end
+    return 'Running'
+end
+
+-- write the encoded fields of an info object, replacing it if requested
+local function store(key, encoded, replace)
+    local fields = cjson.decode(encoded)
+    if replace then
+        redis.call('DEL', key)
+    end
+
+    local flat = {}
+    for field, value in pairs(fields) do
+        flat[#flat + 1] = field
+        flat[#flat + 1] = value
+    end
+    if #flat > 0 then
+        redis.call('HMSET', key, unpack(flat))
+    end
+    return fields
+end
+"""
+
+# KEYS[1]        the group
+# KEYS[2]        the :children of the group
+# KEYS[3]        the :created index of the group
+# KEYS[4..3+n]   the :counts of the group and the groups containing it
+# KEYS[4+n..]    the info objects to create
+# ARGV[1]        the statuses counted as is
+# ARGV[2]        n, the number of :counts keys
+# ARGV[3]        the seconds until the info objects expire, or ''
+# ARGV[4]        the seconds until the counts expire
+# ARGV[5]        the info object of the group, created if the group does not
+#                exist, or ''
+# ARGV[6]        the time the info objects were created
+# ARGV[7]        the channel to publish on, or ''
+# ARGV[8]        the message to publish
+# ARGV[9..]      the encoded info objects, in the order of their keys
+CREATE = _PRELUDE + """
+local n = tonumber(ARGV[2])
+local expire = ARGV[3]
+
+if ARGV[5] ~= '' and redis.call('EXISTS', KEYS[1]) == 0 then
+    store(KEYS[1], ARGV[5], true)
+    if expire ~= '' then
+        redis.call('EXPIRE', KEYS[1], expire)
+    end
+end
+
+local increments = {}
+local counted = false
+for i = 4 + n, #KEYS do
+    local fields = store(KEYS[i], ARGV[i - n + 5], true)
+    if expire ~= '' then
+        redis.call('EXPIRE', KEYS[i], expire)
+    end
+    redis.call('SADD', KEYS[2], KEYS[i])
+    redis.call('ZADD', KEYS[3], ARGV[6], KEYS[i])
+
+    local status = bucket(fields['status'])
+    if status then
+        increments[status] = (increments[status] or 0) + 1
+        counted = true
+    end
+end
+
+if counted then
+    for i = 4, 3 + n do
+        for status, amount in pairs(increments) do
+            redis.call('HINCRBY', KEYS[i], status, amount)
+        end
+        redis.call('EXPIRE', KEYS[i], ARGV[4])
+    end
+end
+
+if ARGV[7] ~= '' then
+    redis.call('PUBLISH', ARGV[7], ARGV[8])
+end
+"""
+
+# KEYS[1]        the info object
+# KEYS[2]        the :ended index of the group of the info object
+# KEYS[3]        the :children of the group of the info object, or the info
+#                object if it has no group
+# KEYS[4..]      the :counts of the groups containing the info object
+# ARGV[1]        the statuses counted as is
+# ARGV[2]        '1' to replace the info object with the fields, '0' to
+#                update it
+# ARGV[3]        the encoded fields
+# ARGV[4]        the seconds until the info object and the counts expire
+# ARGV[5]        the new encoded status, or '' if the status is not changed
+# ARGV[6]        the time the info object ended, or '' if it has not
+# ARGV[7]        the message to publish
+# ARGV[8..]      the channels to publish on
+#
+# The counts and the :ended index are left as they are if the info object was
+# removed from its group.
+#
+# Returns the old encoded status, if any
+WRITE = _PRELUDE + """
+local old = redis.call('HGET', KEYS[1], 'status')
+
+store(KEYS[1], ARGV[3], ARGV[2] == '1')
+redis.call('EXPIRE', KEYS[1], ARGV[4])
+
+local member = KEYS[3] == KEYS[1] or
+    redis.call('SISMEMBER', KEYS[3], KEYS[1]) == 1
+
+if member and ARGV[5] ~= '' then
+    local from = bucket(old)
+    local to = bucket(ARGV[5])
+    if from ~= to then
+        for i = 4, #KEYS do
+            if from then
+                redis.call('HINCRBY', KEYS[i], from, -1)
+            end
+            if to then
+                redis.call('HINCRBY', KEYS[i], to, 1)
+            end
+            redis.call('EXPIRE', KEYS[i], ARGV[4])
+        end
+    end
+end
+
+if member and ARGV[6] ~= '' then
+    redis.call('ZADD', KEYS[2], ARGV[6], KEYS[1])
+end
+
+for i = 8, #ARGV do
+    redis.call('PUBLISH', ARGV[i], ARGV[7])
+end
+
+return old
+"""
+
+# KEYS[1]        the node to remove
+# KEYS[2]        the :children of the group of the node
+# KEYS[3]        the :created index of the group
+# KEYS[4]        the :ended index of the group
+# KEYS[5]        the :counts of the node, if it is a group
+# KEYS[6..]      the :counts of the group and the groups containing it
+# ARGV[1]        the statuses counted as is
+#
+# Returns 1 if the node was removed, or 0 if it was not a child of the group
+REMOVE = _PRELUDE + """
+if redis.call('SREM', KEYS[2], KEYS[1]) == 0 then
+    return 0
+end
+redis.call('ZREM', KEYS[3], KEYS[1])
+redis.call('ZREM', KEYS[4], KEYS[1])
+
+local counts = {}
+local info_type = redis.call('HGET', KEYS[1], 'type')
+if info_type and cjson.decode(info_type) == 'group' then
+    local flat = redis.call('HGETALL', KEYS[5])
+    for i = 1, #flat, 2 do
+        counts[flat[i]] = tonumber(flat[i + 1])
+    end
+else
+    local status = bucket(redis.call('HGET', KEYS[1], 'status'))
+    if status then
+        counts[status] = 1
+    end
+end
+
+for i = 6, #KEYS do
+    for status, n in pairs(counts) do
+        if n ~= 0 then
+            redis.call('HINCRBY', KEYS[i], status, -n)
+        end
+    end
+end
+return 1
+"""
+
+# KEYS[1]        the map of users to IDs and IDs to users
+# ARGV[1]        the user
+# ARGV[2]        the ID to map the user to, if the user is not mapped
+#
+# Returns the ID of the user
+GET_OR_CREATE_ID = """
+local id = redis.call('HGET', KEYS[1], ARGV[1])
+if id then
+    return id
+end
+
+redis.call('HSET', KEYS[1], ARGV[1], ARGV[2])
+redis.call('HSET', KEYS[1], ARGV[2], ARGV[1])
+return ARGV[2]
+"""
+
+# KEYS[1]        the result to copy
+# KEYS[2]        the copy
+# ARGV[1]        the seconds until the copy expires
+#
+# Returns 1 if the result was copied, or 0 if it does not exist
+COPY_RESULT = """
+local data = redis.call('GET', KEYS[1])
+if not data then
+    return 0
+end
+
+redis.call('SET', KEYS[2], data, 'EX', ARGV[1])
+return 1
+"""
+
+_registered = {}
+
+
+def run(script, keys, args):
+    """Run a script, registering it on first use
+
+    Parameters
+    ----------
+    script : str
+        The source of the script, ``CREATE``, ``WRITE``, ``REMOVE``,
+        ``GET_OR_CREATE_ID`` or ``COPY_RESULT``
+    keys : list of str
+        The keys the script accesses
+    args : list
+        The arguments of the script
+
+    Raises
+    ------
+    redis.ResponseError
+        If the script fails, e.g. if an info object is a legacy string. The
+        script has no effect in that case if it failed on its first command.
+
+    Returns
+    -------
+    object
+        The return of the script
+    """
+    registered = _registered.get(script)
+    if registered is None:
+        registered = _registered[script] = r_client.register_script(script)
+
+    # the client is passed on every call, as it is replaced on reconfiguring
+    return registered(keys=keys, args=args, client=r_client)
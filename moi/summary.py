@@ -0,0 +1,166 @@
+r"""Counts of jobs by status
+
+Every group holds the number of jobs by status within it and all of the
+groups it contains, in the ``<group>:counts`` hash. The counts are adjusted
+in the same transaction as the status of a job is written, so a summary of a
+group is obtained with a single read regardless of the number of jobs.
+
+Jobs are counted under one of the default statuses. Custom statuses set by
+a running job through ``moi_update_status`` are counted as Running.
+"""
+
+# -----------------------------------------------------------------------------
+# Copyright (c) 2014--, The qiita Development Team.
+#
+# Distributed under the terms of the BSD 3-clause License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# -----------------------------------------------------------------------------
+
+from moi import r_client, REDIS_KEY_TIMEOUT
+from moi import record
+from moi.cache import LRUCache
+
+
+STATUSES = ('Queued', 'Running', 'Success', 'Failed', 'Blocked')
+
+# the ancestry of groups, which does not change once a group is created
+_ancestors = LRUCache(1000)
+
+
+def _counts_key(key):
+    """Create a key that corresponds to the group's counts
+
+    Parameters
+    ----------
+    key : str
+        The group key
+
+    Returns
+    -------
+    str
+        The augmented key
+    """
+    return key + ':counts'
+
+
+def bucket(status):
+    """Get the status a job is counted under
+
+    Parameters
+    ----------
+    status : str or None
+        The status of the job
+
+    Returns
+    -------
+    str or None
+        The status the job is counted under, or None if the job is not
+        counted
+    """
+    if status is None:
+        return None
+    return status if status in STATUSES else 'Running'
+
+
+def ancestors(parent):
+    """Get a group and the groups which contain it
+
+    Parameters
+    ----------
+    parent : str or None
+        The ID of a group
+
+    Returns
+    -------
+    list of str
+        The group followed by its parent, the parent of its parent, and so
+        on. Empty if ``parent`` is None.
+    """
+    if parent is None:
+        return []
+
+    cached = _ancestors.get(parent)
+    if cached is not None:
+        return list(cached)
+
+    result = []
+    id_ = parent
+    while id_ is not None and id_ not in result:
+        result.append(id_)
+        info = record.fetch(id_)
+        if info is None:
+            # the group is not stored yet, so its ancestry may not be final
+            return result
+        id_ = info.get('parent')
+
+    _ancestors.set(parent, result)
+    return list(result)
+
+
+def count(pipe, parent, old_status, new_status, amount=1):
+    """Queue the adjustment of counts for a change of job status
+
+    Parameters
+    ----------
+    pipe : redis.client.Pipeline
+        The pipeline to queue the adjustment on
+    parent : str or None
+        The ID of the group the jobs are a part of
+    old_status : str or None
+        The status of the jobs prior to the change, None for new jobs
+    new_status : str or None
+        The status of the jobs after the change, None for removed jobs
+    amount : int, optional
+        The number of jobs changing status
+    """
+    old = bucket(old_status)
+    new = bucket(new_status)
+    if old == new:
+        return
+
+    for id_ in ancestors(parent):
+        key = _counts_key(id_)
+        if old is not None:
+            pipe.hincrby(key, old, -amount)
+        if new is not None:
+            pipe.hincrby(key, new, amount)
+        pipe.expire(key, REDIS_KEY_TIMEOUT)
+
+
+def get_summaries(ids):
+    """Get the counts of jobs by status for groups in a single round trip
+
+    Parameters
+    ----------
+    ids : list of str
+        The IDs of the groups
+
+    Returns
+    -------
+    list of dict
+        For each group, the number of jobs under each of ``STATUSES``
+    """
+    with r_client.pipeline(transaction=False) as pipe:
+        for id_ in ids:
+            pipe.hmget(_counts_key(id_), *STATUSES)
+        counts = pipe.execute()
+
+    return [{status: int(n or 0) for status, n in zip(STATUSES, c)}
+            for c in counts]
+
+
+def get_summary(id_):
+    """Get the counts of jobs by status for a group
+
+    Parameters
+    ----------
+    id_ : str
+        The ID of the group
+
+    Returns
+    -------
+    dict
+        The number of jobs under each of ``STATUSES``
+    """
+    return get_summaries([id_])[0]
@@ -100,10 +100,19 @@ var moi = new function () {
         ws.onerror = on_error;
 
         ws.onmessage = function(evt) {
-            message = decode(evt.data);
-            for(var action in message) {
-                if(action in callbacks) {
-                    callbacks[action](message[action]);
+            var messages = decode(evt.data);
+
+            // the server may batch multiple messages into a single frame
+            if (!(messages instanceof Array)) {
+                messages = [messages];
+            }
+
+            for(var i = 0; i < messages.length; i++) {
+                var message = messages[i];
+                for(var action in message) {
+                    if(action in callbacks) {
+                        callbacks[action](message[action]);
+                    }
                 }
             }
         };
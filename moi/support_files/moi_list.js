@@ -15,6 +15,10 @@ var moi_list = new function () {
     var info_ids = {};
     var info_list = null;
     var restrict_to_group_id = null;
+    // details received before the id of the group is known
+    var unclaimed = [];
+    var more_button = null;
+    var page_size = 50;
 
     function createButton(context, func){
         var button = document.createElement("input");
@@ -48,6 +52,11 @@ var moi_list = new function () {
 
 
     function addInfo(info) {
+        if(restrict_to_group_id === null) {
+            unclaimed.push(info);
+            return;
+        }
+
         if(!tracked_node(info))
             return;
 
@@ -113,20 +122,60 @@ var moi_list = new function () {
         }
     };
 
-    this.init = function (group_id, div) {
+    function requestPage(cursor) {
+        moi.send('get', {'id': restrict_to_group_id,
+                         'limit': page_size,
+                         'cursor': cursor});
+    };
+
+    function setPage(page) {
+        // without a group id, the list is of the group of the connection,
+        // which is the group of the first page
+        if(restrict_to_group_id === null) {
+            restrict_to_group_id = page.id;
+            var infos = unclaimed;
+            unclaimed = [];
+            for(var i = 0; i < infos.length; i++) {
+                addInfo(infos[i]);
+            }
+        }
+
+        if(page.id != restrict_to_group_id)
+            return;
+
+        // the cursor is null once the last page has been received
+        if(page.cursor === null) {
+            more_button.style.display = 'none';
+        } else {
+            more_button.style.display = '';
+            more_button.onclick = function () { requestPage(page.cursor); };
+        }
+    };
+
+    this.init = function (group_id, div, size) {
         if (typeof div === 'undefined') {
             div = document.body;
         }
+        if (typeof size !== 'undefined') {
+            page_size = size;
+        }
 
         restrict_to_group_id = group_id;
         info_list = document.createElement("div");
         info_list.setAttribute("id", "moi-list");
         div.appendChild(info_list);
+
+        more_button = document.createElement("input");
+        more_button.type = "button";
+        more_button.value = "More";
+        more_button.style.display = 'none';
+        div.appendChild(more_button);
         
         moi.add_callback('add', addInfo);
         moi.add_callback('get', addInfo);
         moi.add_callback('remove', removeInfo);
         moi.add_callback('update', updateInfo);
-        moi.init(group_id);
+        moi.add_callback('page', setPage);
+        moi.init(group_id, null, function () { requestPage(null); });
     };
 };
@@ -0,0 +1,315 @@
+r"""Background reclamation of expired jobs
+
+Job and group records expire ``REDIS_KEY_TIMEOUT`` seconds after they were
+last written, but the sets and indexes that reference them do not. The
+sweeper incrementally walks the keyspace with ``SCAN``, and for every group:
+
+    * removes children whose records no longer exist from ``<id>:children``,
+      ``<id>:created`` and ``<id>:ended``
+    * if children were removed, rebuilds ``<id>:counts`` from the remaining
+      children, and adjusts the counts of the groups containing it by the
+      difference (see ``moi.summary``)
+    * once a group has no children left, expires its record if it does not
+      expire already, and deletes its ``<id>:counts``
+
+When a pass over the keyspace completes, result files in the
+``result_directory`` of the configuration whose jobs no longer exist are
+removed as well.
+
+A status changed within a group while its counts are rebuilt defers the
+rebuild, and the expiration of the group, to the next pass of the sweeper.
+
+Reads never modify Redis; a sweeper is run as a periodic callback on the
+IOLoop of a server (see ``start``), or with the ``moi sweep`` command.
+"""
+
+# -----------------------------------------------------------------------------
+# Copyright (c) 2014--, The qiita Development Team.
+#
+# Distributed under the terms of the BSD 3-clause License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# -----------------------------------------------------------------------------
+
+import os
+import errno
+
+from redis import WatchError
+from tornado.ioloop import PeriodicCallback
+from tornado.log import app_log
+
+import moi
+from moi import r_client, REDIS_KEY_TIMEOUT
+from moi import record, summary
+from moi.group import (_children_key, _created_key, _ended_key,
+                       _remove_children)
+from moi.summary import _counts_key
+
+
+_CHILDREN_SUFFIX = _children_key('')
+
+
+def _new_stats():
+    """The counters of a pass, all of which start at zero"""
+    return {'groups': 0, 'children': 0, 'expired': 0, 'files': 0}
+
+
+def _exists(ids):
+    """Check whether keys exist in a single round trip"""
+    with r_client.pipeline(transaction=False) as pipe:
+        for id_ in ids:
+            pipe.exists(id_)
+        return pipe.execute()
+
+
+class Sweeper(object):
+    """An incremental sweep over the groups in Redis
+
+    Parameters
+    ----------
+    count : int, optional
+        The number of keys examined per step, and the number of children
+        examined per round trip. Defaults to the ``sweep_count`` of the
+        configuration.
+
+    Attributes
+    ----------
+    stats : dict
+        The number of ``groups`` examined, ``children`` removed, groups
+        ``expired`` and result ``files`` removed during the current pass
+    passes : int
+        The number of completed passes
+    """
+    def __init__(self, count=None):
+        self.count = moi.sweep_count if count is None else count
+        if self.count < 1:
+            raise ValueError("count must be positive: %d" % self.count)
+
+        self.cursor = 0
+        self.passes = 0
+        self.stats = _new_stats()
+
+        # the groups whose counts are yet to be rebuilt
+        self._stale = set()
+
+    def step(self):
+        """Sweep the next batch of keys
+
+        Returns
+        -------
+        dict or None
+            The stats of the pass if this step completed it, otherwise None
+        """
+        cursor, keys = r_client.scan(self.cursor, match='*' + _CHILDREN_SUFFIX,
+                                     count=self.count)
+        for key in keys:
+            self._sweep_group(key[:-len(_CHILDREN_SUFFIX)])
+        self.cursor = int(cursor)
+
+        if self.cursor != 0:
+            return None
+
+        self._sweep_files()
+        stats, self.stats = self.stats, _new_stats()
+        self.passes += 1
+        app_log.info("Swept %(groups)d groups: removed %(children)d children "
+                     "and %(files)d files, expired %(expired)d groups" %
+                     stats)
+        return stats
+
+    def sweep(self):
+        """Sweep until the current pass completes
+
+        Returns
+        -------
+        dict
+            The stats of the pass
+        """
+        while True:
+            stats = self.step()
+            if stats is not None:
+                return stats
+
+    def _sweep_group(self, group):
+        """Remove the expired children of a group, and expire it if empty
+
+        Parameters
+        ----------
+        group : str
+            The ID of the group
+        """
+        self.stats['groups'] += 1
+        key = _children_key(group)
+
+        removed = False
+        cursor = None
+        while cursor != 0:
+            cursor, children = r_client.sscan(key, cursor or 0,
+                                              count=self.count)
+            cursor = int(cursor)
+            children = list(children)
+            if not children:
+                continue
+
+            dead = [child for child, alive in zip(children, _exists(children))
+                    if not alive]
+            if dead:
+                # the record of a child is written in the same transaction
+                # as it is added to the group, so a missing record has expired
+                with r_client.pipeline(transaction=False) as pipe:
+                    _remove_children(pipe, group, dead)
+                    pipe.execute()
+                self.stats['children'] += len(dead)
+                removed = True
+
+        if removed or group in self._stale:
+            if not self._recount(group):
+                self._stale.add(group)
+                return
+            self._stale.discard(group)
+
+        with r_client.pipeline() as pipe:
+            try:
+                # a child added meanwhile aborts the transaction
+                pipe.watch(key)
+                if pipe.exists(key):
+                    return
+                ttl = pipe.ttl(group)
+
+                pipe.multi()
+                pipe.delete(_counts_key(group), _created_key(group),
+                            _ended_key(group))
+                # redis-py reports keys without an expiration as None or -1,
+                # and missing keys as -2
+                expire = ttl is None or ttl == -1
+                if expire:
+                    pipe.expire(group, REDIS_KEY_TIMEOUT)
+                pipe.execute()
+            except WatchError:
+                return
+
+        if expire:
+            self.stats['expired'] += 1
+
+    def _recount(self, group):
+        """Rebuild the counts of a group from its children
+
+        The counts of the groups containing the group are adjusted by the
+        difference, which removes expired jobs from their counts.
+
+        Parameters
+        ----------
+        group : str
+            The ID of the group
+
+        Returns
+        -------
+        bool
+            False if a status changed within the group meanwhile, in which
+            case the counts are left as they are
+        """
+        key = _counts_key(group)
+        with r_client.pipeline() as pipe:
+            try:
+                # any change of status within the group changes its counts,
+                # and aborts the transaction
+                pipe.watch(key)
+                old = pipe.hmget(key, *summary.STATUSES)
+                children = list(pipe.smembers(_children_key(group)))
+
+                counts = dict.fromkeys(summary.STATUSES, 0)
+                for i in range(0, len(children), self.count):
+                    batch = children[i:i + self.count]
+                    groups = []
+                    for payload in record.fetch_many(batch):
+                        try:
+                            info = record.decode(payload)
+                        except ValueError:
+                            continue
+                        if info.get('type') == 'group':
+                            groups.append(info['id'])
+                            continue
+                        status = summary.bucket(info.get('status'))
+                        if status is not None:
+                            counts[status] += 1
+
+                    # nested groups count the jobs of all of their groups
+                    for nested in summary.get_summaries(groups):
+                        for status, n in nested.items():
+                            counts[status] += n
+
+                pipe.multi()
+                for status, n in zip(summary.STATUSES, old):
+                    difference = counts[status] - int(n or 0)
+                    if difference > 0:
+                        summary.count(pipe, group, None, status, difference)
+                    elif difference < 0:
+                        summary.count(pipe, group, status, None, -difference)
+                pipe.execute()
+            except WatchError:
+                return False
+
+        return True
+
+    def _sweep_files(self):
+        """Remove result files of jobs which no longer exist"""
+        directory = moi.result_directory
+        if directory is None:
+            return
+
+        try:
+            names = os.listdir(directory)
+        except OSError as e:
+            if e.errno == errno.ENOENT:
+                return
+            raise
+
+        # files being written are hidden until they are complete
+        names = [name for name in names if not name.startswith('.')]
+        for i in range(0, len(names), self.count):
+            batch = names[i:i + self.count]
+            for name, alive in zip(batch, _exists(batch)):
+                if alive:
+                    continue
+                try:
+                    os.remove(os.path.join(directory, name))
+                except OSError as e:
+                    if e.errno != errno.ENOENT:
+                        raise
+                else:
+                    self.stats['files'] += 1
+
+
+def start(interval=None, count=None, io_loop=None):
+    """Sweep periodically on an IOLoop
+
+    Parameters
+    ----------
+    interval : float, optional
+        The number of seconds between steps. Defaults to the
+        ``sweep_interval`` of the configuration.
+    count : int, optional
+        The number of keys examined per step, see ``Sweeper``
+    io_loop : tornado.ioloop.IOLoop, optional
+        The IOLoop to sweep on. Defaults to the current IOLoop.
+
+    Notes
+    -----
+    Each step examines a bounded number of groups, so the IOLoop is only
+    blocked briefly at a time.
+
+    Returns
+    -------
+    tornado.ioloop.PeriodicCallback or None
+        The started callback, which is stopped with ``stop``, or None if the
+        interval is 0
+    """
+    interval = moi.sweep_interval if interval is None else interval
+    if not interval:
+        return None
+
+    sweeper = Sweeper(count)
+    callback = PeriodicCallback(sweeper.step, interval * 1000,
+                                io_loop=io_loop)
+    callback.start()
+    return callback
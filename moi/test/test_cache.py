@@ -0,0 +1,56 @@
+# -----------------------------------------------------------------------------
+# Copyright (c) 2014--, The qiita Development Team.
+#
+# Distributed under the terms of the BSD 3-clause License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# -----------------------------------------------------------------------------
+
+from unittest import TestCase, main
+
+from moi.cache import LRUCache
+
+
+class LRUCacheTests(TestCase):
+    def setUp(self):
+        self.obj = LRUCache(2)
+
+    def test_init(self):
+        with self.assertRaises(ValueError):
+            LRUCache(0)
+
+    def test_get_set(self):
+        self.assertEqual(self.obj.get('a'), None)
+        self.assertEqual(self.obj.get('a', 1), 1)
+
+        self.obj.set('a', 2)
+        self.assertEqual(self.obj.get('a'), 2)
+        self.assertIn('a', self.obj)
+        self.assertEqual(len(self.obj), 1)
+        self.assertEqual((self.obj.hits, self.obj.misses), (1, 2))
+
+    def test_eviction(self):
+        self.obj.set('a', 1)
+        self.obj.set('b', 2)
+        self.obj.get('a')
+        self.obj.set('c', 3)
+
+        # b is the least recently used
+        self.assertNotIn('b', self.obj)
+        self.assertIn('a', self.obj)
+        self.assertIn('c', self.obj)
+        self.assertEqual(len(self.obj), 2)
+
+    def test_pop(self):
+        self.obj.set('a', 1)
+        self.assertEqual(self.obj.pop('a'), 1)
+        self.assertEqual(self.obj.pop('a', 2), 2)
+
+    def test_clear(self):
+        self.obj.set('a', 1)
+        self.obj.clear()
+        self.assertEqual(len(self.obj), 0)
+
+
+if __name__ == '__main__':
+    main()
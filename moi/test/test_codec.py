@@ -0,0 +1,100 @@
+# -----------------------------------------------------------------------------
+# Copyright (c) 2014--, The qiita Development Team.
+#
+# Distributed under the terms of the BSD 3-clause License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# -----------------------------------------------------------------------------
+
+from unittest import TestCase, main, skipIf
+
+from moi.codec import encode, decode, validate, jsonable, msgpack, lz4, np
+
+
+class CodecTests(TestCase):
+    def setUp(self):
+        self.result = {'a': [1, 2.5, None], 'b': u'foo'}
+
+    def test_validate(self):
+        validate('json')
+        validate('pickle+zlib')
+        with self.assertRaises(ValueError):
+            validate('foo')
+        with self.assertRaises(ValueError):
+            validate('json+foo')
+
+    def test_json(self):
+        self.assertEqual(encode([1, 'a']), b'[1, "a"]')
+        self.assertEqual(decode(b'[1, "a"]'), [1, 'a'])
+
+        with self.assertRaises(TypeError):
+            encode(object())
+        with self.assertRaises(ValueError):
+            decode(b'not json')
+
+    def test_round_trip(self):
+        for codec in ['json', 'json+zlib', 'pickle', 'pickle+zlib']:
+            obs = decode(encode(self.result, codec), codec)
+            self.assertEqual(obs, self.result)
+
+    def test_pickle(self):
+        obs = decode(encode({1, 2}, 'pickle'), 'pickle')
+        self.assertEqual(obs, {1, 2})
+
+        with self.assertRaises(ValueError):
+            decode(b'not a pickle', 'pickle')
+
+    def test_zlib(self):
+        data = encode(list(range(1000)), 'json+zlib')
+        self.assertTrue(len(data) < len(encode(list(range(1000)))))
+
+        with self.assertRaises(ValueError):
+            decode(b'not compressed', 'json+zlib')
+        with self.assertRaises(ValueError):
+            decode(data[:-10], 'json+zlib')
+
+    @skipIf(msgpack is None, "msgpack is not installed")
+    def test_msgpack(self):
+        obs = decode(encode(self.result, 'msgpack'), 'msgpack')
+        self.assertEqual(obs, self.result)
+
+    @skipIf(lz4 is None, "lz4 is not installed")
+    def test_lz4(self):
+        obs = decode(encode(self.result, 'pickle+lz4'), 'pickle+lz4')
+        self.assertEqual(obs, self.result)
+
+        with self.assertRaises(ValueError):
+            decode(b'not compressed', 'pickle+lz4')
+
+    @skipIf(np is None, "NumPy is not installed")
+    def test_numpy(self):
+        arr = np.arange(12, dtype='f8').reshape(3, 4)
+        self.assertEqual(decode(encode(arr)), arr.tolist())
+
+        codecs = ['pickle', 'pickle+zlib']
+        if msgpack is not None:
+            codecs.append('msgpack')
+
+        for codec in codecs:
+            obs = decode(encode({'m': arr}, codec), codec)['m']
+            self.assertTrue(isinstance(obs, np.ndarray))
+            self.assertEqual(obs.dtype, arr.dtype)
+            self.assertTrue((obs == arr).all())
+
+    @skipIf(np is None, "NumPy is not installed")
+    def test_numpy_zero_copy(self):
+        arr = np.arange(1000, dtype='i4')
+        codecs = ['pickle'] + (['msgpack'] if msgpack is not None else [])
+        for codec in codecs:
+            obs = decode(encode(arr, codec), codec)
+            # the array is a view of the decoded bytes
+            self.assertFalse(obs.flags.owndata)
+
+    @skipIf(np is None, "NumPy is not installed")
+    def test_jsonable(self):
+        obs = jsonable({'a': (np.float32(1.5), np.arange(2)), 'b': 'c'})
+        self.assertEqual(obs, {'a': [1.5, [0, 1]], 'b': 'c'})
+
+
+if __name__ == '__main__':
+    main()
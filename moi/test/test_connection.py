@@ -0,0 +1,91 @@
+# -----------------------------------------------------------------------------
+# Copyright (c) 2014--, The qiita Development Team.
+#
+# Distributed under the terms of the BSD 3-clause License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# -----------------------------------------------------------------------------
+
+from unittest import TestCase, main
+
+from future import standard_library
+from redis import (ConnectionPool, ConnectionError, Connection,
+                   UnixDomainSocketConnection)
+with standard_library.hooks():
+    from configparser import ConfigParser
+
+from moi.connection import MeteredConnectionPool, create_client, pool_stats
+
+
+class ConnectionTests(TestCase):
+    def config(self, **options):
+        config = ConfigParser()
+        config.add_section('redis')
+        config.set('redis', 'host', 'localhost')
+        config.set('redis', 'port', '6379')
+        config.set('redis', 'password', '')
+        config.set('redis', 'db', '0')
+        for key, value in options.items():
+            config.set('redis', key, value)
+        return config
+
+    def test_create_client(self):
+        client = create_client(self.config())
+        pool = client.connection_pool
+        self.assertEqual(type(pool), ConnectionPool)
+        self.assertEqual(pool.connection_class, Connection)
+        self.assertEqual(pool.connection_kwargs['host'], 'localhost')
+        self.assertEqual(pool.connection_kwargs['port'], 6379)
+        self.assertEqual(pool.connection_kwargs['socket_timeout'], None)
+
+    def test_create_client_options(self):
+        client = create_client(self.config(max_connections='3',
+                                           pool_timeout='0.5',
+                                           socket_timeout='2',
+                                           socket_keepalive='true'))
+        pool = client.connection_pool
+        self.assertIsInstance(pool, MeteredConnectionPool)
+        self.assertEqual(pool.max_connections, 3)
+        self.assertEqual(pool.timeout, 0.5)
+        self.assertEqual(pool.connection_kwargs['socket_timeout'], 2.0)
+        self.assertEqual(pool.connection_kwargs['socket_keepalive'], True)
+
+    def test_create_client_unix_socket(self):
+        client = create_client(self.config(unix_socket_path='/tmp/r.sock'))
+        pool = client.connection_pool
+        self.assertEqual(pool.connection_class, UnixDomainSocketConnection)
+        self.assertEqual(pool.connection_kwargs['path'], '/tmp/r.sock')
+        self.assertNotIn('host', pool.connection_kwargs)
+
+    def test_metered_connection_pool(self):
+        pool = MeteredConnectionPool(max_connections=1, timeout=0.01)
+        conn = pool.get_connection('GET')
+        self.assertEqual((pool.waits, pool.exhausted), (0, 0))
+
+        with self.assertRaises(ConnectionError):
+            pool.get_connection('GET')
+        self.assertEqual((pool.waits, pool.exhausted), (1, 1))
+
+        pool.release(conn)
+        pool.get_connection('GET')
+        self.assertEqual((pool.waits, pool.exhausted), (1, 1))
+
+    def test_pool_stats(self):
+        client = create_client(self.config(max_connections='2'))
+        conn = client.connection_pool.get_connection('GET')
+        self.assertEqual(pool_stats(client), {'max_connections': 2,
+                                              'in_use': 1,
+                                              'created': 1,
+                                              'waits': 0,
+                                              'exhausted': 0})
+        client.connection_pool.release(conn)
+        self.assertEqual(pool_stats(client)['in_use'], 0)
+
+        client = create_client(self.config())
+        obs = pool_stats(client)
+        self.assertEqual((obs['in_use'], obs['created']), (0, 0))
+        self.assertNotIn('waits', obs)
+
+
+if __name__ == '__main__':
+    main()
@@ -9,8 +9,15 @@
 from json import dumps
 from unittest import TestCase, main
 
+from mock import patch
+
 from moi import r_client
-from moi.group import Group
+from moi import record
+from moi.summary import get_summary
+from moi.job import _status_change, _write_info
+from moi.group import (Group, create_info, page, get_id_from_user,
+                       get_user_from_id, _get_info_cache, _refresh_cached,
+                       _parse_date, _ids, _users)
 
 
 class GroupTests(TestCase):
@@ -25,18 +32,38 @@ class GroupTests(TestCase):
         r_client.set('d', '{"type": "job", "id": "d", "name": "other job"}')
         r_client.set('e', '{"type": "job", "id": "e", "name": "other job e"}')
         self.obj = Group('testing')
+        # the nodes of the group are subscribed to as they are read
+        self.obj.action('get', [])
+        self.confirm()
         self.to_delete = ['testing', 'testing:jobs', 'testing:children',
                           'user-id-map', 'a', 'b', 'c', 'd', 'e']
 
     def tearDown(self):
+        self.obj.close()
         for key in self.to_delete:
             r_client.delete(key)
 
+    def confirm(self):
+        """Confirm the subscriptions, as Redis does on the IOLoop"""
+        subscriber = self.obj._subscriber
+        for channel in subscriber.channels:
+            subscriber._dispatch(('subscribe', channel, 1))
+
     def test_init(self):
         self.assertEqual(self.obj.group_children, 'testing:children')
         self.assertEqual(self.obj.group_pubsub, 'testing:pubsub')
         self.assertEqual(self.obj.forwarder('foo'), None)
 
+    def test_init_lazy(self):
+        other = Group('testing')
+        self.assertEqual(other._listening_to, {})
+        self.assertIn(other.callback,
+                      other._subscriber.listeners('testing:pubsub'))
+
+        other.action('get', [])
+        self.assertItemsEqual(other.jobs, ['a', 'b', 'c'])
+        other.close()
+
     def test_traverse_simple(self):
         exp = {'a', 'b', 'c'}
         obs = {obj['id'] for obj in self.obj.traverse('testing')}
@@ -47,7 +74,10 @@ class GroupTests(TestCase):
         exp = {'a', 'c'}
         obs = {obj['id'] for obj in self.obj.traverse('testing')}
         self.assertEqual(obs, exp)
-        self.assertEqual(r_client.smembers('testing:children'), exp)
+
+        # reads do not modify the group, see moi.sweep
+        self.assertEqual(r_client.smembers('testing:children'),
+                         {'a', 'b', 'c'})
 
     def test_traverse_complex(self):
         r_client.sadd('testing:children', 'd')
@@ -62,11 +92,157 @@ class GroupTests(TestCase):
         obs = {obj['id'] for obj in self.obj.traverse('testing')}
         self.assertEqual(obs, exp)
 
+    def test_traverse_nested_shared_child(self):
+        r_client.sadd('testing:children', 'd')
+        r_client.sadd('d:children', 'd_a', 'e', 'a')
+        r_client.sadd('e:children', 'a', 'e_a')
+        r_client.set('d', '{"type": "group", "id": "d", "name": "d"}')
+        r_client.set('e', '{"type": "group", "id": "e", "name": "e"}')
+        r_client.set('d_a', '{"type": "job", "id": "d_a", "name": "d_a"}')
+        self.to_delete.extend(['d:children', 'e:children', 'd_a'])
+
+        obs = [obj['id'] for obj in self.obj.traverse('testing')]
+        self.assertItemsEqual(obs, ['a', 'b', 'c', 'd', 'd_a', 'e'])
+
+        # e_a does not exist, and is skipped
+        self.assertEqual(r_client.smembers('e:children'), {'a', 'e_a'})
+
+    def test_traverse_undecodable(self):
+        r_client.set('b', 'not json')
+        with self.assertRaises(ValueError):
+            list(self.obj.traverse('testing'))
+
+    def test_resolve_include_roots(self):
+        r_client.sadd('d:children', 'a', 'e')
+        r_client.set('d', '{"type": "group", "id": "d", "name": "d"}')
+        self.to_delete.append('d:children')
+
+        obs = [obj['id'] for obj in self.obj._resolve(['d', 'b', 'd', None])]
+        self.assertEqual(obs[:2], ['d', 'b'])
+        self.assertItemsEqual(obs[2:], ['a', 'e'])
+
+    def test_fetch(self):
+        r_client.set('b', 'not json')
+        self.assertEqual(self.obj._fetch([]), [])
+        self.assertEqual(self.obj._fetch(['a', 'f']),
+                         [{u'id': u'a', u'name': u'a', u'type': u'job'},
+                          None])
+        with self.assertRaises(ValueError):
+            self.obj._fetch(['a', 'b'])
+
+        obs = self.obj._fetch(['b', 'a'], ignore_errors=True)
+        self.assertEqual(len(obs), 2)
+        self.assertEqual(obs[1]['id'], 'a')
+
+    def test_fetch_cached(self):
+        exp = [{u'id': u'a', u'name': u'a', u'type': u'job'}]
+        self.assertEqual(self.obj._fetch(['a'], cached=True), exp)
+
+        # the group is subscribed to a, so a is served from the cache until
+        # an update is received
+        r_client.set('a', '{"type": "job", "id": "a", "name": "new"}')
+        self.assertEqual(self.obj._fetch(['a'], cached=True), exp)
+        self.assertEqual(self.obj._fetch(['a'])[0]['name'], 'new')
+
+        _refresh_cached(('message', 'a:pubsub', dumps({'update': ['a']})))
+        self.assertEqual(self.obj._fetch(['a'], cached=True)[0]['name'],
+                         'new')
+
+    def test_fetch_cached_unconfirmed(self):
+        self.obj.listen_to_node('d')
+
+        # updates published before the subscription is confirmed are missed,
+        # so d is not cached until then
+        self.obj._fetch(['d'], cached=True)
+        r_client.set('d', '{"type": "job", "id": "d", "name": "new"}')
+        self.assertEqual(self.obj._fetch(['d'], cached=True)[0]['name'],
+                         'new')
+
+        self.confirm()
+        self.obj._fetch(['d'], cached=True)
+        r_client.set('d', '{"type": "job", "id": "d", "name": "newer"}')
+        self.assertEqual(self.obj._fetch(['d'], cached=True)[0]['name'],
+                         'new')
+
+    def test_fetch_cached_inline(self):
+        self.obj._fetch(['a', 'b'], cached=True)
+        r_client.delete('a', 'b')
+
+        # inline updates are applied without reading redis
+        _refresh_cached(('message', 'a:pubsub', dumps(
+            {'update': [{'id': 'a', 'diff': {'status': 'Running'}}]})))
+        _refresh_cached(('message', 'b:pubsub', dumps(
+            {'update': [{'id': 'b', 'info': {'id': 'b', 'name': 'new'}}]})))
+
+        obs = self.obj._fetch(['a', 'b'], cached=True)
+        self.assertEqual(obs, [{u'id': u'a', u'name': u'a', u'type': u'job',
+                                u'status': u'Running'},
+                               {u'id': u'b', u'name': u'new'}])
+
+    def test_fetch_cached_copy(self):
+        self.obj._fetch(['a'], cached=True)[0]['name'] = 'changed'
+        self.assertEqual(self.obj._fetch(['a'], cached=True)[0]['name'], 'a')
+
+    def test_fetch_cached_unsubscribed(self):
+        # d is not listened to, so its updates would not be received
+        self.obj._fetch(['d'], cached=True)
+        r_client.set('d', '{"type": "job", "id": "d", "name": "new"}')
+        self.assertEqual(self.obj._fetch(['d'], cached=True)[0]['name'],
+                         'new')
+
+        self.obj._fetch(['a'], cached=True)
+        self.obj.unlisten_to_node('a')
+        r_client.set('a', '{"type": "job", "id": "a", "name": "new"}')
+
+        # updates may have been missed while unsubscribed
+        self.obj.listen_to_node('a')
+        self.assertEqual(self.obj._fetch(['a'], cached=True)[0]['name'],
+                         'new')
+
+    def test_fetch_cached_disabled(self):
+        with patch('moi.info_cache_size', 0):
+            self.assertEqual(_get_info_cache(), None)
+            self.obj._fetch(['a'], cached=True)
+            r_client.set('a', '{"type": "job", "id": "a", "name": "new"}')
+            self.assertEqual(self.obj._fetch(['a'], cached=True)[0]['name'],
+                             'new')
+
+    def test_fetch_cached_shared(self):
+        other = Group('testing')
+        self.addCleanup(other.close)
+
+        self.obj._fetch(['b'], cached=True)
+        r_client.set('b', 'not json')
+        self.assertEqual(other._fetch(['b'], cached=True)[0]['id'], 'b')
+
     def test_del(self):
         pass  # unsure how to test
 
     def test_close(self):
-        pass  # unsure how to test
+        subscriber = self.obj._subscriber
+        self.assertIn(self.obj.callback, subscriber.listeners('a:pubsub'))
+        self.assertIn(self.obj.callback,
+                      subscriber.listeners('testing:pubsub'))
+
+        self.obj.close()
+        self.assertNotIn(self.obj.callback, subscriber.listeners('a:pubsub'))
+        self.assertNotIn(self.obj.callback,
+                         subscriber.listeners('testing:pubsub'))
+
+        # closing is idempotent
+        self.obj.close()
+
+    def test_shared_subscriber(self):
+        other = Group('testing')
+        other.action('get', [])
+        self.assertIs(other._subscriber, self.obj._subscriber)
+        self.assertEqual(
+            self.obj._subscriber.listeners('a:pubsub').count(other.callback),
+            1)
+
+        other.close()
+        self.assertIn(self.obj.callback,
+                      self.obj._subscriber.listeners('a:pubsub'))
 
     def test_decode(self):
         obs = self.obj._decode(dumps({'foo': ['bar']}))
@@ -81,6 +257,30 @@ class GroupTests(TestCase):
                                ('b:pubsub', 'b'),
                                ('c:pubsub', 'c')])
 
+    def test_listen_group_channels(self):
+        r_client.sadd('testing:children', 'd')
+        r_client.sadd('d:children', 'd_a')
+        r_client.set('d', '{"type": "group", "id": "d", "name": "d"}')
+        r_client.set('d_a', '{"type": "job", "id": "d_a", "name": "d_a"}')
+        self.to_delete.extend(['d:children', 'd_a'])
+
+        with patch('moi.job_updates', 'group'):
+            grp = Group('testing')
+            grp.action('get', [])
+            grp.listen_to_node('e')
+        subscriber = grp._subscriber
+
+        # every node is tracked, but only groups are subscribed to
+        self.assertItemsEqual(grp.jobs, ['a', 'b', 'c', 'd', 'd_a', 'e'])
+        self.assertIn(grp.callback, subscriber.listeners('testing:pubsub'))
+        self.assertIn(grp.callback, subscriber.listeners('d:pubsub'))
+        for id_ in ['a', 'b', 'c', 'd_a', 'e']:
+            self.assertNotIn(grp.callback,
+                             subscriber.listeners(id_ + ':pubsub'))
+
+        grp.close()
+        self.assertNotIn(grp.callback, subscriber.listeners('d:pubsub'))
+
     def test_unlisten_to_node(self):
         self.assertEqual(self.obj.unlisten_to_node('b'), 'b')
         self.assertItemsEqual(self.obj._listening_to.items(),
@@ -88,6 +288,15 @@ class GroupTests(TestCase):
                                ('c:pubsub', 'c')])
         self.assertEqual(self.obj.unlisten_to_node('foo'), None)
 
+    def test_unlisten_to_node_hash_record(self):
+        record.store({'id': 'f', 'type': 'job', 'parent': 'testing'})
+        self.to_delete.append('f')
+        r_client.sadd('testing:children', 'f')
+        self.obj.listen_to_node('f')
+
+        self.assertEqual(self.obj.unlisten_to_node('f'), 'f')
+        self.assertNotIn('f', r_client.smembers('testing:children'))
+
     def test_callback(self):
         class forwarder(object):
             def __init__(self):
@@ -139,6 +348,10 @@ class GroupTests(TestCase):
         self.obj.action('remove', ['d'])
         self.assertEqual(fwd.result, [])
 
+        self.obj.action('update', ['a'])
+        self.assertEqual(fwd.result, [
+            {'update': {u'id': u'a', u'name': u'a', u'type': u'job'}}])
+
         with self.assertRaises(TypeError):
             self.obj.action('add', 'foo')
 
@@ -170,6 +383,23 @@ class GroupTests(TestCase):
         with self.assertRaises(ValueError):
             self.obj.job_action('foo', ['d'])
 
+    def test_action_update(self):
+        self.obj._fetch(['a'], cached=True)
+        r_client.delete('a')
+        _refresh_cached(('message', 'a:pubsub', dumps(
+            {'update': [{'id': 'a', 'diff': {'name': 'new'}}]})))
+
+        resp = self.obj._action_update([
+            {'id': 'a', 'diff': {'name': 'new'}},
+            {'id': 'f', 'info': {'id': 'f', 'name': 'inline'}},
+            'b'])
+        self.assertItemsEqual(resp, [
+            {u'id': u'a', u'name': u'new', u'type': u'job'},
+            {u'id': u'f', u'name': u'inline'},
+            {u'id': u'b', u'name': u'b', u'type': u'job'}])
+
+        self.assertEqual(self.obj._action_update([]), [])
+
     def test_action_add(self):
         resp = self.obj._action_add(['d', 'f', 'e'])
         self.assertItemsEqual(resp, [
@@ -201,6 +431,160 @@ class GroupTests(TestCase):
             {u'id': u'd', u'name': u'other job', u'type': u'job'},
             {u'id': u'e', u'name': u'other job e', u'type': u'job'}])
 
+    def test_action_get_hash_records(self):
+        info = create_info('hashed', 'job', parent='testing', id='f',
+                           store=True)
+        self.to_delete.append('f')
+        self.assertEqual(r_client.type('f'), 'hash')
+
+        resp = self.obj._action_get(['f', 'a'])
+        self.assertEqual(resp, [info, {u'id': u'a', u'name': u'a',
+                                       u'type': u'job'}])
+
+    def test_action_summary(self):
+        create_info('counted', 'job', parent='testing', id='f', store=True)
+        self.to_delete.extend(['f', 'testing:counts'])
+
+        exp = {'Queued': 1, 'Running': 0, 'Success': 0, 'Failed': 0,
+               'Blocked': 0}
+        self.assertEqual(self.obj._action_summary([]),
+                         [{'id': 'testing', 'counts': exp}])
+        self.assertEqual(self.obj._action_summary(['testing', 'x'])[1],
+                         {'id': 'x', 'counts': dict.fromkeys(exp, 0)})
+
+        self.obj.listen_to_node('f')
+        self.obj.unlisten_to_node('f')
+        self.assertEqual(get_summary('testing')['Queued'], 0)
+
+    def test_unlisten_to_node_running(self):
+        create_info('running', 'job', parent='testing', id='f', store=True)
+        self.to_delete.extend(['f', 'testing:counts', 'testing:created',
+                               'testing:ended'])
+        _status_change('f', 'Running')
+        self.obj.listen_to_node('f')
+        self.obj.unlisten_to_node('f')
+
+        # the removed job is no longer counted or indexed as it completes
+        _write_info('f', {'status': 'Success', 'date_end': 'now'})
+        self.assertEqual(get_summary('testing'),
+                         dict.fromkeys(get_summary('testing'), 0))
+        self.assertEqual(r_client.zscore('testing:ended', 'f'), None)
+        self.assertEqual(page('testing', order='ended'), ([], None))
+
+    def test_parse_date(self):
+        self.assertEqual(_parse_date('not a date'), 0.0)
+        self.assertEqual(_parse_date(None), 0.0)
+        self.assertTrue(_parse_date('2014-07-01 12:00:00.5') -
+                        _parse_date('2014-07-01 12:00:00') == 0.5)
+
+    def test_page(self):
+        for id_ in ['f', 'g', 'h']:
+            create_info(id_, 'job', parent='testing', id=id_, store=True)
+        self.to_delete.extend(['f', 'g', 'h', 'testing:counts',
+                               'testing:created', 'testing:ended'])
+
+        # a, b and c were added prior to the index, and are indexed on the
+        # first page as created at the epoch
+        obs = []
+        details, cursor = page('testing', limit=2)
+        while True:
+            self.assertTrue(len(details) <= 2)
+            obs.extend(d['id'] for d in details)
+            if cursor is None:
+                break
+            details, cursor = page('testing', cursor, limit=2)
+        self.assertEqual(obs, ['h', 'g', 'f', 'c', 'b', 'a'])
+        self.assertEqual(r_client.zcard('testing:created'), 6)
+
+        record.update('g', {'status': 'half way'})
+        details, cursor = page('testing', status=['Running', 'Failed'])
+        self.assertEqual([d['id'] for d in details], ['g'])
+        self.assertEqual(cursor, None)
+
+        self.assertEqual(page('testing', order='ended'), ([], None))
+
+        with self.assertRaises(ValueError):
+            page('testing', order='foo')
+        with self.assertRaises(ValueError):
+            page('testing', limit=0)
+        with self.assertRaises(ValueError):
+            page('testing', cursor='foo')
+
+    def test_action_page(self):
+        create_info('f', 'job', parent='testing', id='f', store=True)
+        self.to_delete.extend(['f', 'testing:counts', 'testing:created'])
+
+        class forwarder(object):
+            def __call__(self, data):
+                self.result = list(data)
+
+        fwd = forwarder()
+        self.obj.forwarder = fwd
+
+        self.obj.action('get', {'limit': 1})
+        self.assertEqual(fwd.result[0]['get']['id'], 'f')
+        self.assertEqual(fwd.result[1]['page']['id'], 'testing')
+
+        cursor = fwd.result[1]['page']['cursor']
+        self.obj.action('get', {'id': 'testing', 'cursor': cursor,
+                                'limit': 5})
+        self.assertItemsEqual([m['get']['id'] for m in fwd.result[:-1]],
+                              ['a', 'b', 'c'])
+        self.assertEqual(fwd.result[-1],
+                         {'page': {'id': 'testing', 'cursor': None}})
+
+        self.obj.unlisten_to_node('f')
+        self.assertEqual(r_client.zscore('testing:created', 'f'), None)
+
+    def test_action_result(self):
+        info = create_info('with result', 'job', id='f', store=True)
+        info.update(record.store_result('f', [1, 2]))
+        record.store(info)
+        self.to_delete.extend(['f', 'f:result'])
+
+        # results are not part of the details
+        self.assertEqual(self.obj._action_get(['f'])[0]['result_key'],
+                         'f:result')
+        self.assertNotIn('result', self.obj._action_get(['f'])[0])
+
+        resp = self.obj._action_result(['f', 'a', 'g'])
+        self.assertEqual(resp, [{'id': 'f', 'result': [1, 2]},
+                                {'id': 'a', 'result': None}])
+
+    def test_action_get_nested_groups(self):
+        r_client.set('d', '{"type": "group", "id": "d", "name": "d"}')
+        r_client.set('e', '{"type": "group", "id": "e", "name": "e"}')
+        r_client.set('c', 'not json')
+        r_client.sadd('d:children', 'a', 'e')
+        r_client.sadd('e:children', 'b', 'c')
+        self.to_delete.extend(['d:children', 'e:children'])
+
+        # e is reachable directly and through d, but is only reported once
+        resp = self.obj._action_get(['d', 'e'])
+        self.assertItemsEqual([r['id'] for r in resp], ['a', 'b', 'd', 'e'])
+
+    def test_get_id_from_user(self):
+        _ids.clear()
+        _users.clear()
+
+        self.assertEqual(get_id_from_user('testing'), 'testing')
+        id_ = get_id_from_user('_moi_test_user')
+        self.assertEqual(r_client.hget('user-id-map', '_moi_test_user'), id_)
+        self.assertEqual(r_client.hget('user-id-map', id_), '_moi_test_user')
+        self.assertEqual(get_user_from_id(id_), '_moi_test_user')
+
+        # known mappings are served from the cache
+        with patch.object(r_client, 'hget') as hget:
+            self.assertEqual(get_id_from_user('_moi_test_user'), id_)
+            self.assertEqual(get_user_from_id(id_), '_moi_test_user')
+            self.assertFalse(hget.called)
+
+    def test_get_id_from_user_existing(self):
+        _ids.clear()
+        r_client.hset('user-id-map', '_moi_test_user', 'foo')
+        self.assertEqual(get_id_from_user('_moi_test_user'), 'foo')
+        self.assertEqual(get_user_from_id('_moi_test_missing'), None)
+
 
 if __name__ == '__main__':
     main()
@@ -6,10 +6,13 @@
 # The full license is in the file LICENSE, distributed with this software.
 # -----------------------------------------------------------------------------
 
+import os
 from os.path import exists, split
+from tempfile import NamedTemporaryFile
 from unittest import TestCase, main
 
-from moi import moi_js, moi_list_js
+import moi
+from moi import moi_js, moi_list_js, configure, _Lazy
 
 
 class InitTests(TestCase):
@@ -22,5 +25,129 @@ class InitTests(TestCase):
         self.assertEqual(split(moi_list_js())[1], 'moi_list.js')
 
 
+class LazyTests(TestCase):
+    def setUp(self):
+        self.created = []
+
+        def factory():
+            self.created.append(True)
+            return {'a': 1}
+
+        self.obj = _Lazy(factory)
+
+    def test_lazy(self):
+        self.assertEqual(self.created, [])
+        self.assertEqual(self.obj['a'], 1)
+        self.assertIn('a', self.obj)
+        self.assertEqual(list(self.obj), ['a'])
+        self.assertEqual(len(self.obj), 1)
+        self.assertEqual(self.obj.get('b', 2), 2)
+        self.assertEqual(self.created, [True])
+
+    def test_reset(self):
+        self.obj.keys()
+        self.obj._reset()
+        self.assertEqual(self.created, [True])
+        self.obj.keys()
+        self.assertEqual(self.created, [True, True])
+
+
+class ConfigureTests(TestCase):
+    def tearDown(self):
+        configure()
+
+    def write_config(self, extra=''):
+        config = NamedTemporaryFile(mode='w', suffix='.txt', delete=False)
+        config.write("[redis]\nhost = localhost\nport = 6379\npassword =\n"
+                     "db = 0\n\n[ipython]\ncontext=foo\ndefault=foo\n" +
+                     extra)
+        config.close()
+        self.addCleanup(os.remove, config.name)
+        return config.name
+
+    def test_configure(self):
+        configure(self.write_config("[job]\nstatus_interval=5\n"))
+        self.assertEqual(moi.ctx_default, 'foo')
+        self.assertEqual(moi.status_interval, 5.0)
+        self.assertEqual(moi.job_updates, 'job')
+        self.assertEqual(moi.flush_interval, 0)
+        self.assertEqual(moi.info_cache_size, 10000)
+        self.assertEqual(moi.inline_max_size, 0)
+        self.assertEqual(moi.result_codec, 'json')
+        self.assertEqual(moi.result_directory, None)
+        self.assertEqual(moi.result_offload_size, 67108864)
+        self.assertEqual(moi.sweep_interval, 0)
+        self.assertEqual(moi.sweep_count, 100)
+        self.assertEqual(moi.scheduler_weights, {})
+        self.assertEqual(moi.scheduler_pins, [])
+        self.assertEqual(moi.scheduler_refresh, 1.0)
+        self.assertEqual(moi.memo_ttl, 86400)
+        self.assertEqual(moi.memo_max_entries, 10000)
+
+        # connections are only established on first use
+        self.assertEqual(moi.r_client._obj, None)
+        self.assertEqual(moi.ctxs._obj, None)
+
+    def test_configure_invalid(self):
+        with self.assertRaises(ValueError):
+            configure(self.write_config("[pubsub]\njob_updates=foo\n"))
+
+    def test_configure_invalid_cache(self):
+        with self.assertRaises(ValueError):
+            configure(self.write_config("[cache]\ninfo_size=-1\n"))
+
+    def test_configure_invalid_unchanged(self):
+        configure(self.write_config("[job]\nstatus_interval=5\n"))
+        config = moi._config
+        with self.assertRaises(ValueError):
+            configure(self.write_config("[job]\nstatus_interval=2\n"
+                                        "[cache]\ninfo_size=-1\n"
+                                        "[memoize]\nttl=0\n"))
+
+        # an invalid configuration leaves the previous one in place
+        self.assertIs(moi._config, config)
+        self.assertEqual(moi.status_interval, 5.0)
+        self.assertEqual(moi.info_cache_size, 10000)
+        self.assertEqual(moi.memo_ttl, 86400)
+
+    def test_configure_invalid_sweep(self):
+        with self.assertRaises(ValueError):
+            configure(self.write_config("[sweep]\ncount=0\n"))
+
+    def test_configure_scheduler(self):
+        configure(self.write_config("[scheduler]\nweights=foo:2, bar:0.5\n"
+                                    "pins=beta_*:foo,a:b:bar\n"))
+        self.assertEqual(moi.scheduler_weights, {'foo': 2.0, 'bar': 0.5})
+        self.assertEqual(moi.scheduler_pins, [('beta_*', 'foo'),
+                                              ('a:b', 'bar')])
+
+    def test_configure_invalid_scheduler(self):
+        with self.assertRaises(ValueError):
+            configure(self.write_config("[scheduler]\nweights=foo:-1\n"))
+        with self.assertRaises(ValueError):
+            configure(self.write_config("[scheduler]\npins=foo\n"))
+
+    def test_configure_invalid_memoize(self):
+        with self.assertRaises(ValueError):
+            configure(self.write_config("[memoize]\nttl=0\n"))
+        with self.assertRaises(ValueError):
+            configure(self.write_config("[memoize]\nttl=%d\n" %
+                                        (moi.REDIS_KEY_TIMEOUT + 1)))
+        with self.assertRaises(ValueError):
+            configure(self.write_config("[memoize]\nmax_entries=0\n"))
+
+    def test_configure_invalid_codec(self):
+        with self.assertRaises(ValueError):
+            configure(self.write_config("[result]\ncodec=foo\n"))
+
+    def test_configure_no_config(self):
+        config_fp = os.environ.pop('MOI_CONFIG_FP')
+        try:
+            with self.assertRaises(IOError):
+                configure()
+        finally:
+            os.environ['MOI_CONFIG_FP'] = config_fp
+
+
 if __name__ == '__main__':
     main()
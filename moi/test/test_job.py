@@ -8,12 +8,24 @@
 
 
 import json
+import os
+from tempfile import NamedTemporaryFile
 from unittest import TestCase, main
-from time import sleep
+from time import sleep, time
+from threading import Timer
 
-from moi import r_client, ctxs, ctx_default
+from mock import patch
+
+from moi import r_client, ctxs, ctx_default, REDIS_KEY_TIMEOUT
+from moi import record, memo
+from moi.summary import get_summary
 from moi.job import (_status_change, _redis_wrap, submit, _submit,
-                     submit_nouser, _deposit_payload, system_call)
+                     submit_nouser, _deposit_payload, system_call,
+                     streaming_system_call,
+                     submit_many, _submit_many, _create_jobs,
+                     _update_channels, _update_message, StatusUpdater,
+                     _get_context, submit_dag, _topological_order,
+                     _failed_dependencies, _after)
 
 
 class MOITests(TestCase):
@@ -32,6 +44,89 @@ class MOITests(TestCase):
         for k in self.test_keys:
             r_client.delete(k)
 
+    def test_update_channels(self):
+        self.assertEqual(_update_channels('a', 'b'), ['a:pubsub'])
+        with patch('moi.job_updates', 'group'):
+            self.assertEqual(_update_channels('a', 'b'), ['b:pubsub'])
+            self.assertEqual(_update_channels('a', None), ['a:pubsub'])
+        with patch('moi.job_updates', 'both'):
+            self.assertEqual(_update_channels('a', 'b'),
+                             ['a:pubsub', 'b:pubsub'])
+            self.assertEqual(_update_channels('a', None), ['a:pubsub'])
+
+    def test_status_change_group_channel(self):
+        self.test_job_info['parent'] = '_moi_test_parent'
+        _deposit_payload(self.test_job_info)
+
+        pubsub = r_client.pubsub()
+        pubsub.subscribe('_moi_test_parent:pubsub')
+        self.assertEqual(pubsub.get_message(timeout=1)['type'], 'subscribe')
+
+        with patch('moi.job_updates', 'group'):
+            self.assertEqual(_status_change(self.test_id, 'new status'),
+                             'old status')
+
+        msg = pubsub.get_message(timeout=1)
+        self.assertEqual(json.loads(msg['data']), {'update': [self.test_id]})
+        pubsub.close()
+
+    def test_update_message(self):
+        self.assertEqual(json.loads(_update_message('a', diff={'b': 1})),
+                         {'update': ['a']})
+
+        with patch('moi.inline_max_size', 100):
+            obs = _update_message('a', diff={'b': 1})
+            self.assertEqual(json.loads(obs),
+                             {'update': [{'id': 'a', 'diff': {'b': 1}}]})
+
+            obs = _update_message('a', info={'id': 'a', 'b': 1})
+            self.assertEqual(json.loads(obs),
+                             {'update': [{'id': 'a',
+                                          'info': {'id': 'a', 'b': 1}}]})
+
+            # too large to be inlined
+            obs = _update_message('a', diff={'b': 'x' * 100})
+            self.assertEqual(json.loads(obs), {'update': ['a']})
+
+    def test_status_change_inline(self):
+        _deposit_payload(self.test_job_info)
+
+        pubsub = r_client.pubsub()
+        pubsub.subscribe(self.test_id + ':pubsub')
+        self.assertEqual(pubsub.get_message(timeout=1)['type'], 'subscribe')
+
+        with patch('moi.inline_max_size', 1000):
+            _status_change(self.test_id, 'new status')
+
+        msg = pubsub.get_message(timeout=1)
+        self.assertEqual(json.loads(msg['data']),
+                         {'update': [{'id': self.test_id,
+                                      'diff': {'status': 'new status'}}]})
+        pubsub.close()
+
+    def test_status_change_counts(self):
+        self.test_job_info['status'] = 'Queued'
+        self.test_job_info['parent'] = '_moi_test_parent'
+        self.test_keys.extend(['_moi_test_parent:counts',
+                               '_moi_test_parent:ended'])
+        _deposit_payload(self.test_job_info)
+
+        _status_change(self.test_id, 'Running')
+        _status_change(self.test_id, 'about half way')
+        self.test_job_info['status'] = 'Success'
+        _deposit_payload(self.test_job_info, ['status'])
+
+        self.assertEqual(get_summary('_moi_test_parent'),
+                         {'Queued': 0, 'Running': 0, 'Success': 1,
+                          'Failed': 0, 'Blocked': 0})
+        self.assertEqual(r_client.zscore('_moi_test_parent:ended',
+                                         self.test_id), None)
+
+        self.test_job_info['date_end'] = 'now'
+        _deposit_payload(self.test_job_info, ['date_end'])
+        self.assertNotEqual(r_client.zscore('_moi_test_parent:ended',
+                                            self.test_id), None)
+
     def test_status_change(self):
         new_status = 'new status'
 
@@ -41,12 +136,83 @@ class MOITests(TestCase):
         obs = _status_change(self.test_id, new_status)
         self.assertEqual(obs, self.test_job_info['status'])
 
-        obs = json.loads(r_client.get(self.test_id))
+        obs = record.fetch(self.test_id)
         self.assertEqual(obs['status'], new_status)
+        self.assertEqual(r_client.type(self.test_id), 'hash')
+
+        # subsequent changes only touch the status field
+        obs = _status_change(self.test_id, 'newer status')
+        self.assertEqual(obs, new_status)
+        self.assertEqual(json.loads(r_client.hget(self.test_id, 'status')),
+                         'newer status')
+        self.assertEqual(record.fetch(self.test_id)['pubsub'],
+                         self.test_pubsub)
+
+    def test_status_updater(self):
+        _deposit_payload(self.test_job_info)
+        updater = StatusUpdater(self.test_id, 'old status', min_interval=60)
+
+        # the first update is written immediately
+        self.assertEqual(updater('first'), 'old status')
+        self.assertEqual(record.fetch(self.test_id)['status'], 'first')
+
+        # later updates within the interval are buffered, latest wins
+        self.assertEqual(updater('second'), 'first')
+        self.assertEqual(updater('third'), 'second')
+        self.assertEqual(record.fetch(self.test_id)['status'], 'first')
+
+        updater.flush()
+        self.assertEqual(record.fetch(self.test_id)['status'], 'third')
+        self.assertEqual(updater._timer, None)
+
+        updater('forced', force=True)
+        self.assertEqual(record.fetch(self.test_id)['status'], 'forced')
+
+    def test_status_updater_background_flush(self):
+        _deposit_payload(self.test_job_info)
+        updater = StatusUpdater(self.test_id, 'old status', min_interval=0.2)
+
+        updater('first')
+        updater('second')
+        self.assertEqual(record.fetch(self.test_id)['status'], 'first')
+
+        sleep(0.5)
+        self.assertEqual(record.fetch(self.test_id)['status'], 'second')
+
+    def test_redis_wrap_flushes_status(self):
+        def foo(**kwargs):
+            kwargs['moi_update_status']('first')
+            kwargs['moi_update_status']('buffered')
+            return kwargs['moi_update_status']('last')
+
+        _deposit_payload(self.test_job_info)
+        self.assertEqual(_redis_wrap(self.test_job_info, foo), 'buffered')
+
+        obs = record.fetch(self.test_id)
+        self.test_keys.append(obs['result_key'])
+        self.assertEqual(obs['status'], 'Success')
 
     def test_deposit_payload(self):
         _deposit_payload(self.test_job_info)
-        obs = json.loads(r_client.get(self.test_id))
+        obs = record.fetch(self.test_id)
+        self.assertEqual(obs, self.test_job_info)
+
+    def test_deposit_payload_fields(self):
+        _deposit_payload(self.test_job_info)
+        self.test_job_info['status'] = 'changed'
+        self.test_job_info['parent'] = 'not deposited'
+        _deposit_payload(self.test_job_info, ['status'])
+
+        obs = record.fetch(self.test_id)
+        self.assertEqual(obs['status'], 'changed')
+        self.assertEqual(obs['parent'], None)
+
+    def test_deposit_payload_fields_legacy(self):
+        r_client.set(self.test_id, json.dumps(self.test_job_info))
+        self.test_job_info['status'] = 'changed'
+        _deposit_payload(self.test_job_info, ['status'])
+
+        obs = record.fetch(self.test_id)
         self.assertEqual(obs, self.test_job_info)
 
     def test_redis_wrap(self):
@@ -57,15 +223,45 @@ class MOITests(TestCase):
         obs_ret = _redis_wrap(self.test_job_info, foo, 1, 2)
 
         sleep(1)
-        obs = json.loads(r_client.get(self.test_job_info['id']))
-        self.assertEqual(obs['result'], 3)
-        self.assertEqual(obs_ret, obs['result'])
+        obs = record.fetch(self.test_job_info['id'])
+        self.assertEqual(record.fetch_result(obs), 3)
+        self.assertEqual(obs_ret, record.fetch_result(obs))
+        self.assertNotIn('result', obs)
+        self.assertEqual(obs['result_key'], self.test_id + ':result')
+        self.assertEqual(obs['result_size'], 1)
+        self.test_keys.append(obs['result_key'])
         self.assertEqual(obs['status'], 'Success')
         self.assertNotEqual(obs['date_start'], None)
         self.assertNotEqual(obs['date_end'], None)
 
         r_client.set(self.test_job_info['id'], json.dumps(self.test_job_info))
 
+    def test_redis_wrap_timing(self):
+        def foo(**kwargs):
+            sleep(0.1)
+
+        self.test_job_info['time_queued'] = time()
+        _redis_wrap(self.test_job_info, foo)
+
+        obs = record.fetch(self.test_job_info['id'])
+        self.test_keys.append(obs['result_key'])
+        times = [obs[k] for k in ('time_queued', 'time_picked_up',
+                                  'time_started', 'time_ended',
+                                  'time_stored')]
+        self.assertEqual(times, sorted(times))
+        self.assertTrue(obs['time_ended'] - obs['time_started'] >= 0.1)
+
+    def test_redis_wrap_redis_seconds(self):
+        def store_result(*args, **kwargs):
+            sleep(0.1)
+            return {}
+
+        # storing the result is not counted as writing to Redis
+        with patch('moi.job.record.store_result', side_effect=store_result), \
+                patch('moi.job.metrics.observe_job') as observe_job:
+            _redis_wrap(self.test_job_info, lambda **kwargs: None)
+        self.assertTrue(0 < observe_job.call_args[0][1] < 0.1)
+
     def test_redis_wrap_except(self):
         def foo(a, b, **kwargs):
             return a+b
@@ -73,13 +269,39 @@ class MOITests(TestCase):
         with self.assertRaises(TypeError):
             _redis_wrap(self.test_job_info, foo, 1)
 
-        obs = json.loads(r_client.get(self.test_job_info['id']))
-        self.assertEqual(obs['result'][0],
+        obs = record.fetch(self.test_job_info['id'])
+        self.assertEqual(record.fetch_result(obs)[0],
                          u'Traceback (most recent call last):\n')
+        self.test_keys.append(obs['result_key'])
         self.assertEqual(obs['status'], 'Failed')
         self.assertNotEqual(obs['date_start'], None)
         self.assertNotEqual(obs['date_end'], None)
 
+    def test_streaming_system_call(self):
+        spool = NamedTemporaryFile(delete=False)
+        spool.close()
+        self.addCleanup(os.remove, spool.name)
+
+        progress = []
+        cmd = 'for i in 1 2 3 4; do echo $i; echo e$i >&2; done'
+        obs = streaming_system_call(cmd, tail=2, stdout_fp=spool.name,
+                                    progress='stderr',
+                                    moi_update_status=progress.append)
+        self.assertEqual(obs, ('3\n4\n', 'e3\ne4\n', 0))
+        self.assertEqual(progress, ['e1', 'e2', 'e3', 'e4'])
+        with open(spool.name) as f:
+            self.assertEqual(f.read(), '1\n2\n3\n4\n')
+
+    def test_streaming_system_call_fail(self):
+        with self.assertRaises(ValueError) as cm:
+            streaming_system_call('echo a; echo b; exit 2', tail=1)
+        # only the tail of stdout is reported
+        stdout = str(cm.exception).split('stdout (last 1 lines): ')[1]
+        self.assertEqual(stdout.split('\nstderr')[0], 'b\n')
+
+        with self.assertRaises(ValueError):
+            streaming_system_call('echo a', progress='foo')
+
     def test_submit(self):
         def foo(a, b, c=10, **kwargs):
             return a+b+c
@@ -92,8 +314,8 @@ class MOITests(TestCase):
 
             sleep(1)
 
-            obs = json.loads(r_client.get(id_))
-            self.assertEqual(obs['result'], 18)
+            obs = record.fetch(id_)
+            self.assertEqual(record.fetch_result(obs), 18)
             self.assertEqual(obs['status'], 'Success')
             self.assertNotEqual(obs['date_start'], None)
             self.assertNotEqual(obs['date_end'], None)
@@ -106,12 +328,267 @@ class MOITests(TestCase):
         self.test_keys.append(pid_)
         sleep(1)
 
-        obs = json.loads(r_client.get(id_))
-        self.assertEqual(obs['result'], [u"hello\n", u"", 0])
+        obs = record.fetch(id_)
+        self.assertEqual(record.fetch_result(obs), [u"hello\n", u"", 0])
         self.assertEqual(obs['status'], 'Success')
         self.assertNotEqual(obs['date_start'], None)
         self.assertNotEqual(obs['date_end'], None)
 
+    def test_get_context(self):
+        self.assertIs(_get_context(ctx_default), ctxs[ctx_default])
+        self.assertIs(_get_context('missing'), ctxs[ctx_default])
+        self.assertIs(_get_context(ctxs[ctx_default]), ctxs[ctx_default])
+
+    def test_get_context_auto(self):
+        with patch('moi.scheduler_pins', [('test*', ctx_default)]):
+            self.assertIs(_get_context('auto', 'test'), ctxs[ctx_default])
+
+        with patch('moi.ctx_default', 'auto'):
+            self.assertIn(_get_context('missing', 'test', 3),
+                          list(ctxs.values()))
+
+    def test_submit_many(self):
+        def foo(a, b, c=10, **kwargs):
+            return a+b+c
+
+        ids, pid_, ar = submit_many(ctx_default, 'no parent', 'test', '/',
+                                    foo, [(1, 2), (3, 4), (5, 6)], c=1)
+        self.test_keys.extend(ids)
+        self.test_keys.append(pid_)
+        self.test_keys.append(pid_ + ':children')
+        self.test_keys.extend([i + ':result' for i in ids])
+
+        self.assertEqual(ar.get(timeout=10), [4, 8, 12])
+
+        for i, id_ in enumerate(ids):
+            obs = record.fetch(id_)
+            self.assertEqual(obs['name'], 'test-%d' % i)
+            self.assertEqual(obs['parent'], pid_)
+            self.assertEqual(obs['status'], 'Success')
+        self.assertEqual(record.fetch_result(record.fetch(ids[1])), 8)
+
+    def test__submit_many_empty(self):
+        with self.assertRaises(ValueError):
+            _submit_many(ctxs.values()[0], 'no parent', 'test', '/', str, [])
+
+    def test__submit_many_memoize(self):
+        def foo(a, **kwargs):
+            return sorted(kwargs)
+
+        with self.assertRaises(ValueError):
+            _submit_many(ctxs.values()[0], 'no parent', 'test', '/', foo,
+                         [(1, )], memoize=True)
+
+        # the flag is not passed on to the function
+        ids, pid_, ar = _submit_many(ctxs.values()[0], 'no parent', 'test',
+                                     '/', foo, [(1, )], memoize=False)
+        self.test_keys.extend(ids)
+        self.test_keys.extend([pid_, pid_ + ':children'])
+        self.test_keys.extend([i + ':result' for i in ids])
+        self.assertNotIn('memoize', ar.get(timeout=10)[0])
+
+    def test_create_jobs(self):
+        ctx = ctxs.values()[0]
+        self.test_keys.extend(['_moi_test_parent',
+                               '_moi_test_parent:children',
+                               '_moi_test_parent:counts',
+                               '_moi_test_parent:created'])
+        infos, pid_ = _create_jobs(ctx, '_moi_test_parent', ['a', 'b'], '/')
+        ids = [info['id'] for info in infos]
+        self.test_keys.extend(ids)
+
+        self.assertEqual(pid_, '_moi_test_parent')
+        self.assertEqual(record.fetch(pid_)['type'], 'group')
+        self.assertEqual(r_client.smembers('_moi_test_parent:children'),
+                         set(ids))
+        self.assertEqual([record.fetch(i) for i in ids], infos)
+        self.assertEqual([info['status'] for info in infos],
+                         ['Queued', 'Queued'])
+        self.assertEqual(get_summary(pid_)['Queued'], 2)
+        self.assertEqual(r_client.zcard('_moi_test_parent:created'), 2)
+
+        # jobs which are never run expire, as does the group created for them
+        for id_ in [pid_] + ids:
+            self.assertTrue(0 < r_client.ttl(id_) <= REDIS_KEY_TIMEOUT)
+
+    def test_create_jobs_depends_on(self):
+        ctx = ctxs.values()[0]
+        self.test_keys.extend(['_moi_test_parent',
+                               '_moi_test_parent:children',
+                               '_moi_test_parent:counts',
+                               '_moi_test_parent:created',
+                               '_moi_test_a', '_moi_test_b'])
+        infos, pid_ = _create_jobs(ctx, '_moi_test_parent', ['a', 'b'], '/',
+                                   ids=['_moi_test_a', '_moi_test_b'],
+                                   depends_on=[[], ['_moi_test_a']])
+
+        self.assertEqual([info['status'] for info in infos],
+                         ['Queued', 'Blocked'])
+        self.assertEqual(record.fetch('_moi_test_b')['depends_on'],
+                         ['_moi_test_a'])
+        self.assertEqual(get_summary(pid_)['Blocked'], 1)
+
+    def test_create_jobs_blocked(self):
+        ctx = ctxs.values()[0]
+        self.test_keys.extend(['_moi_test_parent',
+                               '_moi_test_parent:children',
+                               '_moi_test_parent:counts',
+                               '_moi_test_parent:created',
+                               '_moi_test_a'])
+        # the jobs depended on have completed, so there is nothing to wait on
+        infos, pid_ = _create_jobs(ctx, '_moi_test_parent', ['a'], '/',
+                                   ids=['_moi_test_a'],
+                                   depends_on=[['_moi_test_done']],
+                                   blocked=[False])
+
+        self.assertEqual(infos[0]['status'], 'Queued')
+        self.assertEqual(record.fetch('_moi_test_a')['depends_on'],
+                         ['_moi_test_done'])
+        self.assertEqual(get_summary(pid_)['Blocked'], 0)
+
+    def test_after(self):
+        ctx = ctxs.values()[0]
+        record.store({'id': self.test_id, 'status': 'Success',
+                      'context': ctx.name})
+        record.store({'id': self.test_pubsub, 'status': 'Queued',
+                      'context': ctx.name, 'msg_id': 'foo'})
+        self.assertEqual(_after(ctx, [self.test_id, self.test_pubsub]),
+                         ['foo'])
+        self.assertEqual(_after(ctx, [self.test_id]), [])
+
+    def test_after_pending(self):
+        # a job being submitted records its message after it is created
+        ctx = ctxs.values()[0]
+        record.store({'id': self.test_id, 'status': 'Queued',
+                      'context': ctx.name, 'msg_id': None})
+        timer = Timer(0.2, record.update, (self.test_id, {'msg_id': 'foo'}))
+        timer.start()
+        self.assertEqual(_after(ctx, [self.test_id]), ['foo'])
+        timer.join()
+
+    def test_after_pending_timeout(self):
+        ctx = ctxs.values()[0]
+        record.store({'id': self.test_id, 'status': 'Blocked',
+                      'context': ctx.name, 'msg_id': None})
+        with self.assertRaises(ValueError):
+            _after(ctx, [self.test_id], timeout=0.1)
+
+    def test_topological_order(self):
+        self.assertEqual(_topological_order({'d': ['b', 'c'], 'c': ['a'],
+                                             'b': ['a', 'a'], 'a': []}),
+                         ['a', 'b', 'c', 'd'])
+
+    def test_topological_order_invalid(self):
+        with self.assertRaises(ValueError):
+            _topological_order({})
+        with self.assertRaises(ValueError):
+            _topological_order({'a': ['missing']})
+        with self.assertRaises(ValueError):
+            _topological_order({'a': ['b'], 'b': ['a'], 'c': []})
+
+    def test_failed_dependencies(self):
+        record.store({'id': self.test_id, 'status': 'Success'})
+        record.store({'id': self.test_pubsub, 'status': 'Failed'})
+        self.assertEqual(_failed_dependencies([self.test_id, self.test_pubsub,
+                                               '_moi_test_missing']),
+                         [self.test_pubsub, '_moi_test_missing'])
+
+    def test_submit_dag(self):
+        def add(*args, **kwargs):
+            return sum(args) + kwargs.get('c', 0)
+
+        ids, pid_, ars = submit_dag(
+            ctx_default, 'no parent', '/',
+            {'a': {'func': add, 'args': (1, 2)},
+             'b': {'func': add, 'args': (3, ), 'depends_on': ['a']},
+             'c': {'func': add, 'kwargs': {'c': 4}, 'depends_on': ['a']},
+             'd': {'func': add, 'depends_on': ['b', 'c']}})
+        self.test_keys.extend(ids.values())
+        self.test_keys.extend([pid_, pid_ + ':children'])
+        self.test_keys.extend([i + ':result' for i in ids.values()])
+
+        ars['d'].get(timeout=10)
+        sleep(0.5)
+
+        for name in ids:
+            obs = record.fetch(ids[name])
+            self.assertEqual(obs['status'], 'Success')
+            self.assertEqual(obs['msg_id'], ars[name].msg_ids[0])
+        self.assertEqual(record.fetch(ids['d'])['depends_on'],
+                         [ids['b'], ids['c']])
+
+        # b and c ended before d started
+        d_started = record.fetch(ids['d'])['time_started']
+        for name in ('b', 'c'):
+            self.assertLessEqual(record.fetch(ids[name])['time_ended'],
+                                 d_started)
+
+    def test_submit_depends_on_failed(self):
+        def fail(**kwargs):
+            raise ValueError("failed")
+
+        id_, pid_, ar = submit(ctx_default, 'no parent', 'test', '/', fail)
+        dep_id, _, dep_ar = submit(ctx_default, pid_, 'test', '/', str,
+                                   depends_on=[id_])
+        self.test_keys.extend([id_, dep_id, pid_, pid_ + ':children',
+                               id_ + ':result', dep_id + ':result'])
+
+        self.assertEqual(record.fetch(dep_id)['depends_on'], [id_])
+        with self.assertRaises(Exception):
+            dep_ar.get(timeout=10)
+        sleep(0.5)
+
+        self.assertEqual(record.fetch(id_)['status'], 'Failed')
+        obs = record.fetch(dep_id)
+        self.assertEqual(obs['status'], 'Failed')
+        self.assertIn('Dependencies did not succeed',
+                      ''.join(record.fetch_result(obs)))
+
+    def test_submit_memoize(self):
+        def foo(a, b, **kwargs):
+            return a + b
+
+        id_, pid_, ar = submit(ctx_default, 'no parent', 'test', '/', foo, 1,
+                               2, memoize=True)
+        self.test_keys.extend([id_, pid_, pid_ + ':children', id_ + ':result'])
+        self.assertEqual(ar.get(timeout=10), 3)
+        sleep(0.5)
+
+        key = record.fetch(id_)['memo_key']
+        self.test_keys.append(key)
+        self.assertEqual(key, memo.memo_key(foo, (1, 2), {}))
+        hits = memo.stats()['hits']
+
+        memo_id, _, memo_ar = submit(ctx_default, pid_, 'test', '/', foo, 1,
+                                     2, memoize=True)
+        self.test_keys.extend([memo_id, memo_id + ':result'])
+        self.assertIsInstance(memo_ar, memo.MemoizedResult)
+        self.assertEqual(memo_ar.get(), 3)
+        self.assertEqual(memo.stats()['hits'], hits + 1)
+
+        obs = record.fetch(memo_id)
+        self.assertEqual(obs['status'], 'Success')
+        self.assertEqual(obs['memo_key'], key)
+        self.assertEqual(obs['result_key'], memo_id + ':result')
+        self.assertEqual(record.fetch_result(obs), 3)
+
+    def test_submit_memoize_depends_on(self):
+        # jobs with dependencies are not memoized
+        id_, pid_, ar = submit(ctx_default, 'no parent', 'test', '/', str,
+                               memoize=True)
+        dep_id, _, dep_ar = submit(ctx_default, pid_, 'test', '/', str,
+                                   memoize=True, depends_on=[id_])
+        self.test_keys.extend([id_, dep_id, pid_, pid_ + ':children',
+                               id_ + ':result', dep_id + ':result',
+                               memo.memo_key(str, (), {})])
+        dep_ar.get(timeout=10)
+        self.assertEqual(record.fetch(dep_id)['memo_key'], None)
+
+    def test_submit_depends_on_unknown(self):
+        with self.assertRaises(ValueError):
+            submit(ctx_default, 'no parent', 'test', '/', str,
+                   depends_on=['_moi_test_missing'])
+
     def test_submit_nouser(self):
         def foo(a, b, c=10, **kwargs):
             return a+b+c
@@ -122,8 +599,8 @@ class MOITests(TestCase):
 
         sleep(1)
 
-        obs = json.loads(r_client.get(id_))
-        self.assertEqual(obs['result'], 23)
+        obs = record.fetch(id_)
+        self.assertEqual(record.fetch_result(obs), 23)
         self.assertEqual(obs['status'], 'Success')
         self.assertNotEqual(obs['date_start'], None)
         self.assertNotEqual(obs['date_end'], None)
@@ -0,0 +1,198 @@
+# -----------------------------------------------------------------------------
+# Copyright (c) 2014--, The qiita Development Team.
+#
+# Distributed under the terms of the BSD 3-clause License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# -----------------------------------------------------------------------------
+
+import os
+from functools import partial
+from shutil import rmtree
+from tempfile import mkdtemp
+from unittest import TestCase, main
+
+from mock import patch
+
+from moi import r_client
+from moi import record
+from moi.memo import (memo_key, lookup, copy_result, remember, hit, forget,
+                      stats, MemoizedResult)
+
+
+def add(a, b=1):
+    return a + b
+
+
+def sub(a, b=1):
+    return a - b
+
+
+class MemoTests(TestCase):
+    def setUp(self):
+        for name, value in (('_INDEX_KEY', '_moi_test_memo'),
+                            ('_STATS_KEY', '_moi_test_memo:stats')):
+            patcher = patch('moi.memo.%s' % name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        self.info = {'id': '_moi_test_job'}
+        self.info.update(record.store_result('_moi_test_job', [1, 2]))
+        self.to_delete = ['_moi_test_memo', '_moi_test_memo:stats',
+                          '_moi_test_job:result', '_moi_test_copy:result']
+
+    def tearDown(self):
+        for key in self.to_delete:
+            r_client.delete(key)
+
+    def key(self, *args):
+        key = memo_key(add, args, {})
+        self.to_delete.append(key)
+        return key
+
+    def test_memo_key(self):
+        key = memo_key(add, (1, ), {'b': 2})
+        self.assertTrue(key.startswith('moi:memo:'))
+        self.assertEqual(key, memo_key(add, (1, ), {'b': 2}))
+        self.assertNotEqual(key, memo_key(add, (1, ), {'b': 3}))
+        self.assertNotEqual(key, memo_key(add, (1, 2), {}))
+        self.assertNotEqual(key, memo_key(sub, (1, ), {'b': 2}))
+        self.assertEqual(memo_key(partial(add, 1), (), {}),
+                         memo_key(partial(add, 1), (), {}))
+        self.assertEqual(memo_key(len, ([1], ), {}),
+                         memo_key(len, ([1], ), {}))
+
+    def test_memo_key_names(self):
+        def stat(x, **kwargs):
+            return x.mean()
+        mean = stat
+
+        def stat(x, **kwargs):
+            return x.max()
+
+        self.assertNotEqual(memo_key(mean, (1, ), {}),
+                            memo_key(stat, (1, ), {}))
+
+    def test_memo_key_unordered(self):
+        items = ['item-%d' % i for i in range(20)]
+        self.assertEqual(memo_key(add, (set(items), ), {}),
+                         memo_key(add, (set(reversed(items)), ), {}))
+        self.assertEqual(memo_key(add, (dict.fromkeys(items), ), {}),
+                         memo_key(add, (dict.fromkeys(items[::-1]), ), {}))
+        self.assertNotEqual(memo_key(add, (set(items), ), {}),
+                            memo_key(add, (frozenset(items), ), {}))
+        self.assertNotEqual(memo_key(add, (set(items), ), {}),
+                            memo_key(add, (sorted(items), ), {}))
+
+    def test_memo_key_closure(self):
+        def make(n):
+            def f(a):
+                return a + n
+            return f
+
+        self.assertEqual(memo_key(make(1), (1, ), {}),
+                         memo_key(make(1), (1, ), {}))
+        self.assertNotEqual(memo_key(make(1), (1, ), {}),
+                            memo_key(make(2), (1, ), {}))
+
+    def test_memo_key_unpicklable(self):
+        self.assertEqual(memo_key(add, (lambda: None, ), {}), None)
+
+    def test_lookup(self):
+        key = self.key(1)
+        self.assertEqual(lookup(key), None)
+
+        remember(key, self.info)
+        obs = lookup(key)
+        self.assertEqual(obs['result_key'], '_moi_test_job:result')
+        self.assertEqual(obs['result_checksum'],
+                         self.info['result_checksum'])
+
+        self.assertEqual(stats(), {'lookups': 2, 'hits': 0, 'stores': 1,
+                                   'evictions': 0, 'hit_rate': 0.0})
+
+    def test_copy_result(self):
+        obs = copy_result(self.info, '_moi_test_copy')
+        self.assertEqual(obs['result_key'], '_moi_test_copy:result')
+        self.assertEqual(record.fetch_result(dict(obs, id='_moi_test_copy')),
+                         [1, 2])
+        self.assertGreater(r_client.ttl('_moi_test_copy:result'), 0)
+
+        r_client.delete('_moi_test_job:result')
+        self.assertEqual(copy_result(self.info, '_moi_test_copy2'), None)
+
+    def test_copy_result_file(self):
+        directory = mkdtemp()
+        self.addCleanup(rmtree, directory)
+        with patch('moi.result_directory', directory), \
+                patch('moi.result_offload_size', 0):
+            info = {'id': '_moi_test_job'}
+            info.update(record.store_result('_moi_test_job', [1, 2]))
+
+        obs = copy_result(info, '_moi_test_copy')
+        self.assertEqual(obs['result_path'],
+                         os.path.join(directory, '_moi_test_copy'))
+        self.assertEqual(record.fetch_result(dict(obs, id='_moi_test_copy')),
+                         [1, 2])
+
+        # the copy outlives the result it was copied from
+        os.remove(info['result_path'])
+        self.assertEqual(record.fetch_result(dict(obs, id='_moi_test_copy')),
+                         [1, 2])
+        self.assertEqual(copy_result(info, '_moi_test_copy2'), None)
+
+    def test_hit(self):
+        key = self.key(1)
+        remember(key, self.info)
+        lookup(key)
+
+        copied = copy_result(self.info, '_moi_test_copy')
+        hit(key, copied)
+        self.assertEqual(lookup(key)['result_key'], '_moi_test_copy:result')
+        self.assertEqual(stats()['hits'], 1)
+        self.assertEqual(stats()['hit_rate'], 0.5)
+
+    def test_forget(self):
+        key = self.key(1)
+        remember(key, self.info)
+        forget(key)
+        self.assertEqual(lookup(key), None)
+        self.assertEqual(r_client.zcard('_moi_test_memo'), 0)
+
+    def test_remember_evicts(self):
+        keys = [self.key(i) for i in range(3)]
+        with patch('moi.memo_max_entries', 2), \
+                patch('moi.memo.time', side_effect=[1.0, 2.0, 3.0]):
+            for key in keys:
+                remember(key, self.info)
+
+            # the least recently used entry is evicted
+            self.assertEqual(lookup(keys[0]), None)
+            self.assertNotEqual(lookup(keys[1]), None)
+            self.assertNotEqual(lookup(keys[2]), None)
+        self.assertEqual(stats()['evictions'], 1)
+
+    def test_remember_expires(self):
+        key = self.key(1)
+        with patch('moi.memo_ttl', 100):
+            remember(key, self.info)
+        self.assertTrue(0 < r_client.ttl(key) <= 100)
+
+    def test_stats_empty(self):
+        self.assertEqual(stats(), {'lookups': 0, 'hits': 0, 'stores': 0,
+                                   'evictions': 0, 'hit_rate': None})
+
+    def test_memoized_result(self):
+        record.store(self.info)
+        self.to_delete.append('_moi_test_job')
+
+        ar = MemoizedResult('_moi_test_job')
+        self.assertTrue(ar.ready())
+        self.assertTrue(ar.successful())
+        self.assertEqual(ar.msg_ids, [])
+        ar.wait()
+        self.assertEqual(ar.get(), [1, 2])
+
+
+if __name__ == '__main__':
+    main()
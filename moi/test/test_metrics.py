@@ -0,0 +1,98 @@
+# -----------------------------------------------------------------------------
+# Copyright (c) 2014--, The qiita Development Team.
+#
+# Distributed under the terms of the BSD 3-clause License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# -----------------------------------------------------------------------------
+
+from unittest import TestCase, main
+
+from mock import patch
+
+from moi import r_client
+from moi.metrics import (HISTOGRAMS, observe, observe_job, render,
+                         _metrics_key)
+
+
+class MetricsTests(TestCase):
+    def tearDown(self):
+        for name in HISTOGRAMS:
+            r_client.delete(_metrics_key(name))
+
+    def test_observe(self):
+        with r_client.pipeline() as pipe:
+            observe(pipe, 'moi_job_run_seconds', 'foo', 0.01)
+            observe(pipe, 'moi_job_run_seconds', 'foo', 0.02)
+            observe(pipe, 'moi_job_run_seconds', 'foo', 10 ** 6)
+            pipe.execute()
+
+        obs = r_client.hgetall(_metrics_key('moi_job_run_seconds'))
+        self.assertEqual(obs['foo:1'], '1')
+        self.assertEqual(obs['foo:2'], '1')
+        self.assertEqual(obs['foo:%d' % len(HISTOGRAMS['moi_job_run_seconds']
+                                            [1])], '1')
+        self.assertEqual(obs['foo:count'], '3')
+        self.assertAlmostEqual(float(obs['foo:sum']), 10 ** 6 + 0.03)
+
+    def test_observe_job(self):
+        info = {'context': 'foo', 'time_queued': 10.0,
+                'time_picked_up': 12.0, 'time_started': 12.5,
+                'time_ended': 13.0, 'result_size': 100}
+        observe_job(info, 0.001)
+
+        for name in HISTOGRAMS:
+            obs = r_client.hget(_metrics_key(name), 'foo:count')
+            self.assertEqual(obs, '1')
+        self.assertEqual(r_client.hget(
+            _metrics_key('moi_job_queue_wait_seconds'), 'foo:sum'), '2')
+
+        # jobs without the times of older versions are partially observed
+        observe_job({'context': 'foo', 'result_size': None}, 0.001)
+        self.assertEqual(r_client.hget(
+            _metrics_key('moi_job_run_seconds'), 'foo:count'), '1')
+        self.assertEqual(r_client.hget(
+            _metrics_key('moi_job_redis_seconds'), 'foo:count'), '2')
+
+    def test_render(self):
+        with r_client.pipeline() as pipe:
+            observe(pipe, 'moi_job_run_seconds', 'foo', 0.01)
+            observe(pipe, 'moi_job_run_seconds', 'foo', 2)
+            observe(pipe, 'moi_job_run_seconds', 'a "b"', 2)
+            pipe.execute()
+
+        obs = render().splitlines()
+        self.assertIn('# TYPE moi_job_run_seconds histogram', obs)
+        self.assertIn('# TYPE moi_job_queue_wait_seconds histogram', obs)
+        self.assertIn('moi_job_run_seconds_bucket{context="foo",le="0.005"} '
+                      '0', obs)
+        self.assertIn('moi_job_run_seconds_bucket{context="foo",le="0.01"} '
+                      '1', obs)
+        self.assertIn('moi_job_run_seconds_bucket{context="foo",le="2.5"} '
+                      '2', obs)
+        self.assertIn('moi_job_run_seconds_bucket{context="foo",le="+Inf"} '
+                      '2', obs)
+        self.assertIn('moi_job_run_seconds_sum{context="foo"} 2.01', obs)
+        self.assertIn('moi_job_run_seconds_count{context="foo"} 2', obs)
+        self.assertIn('moi_job_run_seconds_count{context="a \\"b\\""} 1',
+                      obs)
+        self.assertIn('# TYPE moi_memo_hits_total counter', obs)
+        self.assertIn('# TYPE moi_redis_pool_in_use gauge', obs)
+
+    def test_render_pool(self):
+        stats = {'max_connections': 4, 'in_use': 4, 'created': 4,
+                 'waits': 3, 'exhausted': 1}
+        with patch('moi.metrics.pool_stats', return_value=stats):
+            obs = render().splitlines()
+
+        self.assertIn('# TYPE moi_redis_pool_max_connections gauge', obs)
+        self.assertIn('moi_redis_pool_max_connections 4', obs)
+        self.assertIn('moi_redis_pool_in_use 4', obs)
+        self.assertIn('moi_redis_pool_created 4', obs)
+        self.assertIn('# TYPE moi_redis_pool_waits_total counter', obs)
+        self.assertIn('moi_redis_pool_waits_total 3', obs)
+        self.assertIn('moi_redis_pool_exhausted_total 1', obs)
+
+
+if __name__ == '__main__':
+    main()
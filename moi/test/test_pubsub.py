@@ -0,0 +1,136 @@
+# -----------------------------------------------------------------------------
+# Copyright (c) 2014--, The qiita Development Team.
+#
+# Distributed under the terms of the BSD 3-clause License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# -----------------------------------------------------------------------------
+
+from unittest import TestCase, main
+
+from moi.pubsub import Subscriber, get_subscriber
+
+
+class RecordingClient(object):
+    """Records the subscriptions made on the pub/sub connection"""
+    def __init__(self):
+        self.calls = []
+
+    def subscribe(self, channel, callback=None):
+        self.calls.append(('subscribe', channel))
+
+    def unsubscribe(self, channel):
+        self.calls.append(('unsubscribe', channel))
+
+
+class SubscriberTests(TestCase):
+    def setUp(self):
+        self.client = RecordingClient()
+        self.obj = Subscriber(self.client)
+        self.received = []
+
+    def listener(self, msg):
+        self.received.append(('listener', msg))
+
+    def other(self, msg):
+        self.received.append(('other', msg))
+
+    def test_get_subscriber(self):
+        self.assertIs(get_subscriber(), get_subscriber())
+
+    def test_subscribe(self):
+        self.obj.subscribe('a', self.listener)
+        self.obj.subscribe('a', self.other)
+        self.obj.subscribe('b', self.listener)
+
+        self.assertEqual(self.client.calls, [('subscribe', 'a'),
+                                             ('subscribe', 'b')])
+        self.assertEqual(self.obj.channels, {'a', 'b'})
+        self.assertEqual(self.obj.listeners('a'), [self.listener, self.other])
+        self.assertEqual(self.obj.listeners('c'), [])
+
+    def test_unsubscribe(self):
+        self.obj.subscribe('a', self.listener)
+        self.obj.subscribe('a', self.other)
+
+        self.assertTrue(self.obj.unsubscribe('a', self.listener))
+        self.assertFalse(self.obj.unsubscribe('a', self.listener))
+        self.assertEqual(self.client.calls, [('subscribe', 'a')])
+
+        self.assertTrue(self.obj.unsubscribe('a', self.other))
+        self.assertEqual(self.client.calls, [('subscribe', 'a'),
+                                             ('unsubscribe', 'a')])
+        self.assertEqual(self.obj.channels, set())
+        self.assertFalse(self.obj.unsubscribe('b', self.other))
+
+    def test_dispatch(self):
+        def failing(msg):
+            raise ValueError("should not stop the fan out")
+
+        self.obj.subscribe('a', failing)
+        self.obj.subscribe('a', self.listener)
+        self.obj.subscribe('a', self.other)
+        self.obj.subscribe('b', self.other)
+
+        msg = ('message', 'a', '{}')
+        self.obj._dispatch(msg)
+        self.assertEqual(self.received, [('listener', msg), ('other', msg)])
+
+        self.received = []
+        self.obj._dispatch(('message', 'c', '{}'))
+        self.assertEqual(self.received, [])
+
+    def test_hook(self):
+        self.obj.add_hook(self.other)
+        self.obj.add_hook(self.other)
+        self.obj.subscribe('a', self.listener)
+
+        msg = ('message', 'a', '{}')
+        self.obj._dispatch(msg)
+        self.assertEqual(self.received, [('other', msg), ('listener', msg)])
+
+        self.received = []
+        msg = ('message', 'c', '{}')
+        self.obj._dispatch(msg)
+        self.assertEqual(self.received, [('other', msg)])
+
+    def test_generation(self):
+        self.assertEqual(self.obj.generation('a'), None)
+
+        self.obj.subscribe('a', self.listener)
+        self.obj._dispatch(('subscribe', 'a', 1))
+        first = self.obj.generation('a')
+        self.assertNotEqual(first, None)
+        self.obj.subscribe('a', self.other)
+        self.assertEqual(self.obj.generation('a'), first)
+
+        self.obj.unsubscribe('a', self.listener)
+        self.obj.unsubscribe('a', self.other)
+        self.assertEqual(self.obj.generation('a'), None)
+
+        self.obj.subscribe('a', self.listener)
+        self.obj._dispatch(('subscribe', 'a', 1))
+        self.assertNotEqual(self.obj.generation('a'), first)
+
+    def test_generation_unconfirmed(self):
+        # messages published before the confirmation are not received
+        self.obj.subscribe('a', self.listener)
+        self.assertEqual(self.obj.generation('a'), None)
+
+        # the confirmation of an earlier subscription does not count
+        self.obj.unsubscribe('a', self.listener)
+        self.obj.subscribe('a', self.listener)
+        self.obj._dispatch(('subscribe', 'a', 1))
+        self.assertEqual(self.obj.generation('a'), None)
+        self.obj._dispatch(('unsubscribe', 'a', 0))
+        self.obj._dispatch(('subscribe', 'a', 1))
+        self.assertNotEqual(self.obj.generation('a'), None)
+
+        # confirmations without a pending subscription are ignored
+        first = self.obj.generation('a')
+        self.obj._dispatch(('subscribe', 'a', 1))
+        self.assertEqual(self.obj.generation('a'), first)
+
+
+if __name__ == '__main__':
+    main()
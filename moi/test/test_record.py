@@ -0,0 +1,193 @@
+# -----------------------------------------------------------------------------
+# Copyright (c) 2014--, The qiita Development Team.
+#
+# Distributed under the terms of the BSD 3-clause License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# -----------------------------------------------------------------------------
+
+import os
+import json
+from shutil import rmtree
+from tempfile import mkdtemp
+from unittest import TestCase, main
+
+from redis import ResponseError
+
+import moi
+from moi import r_client
+from moi.record import (encode, decode, fetch_many, fetch, store, update,
+                        convert, store_result, fetch_result, open_result)
+
+
+class RecordTests(TestCase):
+    def setUp(self):
+        self.info = {'id': '_moi_test_record', 'type': 'job',
+                     'status': 'Queued', 'result': None, 'parent': 'x'}
+        self.to_delete = ['_moi_test_record', '_moi_test_legacy',
+                          '_moi_test_set', '_moi_test_record:result']
+
+    def tearDown(self):
+        for key in self.to_delete:
+            r_client.delete(key)
+
+    def test_encode(self):
+        obs = encode({'a': None, 'b': [1, 2], 'c': 'foo'})
+        self.assertEqual(obs, {'a': 'null', 'b': '[1, 2]', 'c': '"foo"'})
+
+    def test_decode(self):
+        self.assertEqual(decode({'a': 'null', 'b': '[1, 2]'}),
+                         {'a': None, 'b': [1, 2]})
+        self.assertEqual(decode('{"a": 1}'), {'a': 1})
+
+        with self.assertRaises(ValueError):
+            decode('not json')
+        with self.assertRaises(ValueError):
+            decode({'a': 'not json'})
+        with self.assertRaises(ValueError):
+            decode(None)
+
+    def test_fetch_many(self):
+        store(self.info)
+        r_client.set('_moi_test_legacy', json.dumps(self.info))
+        r_client.sadd('_moi_test_set', 'foo')
+
+        obs = fetch_many(['_moi_test_record', '_moi_test_legacy',
+                          '_moi_test_set', '_moi_test_missing'])
+        self.assertEqual(decode(obs[0]), self.info)
+        self.assertEqual(decode(obs[1]), self.info)
+        self.assertEqual(obs[2:], [None, None])
+        self.assertEqual(fetch_many([]), [])
+
+    def test_fetch(self):
+        self.assertEqual(fetch('_moi_test_record'), None)
+        store(self.info)
+        self.assertEqual(fetch('_moi_test_record'), self.info)
+
+    def test_store(self):
+        r_client.set('_moi_test_record', json.dumps({'old': 'info'}))
+        store(self.info, expire=100)
+        self.assertEqual(r_client.type('_moi_test_record'), 'hash')
+        self.assertEqual(fetch('_moi_test_record'), self.info)
+        self.assertTrue(0 < r_client.ttl('_moi_test_record') <= 100)
+
+    def test_store_pipeline(self):
+        with r_client.pipeline() as pipe:
+            store(self.info, pipe)
+            self.assertEqual(fetch('_moi_test_record'), None)
+            pipe.execute()
+        self.assertEqual(fetch('_moi_test_record'), self.info)
+
+    def test_update(self):
+        store(self.info)
+        update('_moi_test_record', {'status': 'Running', 'result': [1]})
+
+        exp = self.info.copy()
+        exp.update({'status': 'Running', 'result': [1]})
+        self.assertEqual(fetch('_moi_test_record'), exp)
+
+    def test_update_legacy(self):
+        r_client.set('_moi_test_legacy', json.dumps(self.info))
+        with self.assertRaises(ResponseError):
+            update('_moi_test_legacy', {'status': 'Running'})
+
+    def test_convert(self):
+        self.assertEqual(convert('_moi_test_legacy'), None)
+
+        r_client.set('_moi_test_legacy', json.dumps(self.info))
+        self.assertEqual(convert('_moi_test_legacy'), self.info)
+        self.assertEqual(r_client.type('_moi_test_legacy'), 'hash')
+        self.assertEqual(fetch('_moi_test_legacy'), self.info)
+
+    def test_store_result(self):
+        obs = store_result('_moi_test_record', {'foo': [1, 2, 3]}, expire=100)
+        self.assertEqual(obs['result_key'], '_moi_test_record:result')
+        self.assertEqual(obs['result_size'], len('{"foo": [1, 2, 3]}'))
+        self.assertEqual(len(obs['result_checksum']), 40)
+        self.assertEqual(obs['result_codec'], 'json')
+        self.assertEqual(r_client.get('_moi_test_record:result'),
+                         '{"foo": [1, 2, 3]}')
+        self.assertTrue(0 < r_client.ttl('_moi_test_record:result') <= 100)
+
+    def test_fetch_result(self):
+        self.info.update(store_result('_moi_test_record', [1, 'a']))
+        self.assertEqual(fetch_result(self.info), [1, 'a'])
+
+        r_client.set('_moi_test_record:result', '[1, "b"]')
+        with self.assertRaises(ValueError):
+            fetch_result(self.info)
+
+        r_client.delete('_moi_test_record:result')
+        self.assertEqual(fetch_result(self.info), None)
+
+    def test_fetch_result_codec(self):
+        self.info.update(store_result('_moi_test_record', {1, 2},
+                                      codec='pickle+zlib'))
+        self.assertEqual(self.info['result_codec'], 'pickle+zlib')
+        self.assertEqual(fetch_result(self.info), {1, 2})
+
+        # results stored prior to codecs are JSON
+        self.info.update(store_result('_moi_test_record', [1]))
+        del self.info['result_codec']
+        self.assertEqual(fetch_result(self.info), [1])
+
+    def offload(self):
+        directory = mkdtemp()
+        self.addCleanup(rmtree, directory)
+        for name, value in (('result_directory', directory),
+                            ('result_offload_size', 4)):
+            self.addCleanup(setattr, moi, name, getattr(moi, name))
+            setattr(moi, name, value)
+        return directory
+
+    def test_store_result_offload(self):
+        directory = self.offload()
+
+        obs = store_result('_moi_test_record', [1, 2, 3])
+        self.assertEqual(obs['result_key'], None)
+        self.assertEqual(obs['result_path'],
+                         os.path.join(directory, '_moi_test_record'))
+        with open(obs['result_path'], 'rb') as f:
+            self.assertEqual(f.read(), b'[1, 2, 3]')
+        self.assertFalse(r_client.exists('_moi_test_record:result'))
+
+        # small results remain in redis
+        obs = store_result('_moi_test_record', 1)
+        self.assertEqual(obs['result_key'], '_moi_test_record:result')
+        self.assertEqual(obs['result_path'], None)
+
+    def test_fetch_result_offload(self):
+        self.offload()
+        self.info.update(store_result('_moi_test_record', {'foo': [1, 2]}))
+        self.assertEqual(fetch_result(self.info), {'foo': [1, 2]})
+
+        with open(self.info['result_path'], 'wb') as f:
+            f.write(b'{"foo": [1, 3]}')
+        with self.assertRaises(ValueError):
+            fetch_result(self.info)
+
+        os.remove(self.info['result_path'])
+        self.assertEqual(fetch_result(self.info), None)
+
+    def test_open_result(self):
+        self.assertEqual(open_result(self.info), None)
+
+        self.info.update(store_result('_moi_test_record', [1]))
+        with open_result(self.info) as f:
+            self.assertEqual(f.read(), b'[1]')
+
+        self.offload()
+        self.info.update(store_result('_moi_test_record', [1, 2, 3]))
+        with open_result(self.info) as f:
+            self.assertEqual(f.read(), b'[1, 2, 3]')
+
+        os.remove(self.info['result_path'])
+        self.assertEqual(open_result(self.info), None)
+
+    def test_fetch_result_legacy(self):
+        self.assertEqual(fetch_result({'id': 'x', 'result': 42}), 42)
+        self.assertEqual(fetch_result({'id': 'x'}), None)
+
+
+if __name__ == '__main__':
+    main()
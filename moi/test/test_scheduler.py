@@ -0,0 +1,114 @@
+# -----------------------------------------------------------------------------
+# Copyright (c) 2014--, The qiita Development Team.
+#
+# Distributed under the terms of the BSD 3-clause License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# -----------------------------------------------------------------------------
+
+from unittest import TestCase, main
+
+from mock import patch
+
+from moi.scheduler import Scheduler, queue_load
+
+
+class FakeClient(object):
+    def __init__(self, status):
+        self.status = status
+        self.queried = 0
+
+    def queue_status(self):
+        self.queried += 1
+        if isinstance(self.status, Exception):
+            raise self.status
+        return self.status
+
+
+class FakeContext(object):
+    def __init__(self, name, status):
+        self.name = name
+        self.client = FakeClient(status)
+
+
+def _status(engines, outstanding, unassigned=0):
+    """A queue status with the outstanding tasks spread over the engines"""
+    status = {'unassigned': unassigned}
+    for i in range(engines):
+        status[i] = {'queue': 0, 'completed': 10,
+                     'tasks': outstanding // engines}
+    return status
+
+
+class SchedulerTests(TestCase):
+    def setUp(self):
+        self.ctxs = {'a': FakeContext('a', _status(4, 8)),
+                     'b': FakeContext('b', _status(2, 2)),
+                     'c': FakeContext('c', IOError('unreachable')),
+                     'd': FakeContext('d', _status(0, 0))}
+        self.scheduler = Scheduler(self.ctxs)
+
+        for name, value in (('scheduler_weights', {}),
+                            ('scheduler_pins', []),
+                            ('scheduler_refresh', 60)):
+            patcher = patch('moi.%s' % name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_queue_load(self):
+        status = {0: {'queue': 1, 'completed': 5, 'tasks': 2},
+                  1: {'queue': 0, 'completed': 3, 'tasks': 1},
+                  'unassigned': 4}
+        self.assertEqual(queue_load(status), (8, 2))
+        self.assertEqual(queue_load({'unassigned': 0}), (0, 0))
+
+    def test_load(self):
+        self.assertEqual(self.scheduler.load('a'), 2.0)
+        self.assertEqual(self.scheduler.load('b'), 1.0)
+
+    def test_load_unhealthy(self):
+        self.assertEqual(self.scheduler.load('c'), None)
+        self.assertEqual(self.scheduler.load('d'), None)
+
+    def test_load_weights(self):
+        with patch('moi.scheduler_weights', {'a': 4, 'b': 0}):
+            self.assertEqual(self.scheduler.load('a'), 0.5)
+            self.assertEqual(self.scheduler.load('b'), None)
+
+    def test_load_refresh(self):
+        self.scheduler.load('a')
+        self.scheduler.load('a')
+        self.assertEqual(self.ctxs['a'].client.queried, 1)
+
+        with patch('moi.scheduler_refresh', 0):
+            self.scheduler.load('a')
+        self.assertEqual(self.ctxs['a'].client.queried, 2)
+
+    def test_choose(self):
+        self.assertIs(self.scheduler.choose('foo'), self.ctxs['b'])
+
+    def test_choose_accounts_jobs(self):
+        # b holds 2 tasks on 2 engines and a holds 8 on 4, so 3 more jobs
+        # make b the more loaded
+        self.assertIs(self.scheduler.choose('foo', 3), self.ctxs['b'])
+        self.assertEqual(self.scheduler.load('b'), 2.5)
+        self.assertIs(self.scheduler.choose('foo'), self.ctxs['a'])
+
+    def test_choose_weights(self):
+        with patch('moi.scheduler_weights', {'a': 4}):
+            self.assertIs(self.scheduler.choose('foo'), self.ctxs['a'])
+
+    def test_choose_pins(self):
+        with patch('moi.scheduler_pins', [('x*', 'missing'), ('f*', 'a')]):
+            self.assertIs(self.scheduler.choose('foo'), self.ctxs['a'])
+            self.assertIs(self.scheduler.choose('bar'), self.ctxs['b'])
+            self.assertIs(self.scheduler.choose('xyz'), self.ctxs['b'])
+
+    def test_choose_none_healthy(self):
+        scheduler = Scheduler({'c': self.ctxs['c'], 'd': self.ctxs['d']})
+        with self.assertRaises(ValueError):
+            scheduler.choose('foo')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,136 @@
+# -----------------------------------------------------------------------------
+# Copyright (c) 2014--, The qiita Development Team.
+#
+# Distributed under the terms of the BSD 3-clause License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# -----------------------------------------------------------------------------
+
+import json
+from unittest import TestCase, main
+
+from redis import ResponseError
+
+from moi import r_client
+from moi import record
+from moi.scripts import run, CREATE, WRITE, REMOVE
+from moi.summary import STATUSES
+
+
+class ScriptsTests(TestCase):
+    def setUp(self):
+        self.statuses = json.dumps(STATUSES)
+        self.to_delete = ['_moi_test_grp', '_moi_test_grp:children',
+                          '_moi_test_grp:created', '_moi_test_grp:ended',
+                          '_moi_test_grp:counts', '_moi_test_a',
+                          '_moi_test_b']
+
+    def tearDown(self):
+        for key in self.to_delete:
+            r_client.delete(key)
+
+    def create(self, parent_info=''):
+        infos = [{'id': '_moi_test_a', 'status': 'Queued'},
+                 {'id': '_moi_test_b', 'status': 'Queued'}]
+        run(CREATE, ['_moi_test_grp', '_moi_test_grp:children',
+                     '_moi_test_grp:created', '_moi_test_grp:counts',
+                     '_moi_test_a', '_moi_test_b'],
+            [self.statuses, 1, 100, 200, parent_info, 5.0, '', ''] +
+            [json.dumps(record.encode(info)) for info in infos])
+
+    def test_create(self):
+        group = {'id': '_moi_test_grp', 'type': 'group'}
+        self.create(json.dumps(record.encode(group)))
+
+        self.assertEqual(record.fetch('_moi_test_grp'), group)
+        self.assertEqual(record.fetch('_moi_test_a'),
+                         {'id': '_moi_test_a', 'status': 'Queued'})
+        self.assertTrue(0 < r_client.ttl('_moi_test_a') <= 100)
+        self.assertTrue(0 < r_client.ttl('_moi_test_grp') <= 100)
+        self.assertEqual(r_client.smembers('_moi_test_grp:children'),
+                         {'_moi_test_a', '_moi_test_b'})
+        self.assertEqual(r_client.zscore('_moi_test_grp:created',
+                                         '_moi_test_b'), 5.0)
+        self.assertEqual(r_client.hget('_moi_test_grp:counts', 'Queued'),
+                         '2')
+        self.assertTrue(100 < r_client.ttl('_moi_test_grp:counts') <= 200)
+
+    def test_create_existing_group(self):
+        record.store({'id': '_moi_test_grp', 'name': 'existing'})
+        self.create(json.dumps(record.encode({'id': '_moi_test_grp'})))
+        self.assertEqual(record.fetch('_moi_test_grp')['name'], 'existing')
+
+    def test_write(self):
+        self.create()
+        pubsub = r_client.pubsub()
+        pubsub.subscribe('_moi_test_channel')
+        self.assertEqual(pubsub.get_message(timeout=1)['type'], 'subscribe')
+
+        old = run(WRITE, ['_moi_test_a', '_moi_test_grp:ended',
+                          '_moi_test_grp:children', '_moi_test_grp:counts'],
+                  [self.statuses, '0', json.dumps({'status': '"Success"'}),
+                   100, '"Success"', 7.0, 'msg', '_moi_test_channel'])
+        self.assertEqual(old, '"Queued"')
+        self.assertEqual(record.fetch('_moi_test_a'),
+                         {'id': '_moi_test_a', 'status': 'Success'})
+        self.assertEqual(r_client.hmget('_moi_test_grp:counts', 'Queued',
+                                        'Success'), ['1', '1'])
+        self.assertEqual(r_client.zscore('_moi_test_grp:ended',
+                                         '_moi_test_a'), 7.0)
+        self.assertEqual(pubsub.get_message(timeout=1)['data'], 'msg')
+        pubsub.close()
+
+        # custom statuses are counted as Running, and replacing the info
+        # object without a status removes it from the counts
+        run(WRITE, ['_moi_test_b', '_moi_test_b', '_moi_test_grp:children',
+                    '_moi_test_grp:counts'],
+            [self.statuses, '0', json.dumps({'status': '"halfway"'}), 100,
+             '"halfway"', '', 'msg'])
+        self.assertEqual(r_client.hget('_moi_test_grp:counts', 'Running'),
+                         '1')
+        run(WRITE, ['_moi_test_b', '_moi_test_b', '_moi_test_grp:children',
+                    '_moi_test_grp:counts'],
+            [self.statuses, '1', json.dumps({'id': '"_moi_test_b"'}), 100,
+             'null', '', 'msg'])
+        self.assertEqual(record.fetch('_moi_test_b'), {'id': '_moi_test_b'})
+        self.assertEqual(r_client.hget('_moi_test_grp:counts', 'Running'),
+                         '0')
+
+    def test_remove(self):
+        self.create()
+        keys = ['_moi_test_a', '_moi_test_grp:children',
+                '_moi_test_grp:created', '_moi_test_grp:ended',
+                '_moi_test_a:counts', '_moi_test_grp:counts']
+        self.assertEqual(run(REMOVE, keys, [self.statuses]), 1)
+        self.assertEqual(r_client.smembers('_moi_test_grp:children'),
+                         {'_moi_test_b'})
+        self.assertEqual(r_client.zscore('_moi_test_grp:created',
+                                         '_moi_test_a'), None)
+        self.assertEqual(r_client.hget('_moi_test_grp:counts', 'Queued'),
+                         '1')
+
+        # a node is only removed, and discounted, once
+        self.assertEqual(run(REMOVE, keys, [self.statuses]), 0)
+        self.assertEqual(r_client.hget('_moi_test_grp:counts', 'Queued'),
+                         '1')
+
+        # the writes of a removed node are not counted or indexed
+        run(WRITE, ['_moi_test_a', '_moi_test_grp:ended',
+                    '_moi_test_grp:children', '_moi_test_grp:counts'],
+            [self.statuses, '0', json.dumps({'status': '"Success"'}), 100,
+             '"Success"', 7.0, 'msg'])
+        self.assertEqual(r_client.hmget('_moi_test_grp:counts', 'Queued',
+                                        'Success'), ['1', None])
+        self.assertEqual(r_client.zscore('_moi_test_grp:ended',
+                                         '_moi_test_a'), None)
+
+    def test_write_legacy(self):
+        r_client.set('_moi_test_a', '{"status": "Queued"}')
+        with self.assertRaises(ResponseError):
+            run(WRITE, ['_moi_test_a', '_moi_test_a', '_moi_test_a'],
+                [self.statuses, '0', '{}', 100, '', '', 'msg'])
+        self.assertEqual(r_client.type('_moi_test_a'), 'string')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+# -----------------------------------------------------------------------------
+# Copyright (c) 2014--, The qiita Development Team.
+#
+# Distributed under the terms of the BSD 3-clause License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# -----------------------------------------------------------------------------
+
+from unittest import TestCase, main
+
+from moi import r_client
+from moi import record
+from moi.summary import (bucket, ancestors, count, get_summary,
+                         get_summaries, _ancestors)
+
+
+class SummaryTests(TestCase):
+    def setUp(self):
+        record.store({'id': '_moi_test_top', 'type': 'group',
+                      'parent': None})
+        record.store({'id': '_moi_test_sub', 'type': 'group',
+                      'parent': '_moi_test_top'})
+        self.to_delete = ['_moi_test_top', '_moi_test_sub',
+                          '_moi_test_top:counts', '_moi_test_sub:counts']
+        _ancestors.clear()
+
+    def tearDown(self):
+        for key in self.to_delete:
+            r_client.delete(key)
+
+    def test_bucket(self):
+        self.assertEqual(bucket('Queued'), 'Queued')
+        self.assertEqual(bucket('Failed'), 'Failed')
+        self.assertEqual(bucket('half way there'), 'Running')
+        self.assertEqual(bucket(None), None)
+
+    def test_ancestors(self):
+        self.assertEqual(ancestors(None), [])
+        self.assertEqual(ancestors('_moi_test_sub'),
+                         ['_moi_test_sub', '_moi_test_top'])
+        self.assertEqual(ancestors('_moi_test_missing'),
+                         ['_moi_test_missing'])
+        self.assertNotIn('_moi_test_missing', _ancestors)
+
+    def test_ancestors_cycle(self):
+        record.store({'id': '_moi_test_top', 'type': 'group',
+                      'parent': '_moi_test_sub'})
+        self.assertEqual(ancestors('_moi_test_sub'),
+                         ['_moi_test_sub', '_moi_test_top'])
+
+    def test_count(self):
+        with r_client.pipeline() as pipe:
+            count(pipe, '_moi_test_sub', None, 'Queued', 3)
+            count(pipe, '_moi_test_sub', 'Queued', 'my custom status')
+            count(pipe, '_moi_test_sub', 'Running', 'still running')
+            count(pipe, '_moi_test_top', None, 'Queued')
+            pipe.execute()
+
+        self.assertEqual(get_summary('_moi_test_sub'),
+                         {'Queued': 2, 'Running': 1, 'Success': 0,
+                          'Failed': 0, 'Blocked': 0})
+        self.assertEqual(get_summary('_moi_test_top'),
+                         {'Queued': 3, 'Running': 1, 'Success': 0,
+                          'Failed': 0, 'Blocked': 0})
+        self.assertTrue(r_client.ttl('_moi_test_top:counts') > 0)
+
+        with r_client.pipeline() as pipe:
+            count(pipe, '_moi_test_sub', 'Queued', None, 2)
+            pipe.execute()
+        self.assertEqual(get_summary('_moi_test_sub')['Queued'], 0)
+
+    def test_get_summaries(self):
+        exp = {'Queued': 0, 'Running': 0, 'Success': 0, 'Failed': 0,
+               'Blocked': 0}
+        self.assertEqual(get_summaries(['_moi_test_top', '_moi_test_x']),
+                         [exp, exp])
+        self.assertEqual(get_summaries([]), [])
+
+
+if __name__ == '__main__':
+    main()
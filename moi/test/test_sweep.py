@@ -0,0 +1,137 @@
+# -----------------------------------------------------------------------------
+# Copyright (c) 2014--, The qiita Development Team.
+#
+# Distributed under the terms of the BSD 3-clause License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# -----------------------------------------------------------------------------
+
+import os
+from shutil import rmtree
+from tempfile import mkdtemp
+from unittest import TestCase, main
+
+from mock import patch
+
+import moi
+from moi import r_client
+from moi import record
+from moi.group import _add_children
+from moi.sweep import Sweeper, start
+
+
+class SweepTests(TestCase):
+    def setUp(self):
+        record.store({'id': '_moi_test_grp', 'type': 'group',
+                      'parent': None})
+        record.store({'id': '_moi_test_a', 'type': 'job',
+                      'parent': '_moi_test_grp', 'status': 'Queued'})
+        with r_client.pipeline() as pipe:
+            _add_children(pipe, '_moi_test_grp',
+                          ['_moi_test_a', '_moi_test_b'])
+            pipe.hincrby('_moi_test_grp:counts', 'Queued', 2)
+            pipe.execute()
+
+        self.to_delete = ['_moi_test_grp', '_moi_test_a',
+                          '_moi_test_grp:children', '_moi_test_grp:created',
+                          '_moi_test_grp:ended', '_moi_test_grp:counts']
+
+    def tearDown(self):
+        for key in self.to_delete:
+            r_client.delete(key)
+
+    def test_init_invalid(self):
+        with self.assertRaises(ValueError):
+            Sweeper(0)
+
+    def test_sweep(self):
+        sweeper = Sweeper(count=1)
+        stats = sweeper.sweep()
+        self.assertGreaterEqual(stats['groups'], 1)
+        self.assertGreaterEqual(stats['children'], 1)
+        self.assertEqual(sweeper.passes, 1)
+        self.assertEqual(sweeper.cursor, 0)
+
+        self.assertEqual(r_client.smembers('_moi_test_grp:children'),
+                         {'_moi_test_a'})
+        self.assertEqual(r_client.zrange('_moi_test_grp:created', 0, -1),
+                         ['_moi_test_a'])
+        self.assertEqual(r_client.ttl('_moi_test_grp'), None)
+
+        # the expired child is no longer counted
+        self.assertEqual(r_client.hget('_moi_test_grp:counts', 'Queued'), '1')
+
+    def test_sweep_nested_counts(self):
+        record.store({'id': '_moi_test_sub', 'type': 'group',
+                      'parent': '_moi_test_grp'})
+        record.store({'id': '_moi_test_c', 'type': 'job',
+                      'parent': '_moi_test_sub', 'status': 'Success'})
+        with r_client.pipeline() as pipe:
+            _add_children(pipe, '_moi_test_grp', ['_moi_test_sub'])
+            _add_children(pipe, '_moi_test_sub',
+                          ['_moi_test_c', '_moi_test_d'])
+            pipe.hincrby('_moi_test_grp:counts', 'Success', 2)
+            pipe.hincrby('_moi_test_sub:counts', 'Success', 2)
+            pipe.execute()
+        self.to_delete.extend(['_moi_test_sub', '_moi_test_c',
+                               '_moi_test_sub:children',
+                               '_moi_test_sub:created',
+                               '_moi_test_sub:counts'])
+
+        Sweeper().sweep()
+
+        # the groups containing an expired job no longer count it
+        self.assertEqual(r_client.hget('_moi_test_sub:counts', 'Success'),
+                         '1')
+        self.assertEqual(r_client.hgetall('_moi_test_grp:counts'),
+                         {'Queued': '1', 'Success': '1'})
+
+    def test_sweep_recount_deferred(self):
+        sweeper = Sweeper()
+        with patch.object(sweeper, '_recount', return_value=False):
+            sweeper.sweep()
+        self.assertIn('_moi_test_grp', sweeper._stale)
+        self.assertEqual(r_client.hget('_moi_test_grp:counts', 'Queued'), '2')
+
+        # the counts are rebuilt on the next pass
+        sweeper.sweep()
+        self.assertNotIn('_moi_test_grp', sweeper._stale)
+        self.assertEqual(r_client.hget('_moi_test_grp:counts', 'Queued'), '1')
+
+    def test_sweep_empty_group(self):
+        r_client.delete('_moi_test_a')
+        stats = Sweeper().sweep()
+        self.assertGreaterEqual(stats['expired'], 1)
+
+        self.assertFalse(r_client.exists('_moi_test_grp:children'))
+        self.assertFalse(r_client.exists('_moi_test_grp:created'))
+        self.assertFalse(r_client.exists('_moi_test_grp:counts'))
+        self.assertTrue(0 < r_client.ttl('_moi_test_grp') <=
+                        moi.REDIS_KEY_TIMEOUT)
+
+    def test_sweep_files(self):
+        directory = mkdtemp()
+        self.addCleanup(rmtree, directory)
+        self.addCleanup(setattr, moi, 'result_directory',
+                        moi.result_directory)
+        moi.result_directory = directory
+
+        for name in ('_moi_test_a', '_moi_test_b', '.tmp-foo'):
+            with open(os.path.join(directory, name), 'wb') as f:
+                f.write(b'[1]')
+
+        stats = Sweeper().sweep()
+        self.assertEqual(stats['files'], 1)
+        self.assertEqual(sorted(os.listdir(directory)),
+                         ['.tmp-foo', '_moi_test_a'])
+
+    def test_start(self):
+        self.assertEqual(start(interval=0), None)
+
+        callback = start(interval=1)
+        self.addCleanup(callback.stop)
+        self.assertEqual(callback.callback_time, 1000)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,48 @@
+# -----------------------------------------------------------------------------
+# Copyright (c) 2014--, The qiita Development Team.
+#
+# Distributed under the terms of the BSD 3-clause License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# -----------------------------------------------------------------------------
+
+from unittest import TestCase, main
+
+from moi.websocket import UpdateBuffer
+
+
+class UpdateBufferTests(TestCase):
+    def setUp(self):
+        self.obj = UpdateBuffer()
+
+    def test_add(self):
+        self.obj.add({'add': {'id': 'a', 'status': 'Queued'}})
+        self.obj.add({'update': {'id': 'a', 'status': 'Running'}})
+        self.obj.add({'update': {'id': 'b', 'status': 'Running'}})
+        self.obj.add({'update': {'id': 'a', 'status': 'Success'}})
+        self.obj.add({'remove': {'id': 'b'}})
+        self.obj.add({'remove': {'id': 'b'}})
+
+        self.assertEqual(len(self.obj), 5)
+        self.assertEqual(self.obj.drain(), [
+            {'add': {'id': 'a', 'status': 'Queued'}},
+            {'update': {'id': 'a', 'status': 'Success'}},
+            {'update': {'id': 'b', 'status': 'Running'}},
+            {'remove': {'id': 'b'}},
+            {'remove': {'id': 'b'}}])
+
+    def test_add_not_collapsible(self):
+        self.obj.add({'update': 'a'})
+        self.obj.add({'update': 'a'})
+        self.assertEqual(self.obj.drain(), [{'update': 'a'}, {'update': 'a'}])
+
+    def test_drain(self):
+        self.assertEqual(self.obj.drain(), [])
+        self.obj.add({'get': {'id': 'a'}})
+        self.assertEqual(self.obj.drain(), [{'get': {'id': 'a'}}])
+        self.assertEqual(len(self.obj), 0)
+        self.assertEqual(self.obj.drain(), [])
+
+
+if __name__ == '__main__':
+    main()
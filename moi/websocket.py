@@ -6,20 +6,82 @@
 # The full license is in the file LICENSE, distributed with this software.
 # -----------------------------------------------------------------------------
 
+from time import time
+from collections import OrderedDict
+from itertools import count
+
 from tornado.web import authenticated
 from tornado.websocket import WebSocketHandler
 from tornado.escape import json_encode, json_decode
+from tornado.ioloop import IOLoop
 
+import moi
 from moi.group import Group, get_id_from_user
 
 clients = set()
 
 
+class UpdateBuffer(object):
+    """Collect messages to send, collapsing updates to the same job
+
+    Messages are kept in the order they are added. An "update" to a job
+    which already has a pending update replaces the pending update, in its
+    original position, so only the latest update of a job is sent. All other
+    messages are kept as is.
+    """
+    def __init__(self):
+        self._pending = OrderedDict()
+        self._counter = count()
+
+    def __len__(self):
+        return len(self._pending)
+
+    def add(self, item):
+        """Add a message
+
+        Parameters
+        ----------
+        item : dict
+            A message of the form {verb: details}
+        """
+        if len(item) == 1 and 'update' in item:
+            details = item['update']
+            if isinstance(details, dict) and 'id' in details:
+                self._pending[('update', details['id'])] = item
+                return
+
+        self._pending[next(self._counter)] = item
+
+    def drain(self):
+        """Remove and return all pending messages
+
+        Returns
+        -------
+        list of dict
+            The pending messages, in order
+        """
+        items = list(self._pending.values())
+        self._pending.clear()
+        return items
+
+
 # adapted from
 # https://github.com/leporo/tornado-redis/blob/master/demos/websockets
 class MOIMessageHandler(WebSocketHandler):
+    """Relay job and group information over a websocket
+
+    Messages forwarded from the group are buffered for ``flush_interval``
+    seconds, during which updates to the same job collapse to the latest
+    one. The buffered messages are then written as a single frame, which is
+    a JSON array if more than one message is pending. If ``flush_interval``
+    is None, the ``flush_interval`` of the configuration is used.
+    """
+    flush_interval = None
+
     def __init__(self, *args, **kwargs):
         super(MOIMessageHandler, self).__init__(*args, **kwargs)
+        self._buffer = UpdateBuffer()
+        self._flush_scheduled = False
         self.group = Group(self.get_current_user(), forwarder=self.forward)
 
     def get_current_user(self):
@@ -66,6 +128,40 @@ class MOIMessageHandler(WebSocketHandler):
             self.group.action(verb, args)
 
     def forward(self, payload):
-        if self in clients:
-            for item in payload:
-                self.write_message(json_encode(item))
+        """Buffer messages to send, and schedule a flush
+
+        Parameters
+        ----------
+        payload : iterable of dict
+            The messages to send
+        """
+        if self not in clients:
+            return
+
+        for item in payload:
+            self._buffer.add(item)
+
+        if self._buffer and not self._flush_scheduled:
+            self._flush_scheduled = True
+            io_loop = IOLoop.current()
+            interval = self.flush_interval
+            if interval is None:
+                interval = moi.flush_interval
+
+            if interval > 0:
+                io_loop.add_timeout(time() + interval, self.flush)
+            else:
+                io_loop.add_callback(self.flush)
+
+    def flush(self):
+        """Write all buffered messages as a single frame"""
+        self._flush_scheduled = False
+        items = self._buffer.drain()
+
+        if self not in clients or not items:
+            return
+
+        if len(items) == 1:
+            self.write_message(json_encode(items[0]))
+        else:
+            self.write_message(json_encode(items))
@@ -47,8 +47,11 @@ setup(name='moi',
       url='http://github.com/biocore/mustached-octo-ironman',
       test_suite='nose.collector',
       packages=['moi'],
-      extras_require={'test': ["nose >= 0.10.1", "pep8", 'mock']},
-      install_requires=['future', 'tornado==3.1.1', 'toredis', 'redis',
+      extras_require={'test': ["nose >= 0.10.1", "pep8", 'mock'],
+                      'msgpack': ['msgpack'],
+                      'lz4': ['lz4'],
+                      'numpy': ['numpy']},
+      install_requires=['future', 'tornado==3.1.1', 'toredis', 'redis<3',
                         'ipython[all]==2.4.1', 'click >= 3.3',
                         'python-dateutil==2.2'],
       classifiers=classifiers,